@@ -0,0 +1,552 @@
+#!/usr/bin/env python
+
+"""Benchmarks for dependency_viz.
+
+Usage: benchmark_dependency_viz.py [--objects N] [--jobs 1,2,4,8] [--batch-size N]
+                                   [--vertexes N] [--edges-per-vertex N] [BENCHMARK ...]
+
+'stages' and 'corpus' benchmarks time every processing stage separately on a
+synthetic graph and on compiled object files.  Their results can be saved with
+--json and compared with an earlier run with --compare:
+
+  benchmark_dependency_viz.py stages corpus --json before.json
+  benchmark_dependency_viz.py stages corpus --compare before.json
+"""
+
+import argparse
+import collections
+import json
+import multiprocessing
+import os
+import random
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from dependency_viz import *
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+def generate_object_files(directory, count, symbols_per_file=20):
+    """Compiles `count` C files where each function calls functions from the next file."""
+    objects = []
+    for index in range(count):
+        source_path = os.path.join(directory, "file%d.c" % index)
+        object_path = os.path.join(directory, "file%d.o" % index)
+        next_index = (index + 1) % count
+        lines = []
+        for symbol in range(symbols_per_file):
+            lines.append("extern int f%d_%d(void);" % (next_index, symbol))
+        for symbol in range(symbols_per_file):
+            lines.append("int f%d_%d(void) { return f%d_%d(); }" % (index, symbol, next_index, symbol))
+        with open(source_path, "w") as f:
+            f.write("\n".join(lines) + "\n")
+        subprocess.check_call(["cc", "-c", "-o", object_path, source_path])
+        objects.append(object_path)
+    return objects
+
+def deep_sizeof(obj, seen=None):
+    """Approximate memory used by obj and everything it references."""
+    if seen is None:
+        seen = set()
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(deep_sizeof(key, seen) + deep_sizeof(value, seen) for key, value in obj.iteritems())
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        size += sum(deep_sizeof(item, seen) for item in obj)
+    elif hasattr(obj, "__dict__"):
+        size += deep_sizeof(obj.__dict__, seen)
+    elif hasattr(obj, "__slots__"):
+        size += sum(deep_sizeof(getattr(obj, name), seen) for name in obj.__slots__)
+    return size
+
+def allocated_memory(function, shared_objects=()):
+    """Returns (result, bytes) allocated by function.  Uses tracemalloc where
+    available, otherwise deep_sizeof of the result without shared_objects."""
+    if tracemalloc is not None:
+        tracemalloc.start()
+        try:
+            before = tracemalloc.get_traced_memory()[0]
+            result = function()
+            return result, tracemalloc.get_traced_memory()[0] - before
+        finally:
+            tracemalloc.stop()
+    result = function()
+    seen = set()
+    for obj in shared_objects:
+        deep_sizeof(obj, seen)
+    return result, deep_sizeof(result, seen)
+
+def random_graph(vertex_count, edges_per_vertex, seed=0, compact=False):
+    """Random graph where edges mostly point to vertexes with bigger index,
+    with a few back edges to create cycles."""
+    return random_graph_builder(vertex_count, edges_per_vertex, seed).build_graph(compact)
+
+def random_graph_builder(vertex_count, edges_per_vertex, seed=0):
+    rng = random.Random(seed)
+    builder = DirectedGraph.Builder()
+    for vertex in range(vertex_count):
+        builder.add_vertex("v%d" % vertex)
+        for _ in range(edges_per_vertex):
+            if rng.random() < 0.05:
+                to_vertex = rng.randrange(vertex_count)
+            else:
+                to_vertex = min(vertex_count - 1, vertex + 1 + int(rng.expovariate(0.01)))
+            builder.add_edge_with_label("v%d" % vertex, "v%d" % to_vertex, "_symbol%d" % rng.randrange(1000))
+    return builder
+
+def synthetic_graph_builder(vertex_count, edges_per_vertex, depth, cycle_count=0, cycle_size=3,
+        symbols_per_vertex=4, seed=0):
+    """Link graph of `depth` layers where files depend on files in deeper
+    layers, so the longest dependency chain has `depth` - 1 edges.  Every file
+    has about `edges_per_vertex` dependencies.  `cycle_count` rings of
+    `cycle_size` random files add dependency cycles.  Edge labels are names
+    of `symbols_per_vertex` functions defined by destination file."""
+    rng = random.Random(seed)
+    depth = max(1, min(depth, vertex_count))
+    layers = [[] for _ in range(depth)]
+    for vertex in range(vertex_count):
+        layers[vertex * depth // vertex_count].append("v%d" % vertex)
+    builder = DirectedGraph.Builder()
+    def add_edge(from_vertex, to_vertex):
+        builder.add_edge_with_label(from_vertex, to_vertex,
+            "f%s_%d" % (to_vertex[1:], rng.randrange(symbols_per_vertex)))
+    for layer_index, layer in enumerate(layers):
+        for vertex in layer:
+            builder.add_vertex(vertex)
+            if layer_index + 1 == depth:
+                continue
+            # One dependency on the next layer keeps chains `depth` long.
+            add_edge(vertex, rng.choice(layers[layer_index + 1]))
+            for _ in range(edges_per_vertex - 1):
+                add_edge(vertex, rng.choice(layers[rng.randrange(layer_index + 1, depth)]))
+    for _ in range(cycle_count):
+        ring = rng.sample(range(vertex_count), min(cycle_size, vertex_count))
+        for index, vertex in enumerate(ring):
+            add_edge("v%d" % vertex, "v%d" % ring[(index + 1) % len(ring)])
+    return builder
+
+def generate_object_corpus(directory, builder, flags=[]):
+    """Compiles a C file for every graph vertex.  A file defines functions
+    named like labels of edges to it and calls functions named like labels
+    of edges from it.  Returns object file paths."""
+    defined = collections.defaultdict(set)
+    for from_vertex, destinations in builder._edges.iteritems():
+        for to_vertex, label in destinations:
+            defined[to_vertex].add(label)
+    objects = []
+    for vertex in sorted(builder._edges.keys()):
+        called = sorted(set(label for _, label in builder._edges[vertex]))
+        lines = ["extern int %s(void);" % label for label in called]
+        lines.extend("int %s(void) { return %d; }" % (label, index)
+            for index, label in enumerate(sorted(defined[vertex])))
+        lines.append("int use_%s(void) { return 0%s; }" % (vertex, "".join(" + %s()" % label for label in called)))
+        source_path = os.path.join(directory, "%s.c" % vertex)
+        object_path = os.path.join(directory, "%s.o" % vertex)
+        with open(source_path, "w") as f:
+            f.write("\n".join(lines) + "\n")
+        subprocess.check_call(["cc", "-c", "-o", object_path, source_path] + flags)
+        objects.append(object_path)
+    return objects
+
+def chain_graph(depth):
+    builder = DirectedGraph.Builder()
+    for vertex in range(depth):
+        builder.add_edge_with_label("v%d" % vertex, "v%d" % (vertex + 1), "_symbol%d" % vertex)
+    return builder.build_graph()
+
+def legacy_reachable_vertexes(graph, from_vertex, visited=None):
+    """Recursive depth-first traversal used by dependency_viz before breadth-first one."""
+    if visited is None:
+        visited = set()
+    visited.add(from_vertex)
+    reachable = dict()
+    for to_vertex, edge_labels in graph._destinations(from_vertex).iteritems():
+        if to_vertex in visited:
+            continue
+        new_path_item = PathItem(to_vertex, from_vertex, 1, edge_labels)
+        current_path_item = reachable.get(to_vertex)
+        if (current_path_item is None) or (new_path_item.distance < current_path_item.distance):
+            reachable[to_vertex] = new_path_item
+        transitive_reachable = legacy_reachable_vertexes(graph, to_vertex, visited)
+        for reachable_vertex, reachable_path_item in transitive_reachable.iteritems():
+            current_path_item = reachable.get(reachable_vertex)
+            if (current_path_item is None) or (reachable_path_item.distance + 1 < current_path_item.distance):
+                reachable[reachable_vertex] = PathItem(reachable_vertex,
+                    reachable_path_item.prev_vertex,
+                    reachable_path_item.distance + 1,
+                    reachable_path_item.edge_labels)
+    return reachable
+
+def timed(function, *args, **kwargs):
+    start = time.time()
+    result = function(*args, **kwargs)
+    return time.time() - start, result
+
+def peak_memory():
+    """Returns the largest resident set size of this process so far in bytes."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, OS X reports bytes.
+    return peak if sys.platform == "darwin" else peak * 1024
+
+def traced_peak_memory(function):
+    """Returns (result, bytes) of the largest tracemalloc-traced memory
+    function allocated above what was allocated when it started."""
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        result = function()
+        return result, tracemalloc.get_traced_memory()[1] - before
+    finally:
+        tracemalloc.stop()
+
+class StageTimer:
+    """Runs benchmark stages and collects {stage: {"seconds", "stage_memory",
+    "memory_source", "process_peak_memory"}}.  Every stage runs `repeat`
+    times and the fastest run is reported.
+
+    stage_memory is the stage's own peak: tracemalloc peak above the memory
+    allocated at stage start, measured in an extra run because tracing slows
+    the stage down.  Without tracemalloc it's how much the stage raised the
+    process resident set high-water mark, 0 if the stage stayed below an
+    earlier peak.  process_peak_memory is that high-water mark after stage."""
+    def __init__(self, repeat=1):
+        self.repeat = repeat
+        # How many times each stage function is called.
+        self.runs = repeat + (1 if tracemalloc is not None else 0)
+        self.stages = collections.OrderedDict()
+
+    def run(self, stage, function, *args, **kwargs):
+        best_time = None
+        peak_before = peak_memory()
+        for _ in range(self.repeat):
+            elapsed, result = timed(function, *args, **kwargs)
+            best_time = elapsed if best_time is None else min(best_time, elapsed)
+        process_peak = peak_memory()
+        if tracemalloc is not None:
+            _, stage_memory = traced_peak_memory(lambda: function(*args, **kwargs))
+            memory_source = "tracemalloc"
+        else:
+            stage_memory = process_peak - peak_before
+            memory_source = "max_rss_growth"
+        self.stages[stage] = {"seconds": best_time, "stage_memory": stage_memory,
+            "memory_source": memory_source, "process_peak_memory": process_peak}
+        print("%-24s %8.3fs  stage %7.1f MB (%s)  process high-water %7.1f MB" % (stage, best_time,
+            stage_memory / 1e6, memory_source, process_peak / 1e6))
+        return result
+
+def time_graph_stages(timer, dependencies):
+    graph = dependencies._dependency_graph
+    timer.run("all_dependencies", lambda: Dependencies.from_graph(graph)._all_dependencies_dict(True))
+    half = frozenset(sorted(graph.vertexes())[::2])
+    timer.run("subgraph", graph.subgraph, half)
+    timer.run("reversed_graph", graph.reversed_graph)
+    dot_file = tempfile.NamedTemporaryFile(suffix=".dot", delete=False)
+    dot_file.close()
+    try:
+        timer.run("write_dot_file", graph.write_dot_file, dot_file.name, True)
+    finally:
+        os.remove(dot_file.name)
+
+def benchmark_stages(parameters, repeat):
+    timer = StageTimer(repeat)
+    builder = timer.run("generate_graph", synthetic_graph_builder, parameters["vertexes"],
+        parameters["edges_per_vertex"], parameters["depth"], parameters["cycles"], parameters["cycle_size"])
+    graph = timer.run("build_graph", builder.build_graph, parameters["compact"])
+    time_graph_stages(timer, Dependencies.from_graph(graph))
+    return timer.stages
+
+def benchmark_corpus(parameters, repeat):
+    """Times symbol extraction and Dependencies construction on compiled
+    files.  ELF functions are 'T' symbols, which dependency_viz doesn't treat
+    as definitions yet, so graph stages are timed on synthetic graphs only."""
+    timer = StageTimer(repeat)
+    builder = synthetic_graph_builder(parameters["objects"], parameters["edges_per_vertex"],
+        parameters["depth"], parameters["cycles"], parameters["cycle_size"])
+    directory = tempfile.mkdtemp()
+    try:
+        objects = generate_object_corpus(directory, builder)
+        timer.run("global_symbols", collect_global_symbols, objects)
+        timer.run("global_symbols_nm", collect_global_symbols, objects, parameters["jobs"],
+            parameters["batch_size"], use_nm=True)
+        link_file_list = os.path.join(directory, "link_file_list")
+        with open(link_file_list, "w") as f:
+            f.write("\n".join(objects) + "\n")
+        # Symbols come from a warm cache, so this measures mostly graph build.
+        cache_filename = os.path.join(directory, "symbols.cache")
+        Dependencies(link_file_list, cache_filename=cache_filename)
+        instrumentation = Instrumentation()
+        timer.run("build_dependencies", Dependencies, link_file_list,
+            cache_filename=cache_filename, compact_graph=parameters["compact"], instrumentation=instrumentation)
+        for stage, seconds in instrumentation.timings.iteritems():
+            # Instrumentation doesn't measure memory of nested stages.
+            timer.stages["build_dependencies/" + stage] = {"seconds": seconds / timer.runs}
+    finally:
+        shutil.rmtree(directory)
+    return timer.stages
+
+# Differences below it are timer noise rather than regressions.
+MIN_REGRESSION_SECONDS = 0.01
+
+def compare_results(baseline, results, threshold):
+    """Prints stage time ratios of results to baseline and returns number of
+    stages which got slower by more than `threshold` fraction."""
+    regressions = 0
+    for benchmark, result in results["benchmarks"].iteritems():
+        baseline_result = baseline["benchmarks"].get(benchmark)
+        if baseline_result is None:
+            continue
+        if baseline_result["parameters"] != result["parameters"]:
+            print("%s: parameters differ from baseline" % benchmark)
+        print("%s compared to baseline" % benchmark)
+        for stage, timing in result["stages"].iteritems():
+            baseline_timing = baseline_result["stages"].get(stage)
+            if baseline_timing is None:
+                continue
+            ratio = timing["seconds"] / max(baseline_timing["seconds"], 1e-9)
+            is_regression = ((ratio > 1 + threshold) and
+                (timing["seconds"] - baseline_timing["seconds"] > MIN_REGRESSION_SECONDS))
+            regressions += is_regression
+            print("%-24s %8.3fs -> %8.3fs  x%.2f%s" % (stage, baseline_timing["seconds"], timing["seconds"],
+                ratio, "  SLOWER" if is_regression else ""))
+    return regressions
+
+def benchmark_symbol_extraction(objects, jobs_list, batch_size):
+    baseline_time, baseline = timed(collect_global_symbols, objects, use_nm=True)
+    print("%-24s %8.3fs" % ("nm, serial, unbatched", baseline_time))
+    for jobs in jobs_list:
+        elapsed, result = timed(collect_global_symbols, objects, jobs, batch_size, use_nm=True)
+        assert result == baseline
+        print("%-24s %8.3fs  x%.1f" % ("nm, jobs=%d, batch=%d" % (jobs, batch_size),
+            elapsed, baseline_time / elapsed))
+    elapsed, result = timed(collect_global_symbols, objects)
+    assert result == baseline
+    print("%-24s %8.3fs  x%.1f" % ("in-process reader", elapsed, baseline_time / elapsed))
+
+def nm_symbols(filename):
+    """Returns [(symbol_type, symbol_name)] from `nm -g` output."""
+    result = []
+    for line in subprocess.check_output(["nm", "-g", filename]).splitlines():
+        parts = line.split()
+        if (len(parts) >= 2) and not line.endswith(":"):
+            result.append((parts[-2], parts[-1]))
+    return result
+
+def benchmark_symbol_throughput(objects):
+    for name, read_symbols in [("nm", nm_symbols), ("in-process", object_file_symbols)]:
+        elapsed, symbols = timed(lambda: [read_symbols(f) for f in objects])
+        symbol_count = sum(len(file_symbols) for file_symbols in symbols)
+        print("%-24s %8.0f symbols/s" % (name, symbol_count / elapsed))
+
+def benchmark_symbol_cache(objects, directory):
+    cache_filename = os.path.join(directory, "symbols.cache")
+    for run in ["cold", "warm"]:
+        cache = SymbolCache(cache_filename)
+        elapsed, _ = timed(collect_global_symbols, objects, cache=cache)
+        cache.save()
+        print("%-24s %8.3fs" % ("%s cache" % run, elapsed))
+
+def timed_legacy_reachability(graph, sources):
+    """Returns (elapsed, results) or (None, None) if recursion limit is exceeded."""
+    try:
+        return timed(lambda: [legacy_reachable_vertexes(graph, v) for v in sources])
+    except RuntimeError:
+        return None, None
+
+def benchmark_reachability(vertex_count, edges_per_vertex):
+    graph = random_graph(vertex_count, edges_per_vertex)
+    sources = sorted(graph.vertexes())[:100]
+    legacy_time, legacy_results = timed_legacy_reachability(graph, sources)
+    bfs_time, bfs_results = timed(lambda: [graph.reachable_vertexes(v) for v in sources])
+    if legacy_time is not None:
+        longer_paths = 0
+        for legacy, bfs in zip(legacy_results, bfs_results):
+            assert set(legacy.keys()) == set(bfs.keys())
+            longer_paths += sum(1 for v in bfs if legacy[v].distance > bfs[v].distance)
+        print("%-24s %8.3fs" % ("recursive DFS", legacy_time))
+        print("%-24s %8.3fs  x%.1f" % ("iterative BFS", bfs_time, legacy_time / bfs_time))
+        print("%-24s %8d" % ("non-shortest DFS paths", longer_paths))
+    else:
+        print("%-24s %9s" % ("recursive DFS", "overflow"))
+        print("%-24s %8.3fs" % ("iterative BFS", bfs_time))
+    graph = chain_graph(100000)
+    legacy_time, _ = timed_legacy_reachability(graph, ["v0"])
+    if legacy_time is not None:
+        print("%-24s %8.3fs" % ("recursive DFS, chain", legacy_time))
+    else:
+        print("%-24s %9s" % ("recursive DFS, chain", "overflow"))
+    bfs_time, _ = timed(graph.reachable_vertexes, "v0")
+    print("%-24s %8.3fs" % ("iterative BFS, chain", bfs_time))
+
+def benchmark_closure(vertex_count, edges_per_vertex):
+    graph = random_graph(vertex_count, edges_per_vertex)
+    def bfs_counts():
+        reversed_graph = graph.reversed_graph()
+        return dict((v, (len(graph.reachable_vertexes(v)), len(reversed_graph.reachable_vertexes(v))))
+            for v in graph.vertexes())
+    def closure_counts():
+        required = TransitiveClosure(graph)
+        provided = TransitiveClosure(graph, reverse=True)
+        return dict((v, (required.reachable_count(v), provided.reachable_count(v)))
+            for v in graph.vertexes())
+    bfs_time, bfs_result = timed(bfs_counts)
+    closure_time, closure_result = timed(closure_counts)
+    assert bfs_result == closure_result
+    print("%-24s %8.3fs" % ("BFS from every vertex", bfs_time))
+    print("%-24s %8.3fs  x%.1f" % ("condensation closure", closure_time, bfs_time / closure_time))
+
+def benchmark_backends(vertex_count, edges_per_vertex):
+    builder = random_graph_builder(vertex_count, edges_per_vertex)
+    sources = sorted(builder._edges.keys())[:100]
+    for name, compact in [("dict", False), ("compact", True)]:
+        build_time, graph = timed(builder.build_graph, compact)
+        size = deep_sizeof(graph)
+        reversed_time, _ = timed(graph.reversed_graph)
+        subgraph_time, _ = timed(graph.subgraph, frozenset(sources))
+        bfs_time, _ = timed(lambda: [graph.reachable_vertexes(v) for v in sources])
+        print("%-8s %8.1f MB  build %.3fs  reversed %.3fs  subgraph %.3fs  BFS x%d %.3fs" % (name,
+            size / 1e6, build_time, reversed_time, subgraph_time, len(sources), bfs_time))
+
+def benchmark_cycles(vertex_count, edges_per_vertex):
+    graph = random_graph(vertex_count, edges_per_vertex, compact=True)
+    dependencies = Dependencies.from_graph(graph)
+    elapsed, cycles = timed(dependencies.strong_connected_components)
+    largest = cycles[0].size() if len(cycles) > 0 else 0
+    print("%-24s %8.3fs  %d cycles, largest %d files" % ("ranked cycles", elapsed, len(cycles), largest))
+    elapsed, _ = timed(dependencies.condensed_graph)
+    print("%-24s %8.3fs" % ("condensed graph", elapsed))
+
+def benchmark_path_memory(vertex_count, edges_per_vertex):
+    graph = random_graph(vertex_count, edges_per_vertex, compact=True)
+    sources = sorted(graph.vertexes())[:200]
+    graph._indexed()
+    for name, reachability in [("PathItem dicts", graph.reachable_vertexes),
+            ("reachability tables", graph.reachability_table)]:
+        start = time.time()
+        results, size = allocated_memory(lambda: [reachability(v) for v in sources], [graph])
+        elapsed = time.time() - start
+        reached = sum(len(result) for result in results)
+        print("%-24s %8.1f MB  %6.1f bytes/path  %.3fs" % (name, size / 1e6, float(size) / reached, elapsed))
+
+def benchmark_parallel_reachability(vertex_count, edges_per_vertex, jobs_list):
+    graph = random_graph(vertex_count, edges_per_vertex, compact=True)
+    graphs = [graph, graph.reversed_graph()]
+    base_time = None
+    for jobs in jobs_list:
+        elapsed, _ = timed(all_reachability_tables, graphs, jobs)
+        base_time = base_time or elapsed
+        print("%3d jobs %8.3fs  speedup x%.2f  efficiency %3.0f%%" % (jobs, elapsed,
+            base_time / elapsed, 100.0 * base_time / elapsed / jobs))
+
+def benchmark_views(vertex_count, edges_per_vertex):
+    for compact in [False, True]:
+        graph = random_graph(vertex_count, edges_per_vertex, compact=compact)
+        graph._indexed()
+        sub_vertexes = frozenset(sorted(graph.vertexes())[:vertex_count * 9 // 10])
+        source = sorted(sub_vertexes)[0]
+        for name, make_copy, make_view in [
+                ("subgraph", lambda: graph.subgraph(sub_vertexes), lambda: graph.subgraph_view(sub_vertexes)),
+                ("reversed", graph.reversed_graph, graph.reversed_view)]:
+            # Build the graph and traverse it once, views index themselves on first traversal.
+            copy_time, copy = timed(lambda: make_copy().reachability_table(source) and None)
+            view_time, view = timed(lambda: make_view().reachability_table(source) and None)
+            print("%-8s %-14s copy %.3fs  view %.3fs  x%.1f" % ("compact" if compact else "dict", name,
+                copy_time, view_time, copy_time / view_time))
+        dot_copy_time, _ = timed(lambda: graph.subgraph(sub_vertexes).write_dot(NullWriter(), True))
+        dot_view_time, _ = timed(lambda: graph.subgraph_view(sub_vertexes).write_dot(NullWriter(), True))
+        print("%-8s %-14s copy %.3fs  view %.3fs  x%.1f" % ("compact" if compact else "dict", "dump_subgraph",
+            dot_copy_time, dot_view_time, dot_copy_time / dot_view_time))
+
+class NullWriter:
+    def write(self, text):
+        pass
+
+BENCHMARKS = ["symbols", "reachability", "closure", "backends", "cycles", "memory", "parallel",
+    "stages", "corpus", "views"]
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks dependency_viz stages.")
+    parser.add_argument("benchmarks", nargs="*", metavar="BENCHMARK",
+        help="benchmarks to run: %s; all by default" % ", ".join(BENCHMARKS))
+    parser.add_argument("--objects", type=int, default=500, help="number of object files to generate")
+    parser.add_argument("--jobs", default="1,2,4,8", help="comma-separated worker counts")
+    parser.add_argument("--batch-size", type=int, default=64, help="files per nm invocation")
+    parser.add_argument("--vertexes", type=int, default=2000, help="synthetic graph size")
+    parser.add_argument("--edges-per-vertex", type=int, default=4, help="synthetic graph density")
+    parser.add_argument("--depth", type=int, default=20, help="synthetic graph longest chain")
+    parser.add_argument("--cycles", type=int, default=10, help="dependency cycles in synthetic graph")
+    parser.add_argument("--cycle-size", type=int, default=5, help="files in every cycle")
+    parser.add_argument("--compact", action="store_true", help="use CompactDirectedGraph")
+    parser.add_argument("--repeat", type=int, default=1, help="runs of every stage, the fastest is reported")
+    parser.add_argument("--json", metavar="FILE", help="write stage results as JSON")
+    parser.add_argument("--compare", metavar="FILE", help="compare stage results with earlier JSON results")
+    parser.add_argument("--threshold", type=float, default=0.1,
+        help="slowdown fraction which --compare reports as regression")
+    args = parser.parse_args()
+    for benchmark in args.benchmarks:
+        if benchmark not in BENCHMARKS:
+            parser.error("unknown benchmark %s" % benchmark)
+    args.benchmarks = args.benchmarks or BENCHMARKS
+    jobs_list = [int(jobs) for jobs in args.jobs.split(",")]
+    if "symbols" in args.benchmarks:
+        directory = tempfile.mkdtemp()
+        try:
+            objects = generate_object_files(directory, args.objects)
+            print("Symbol extraction, %d object files" % len(objects))
+            benchmark_symbol_extraction(objects, jobs_list, args.batch_size)
+            benchmark_symbol_throughput(objects)
+            benchmark_symbol_cache(objects, directory)
+        finally:
+            shutil.rmtree(directory)
+    if "reachability" in args.benchmarks:
+        print("Reachability, %d vertexes, %d edges per vertex" % (args.vertexes, args.edges_per_vertex))
+        benchmark_reachability(args.vertexes, args.edges_per_vertex)
+    if "closure" in args.benchmarks:
+        print("All-pairs counts, %d vertexes, %d edges per vertex" % (args.vertexes, args.edges_per_vertex))
+        benchmark_closure(args.vertexes, args.edges_per_vertex)
+    if "backends" in args.benchmarks:
+        print("Graph backends, %d vertexes, %d edges per vertex" % (args.vertexes, args.edges_per_vertex))
+        benchmark_backends(args.vertexes, args.edges_per_vertex)
+    if "cycles" in args.benchmarks:
+        print("Cycles, %d vertexes, %d edges per vertex" % (args.vertexes, args.edges_per_vertex))
+        benchmark_cycles(args.vertexes, args.edges_per_vertex)
+    if "memory" in args.benchmarks:
+        print("Path memory, %d vertexes, %d edges per vertex" % (args.vertexes, args.edges_per_vertex))
+        benchmark_path_memory(args.vertexes, args.edges_per_vertex)
+    if "parallel" in args.benchmarks:
+        print("All-pairs reachability tables, %d vertexes, %d edges per vertex, %d cores" % (
+            args.vertexes, args.edges_per_vertex, multiprocessing.cpu_count()))
+        benchmark_parallel_reachability(args.vertexes, args.edges_per_vertex, jobs_list)
+    if "views" in args.benchmarks:
+        print("Graph views, %d vertexes, %d edges per vertex" % (args.vertexes, args.edges_per_vertex))
+        benchmark_views(args.vertexes, args.edges_per_vertex)
+    parameters = {"vertexes": args.vertexes, "objects": args.objects, "edges_per_vertex": args.edges_per_vertex,
+        "depth": args.depth, "cycles": args.cycles, "cycle_size": args.cycle_size, "compact": args.compact,
+        "jobs": max(jobs_list), "batch_size": args.batch_size}
+    results = {"format": "dependency-viz-benchmark", "version": 1, "python": sys.version.split()[0],
+        "platform": sys.platform, "benchmarks": collections.OrderedDict()}
+    for name, benchmark, size in [("stages", benchmark_stages, "vertexes"), ("corpus", benchmark_corpus, "objects")]:
+        if name in args.benchmarks:
+            print("Stages, %s, %d files, %d edges per file, depth %d, %d cycles of %d" % (name, parameters[size],
+                args.edges_per_vertex, args.depth, args.cycles, args.cycle_size))
+            results["benchmarks"][name] = {"parameters": parameters, "stages": benchmark(parameters, args.repeat)}
+    if args.json is not None:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+    if args.compare is not None:
+        with open(args.compare, "r") as f:
+            baseline = json.load(f)
+        if compare_results(baseline, results, args.threshold) > 0:
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
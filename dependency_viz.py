@@ -1,10 +1,34 @@
 #!/usr/bin/env python
 
+import array
+import bisect
 import collections
+import contextlib
+import fnmatch
+import functools
+import gzip
+import hashlib
+import heapq
+import itertools
+import json
+import logging
+import marshal
+import mmap
 import re
+import shlex
+import socket
+import SocketServer
+import stat
+import StringIO
+import struct
 import subprocess
 import os, sys
-from operator import attrgetter, methodcaller
+import threading
+import time
+import zlib
+import multiprocessing
+from multiprocessing.pool import ThreadPool
+from operator import attrgetter
 
 DEFINED_SYMBOL_TYPE = 'S'
 UNDEFINED_SYMBOL_TYPE = 'U'
@@ -20,8 +44,286 @@ def parse_symbol_string(symbol_string):
             return symbol_type, symbol_name
     return UNKNOWN_SYMBOL_TYPE, None
 
-def global_symbols(filename):
-    """Returns tuple of lists - (defined_symbols, undefined_symbols)."""
+ARCHIVE_MAGIC = "!<arch>\n"
+
+def is_archive(filename):
+    with open(filename, "rb") as f:
+        return f.read(len(ARCHIVE_MAGIC)) == ARCHIVE_MAGIC
+
+class UnsupportedObjectFile(Exception):
+    """Raised when in-process reader doesn't support object file format."""
+    pass
+
+def _c_string(data, offset, end):
+    terminator = data.find("\0", offset, end)
+    if terminator == -1:
+        raise UnsupportedObjectFile("Unterminated string")
+    return data[offset:terminator]
+
+# ELF constants.
+_ELF_MAGIC = "\x7fELF"
+_SHT_SYMTAB = 2
+_SHT_NOBITS = 8
+_SHF_WRITE = 0x1
+_SHF_ALLOC = 0x2
+_SHF_EXECINSTR = 0x4
+_SHN_UNDEF = 0
+_SHN_LORESERVE = 0xff00
+_SHN_ABS = 0xfff1
+_SHN_COMMON = 0xfff2
+_STB_GLOBAL = 1
+_STB_WEAK = 2
+_STB_GNU_UNIQUE = 10
+_STT_OBJECT = 1
+_STT_GNU_IFUNC = 10
+# MSVC section names GNU nm recognizes before looking at section flags.
+_NM_SECTION_TYPES = [(".drectve", "i"), (".edata", "e"), (".idata", "i"), (".pdata", "p")]
+
+def _elf_section_type(section_name, section_type, section_flags):
+    """Returns nm symbol type letter for a symbol defined in ELF section."""
+    for prefix, symbol_type in _NM_SECTION_TYPES:
+        if section_name.startswith(prefix) and section_name[len(prefix):len(prefix) + 1] in ".$0123456789":
+            return symbol_type
+    has_contents = section_type != _SHT_NOBITS
+    is_readonly = (section_flags & _SHF_WRITE) == 0
+    if section_flags & _SHF_EXECINSTR:
+        return "t"
+    if (section_flags & _SHF_ALLOC) and has_contents:
+        return "r" if is_readonly else "d"
+    if not has_contents:
+        return "b"
+    if section_name.startswith((".debug", ".zdebug", ".gnu.linkonce.wi.", ".line", ".stab")):
+        return "N"
+    if is_readonly:
+        return "n"
+    return "?"
+
+def _elf_symbols(data, start, end):
+    elf_class = ord(data[start + 4])
+    elf_data = ord(data[start + 5])
+    if (elf_class not in (1, 2)) or (elf_data not in (1, 2)):
+        raise UnsupportedObjectFile("Unknown ELF class or data encoding")
+    endian = "<" if elf_data == 1 else ">"
+    if elf_class == 2:
+        header_format, section_format, symbol_format = "16sHHIQQQIHHHHHH", "IIQQQQIIQQ", "IBBHQQ"
+    else:
+        header_format, section_format, symbol_format = "16sHHIIIIIHHHHHH", "IIIIIIIIII", "IIIBBH"
+    header = struct.unpack_from(endian + header_format, data, start)
+    section_offset, section_size, section_count, names_index = header[6], header[11], header[12], header[13]
+    if section_offset == 0:
+        return []
+    section_struct = struct.Struct(endian + section_format)
+    def section(index):
+        name, section_type, flags, _, offset, size, link, _, _, entry_size = section_struct.unpack_from(
+            data, start + section_offset + index * section_size)
+        return name, section_type, flags, offset, size, link, entry_size
+    if section_count == 0:
+        # Real section count is in the first section header size.
+        section_count = section(0)[4]
+    sections = [section(index) for index in xrange(section_count)]
+    names_offset = start + sections[names_index][3]
+    section_names = [_c_string(data, names_offset + s[0], end) for s in sections]
+    result = []
+    symbol_struct = struct.Struct(endian + symbol_format)
+    for symbol_table in sections:
+        if symbol_table[1] != _SHT_SYMTAB:
+            continue
+        _, _, _, symbols_offset, symbols_size, strings_index, entry_size = symbol_table
+        strings_offset = start + sections[strings_index][3]
+        # Symbol 0 is reserved null symbol.
+        for symbol_offset in xrange(start + symbols_offset + entry_size,
+                start + symbols_offset + symbols_size, entry_size):
+            fields = symbol_struct.unpack_from(data, symbol_offset)
+            if elf_class == 2:
+                name_offset, info, _, section_index = fields[0], fields[1], fields[2], fields[3]
+            else:
+                name_offset, info, _, section_index = fields[0], fields[3], fields[4], fields[5]
+            binding = info >> 4
+            symbol_type = info & 0xf
+            if (binding not in (_STB_GLOBAL, _STB_WEAK, _STB_GNU_UNIQUE) and
+                    section_index not in (_SHN_UNDEF, _SHN_COMMON)):
+                continue
+            if section_index == _SHN_COMMON:
+                letter = "C"
+            elif section_index == _SHN_UNDEF:
+                if binding == _STB_WEAK:
+                    letter = "v" if symbol_type == _STT_OBJECT else "w"
+                else:
+                    letter = "U"
+            elif symbol_type == _STT_GNU_IFUNC:
+                letter = "i"
+            elif binding == _STB_WEAK:
+                letter = "V" if symbol_type == _STT_OBJECT else "W"
+            elif binding == _STB_GNU_UNIQUE:
+                letter = "u"
+            elif section_index == _SHN_ABS:
+                letter = "A"
+            elif section_index >= _SHN_LORESERVE:
+                raise UnsupportedObjectFile("Extended section indexes aren't supported")
+            else:
+                _, section_type, section_flags = sections[section_index][:3]
+                letter = _elf_section_type(section_names[section_index], section_type, section_flags)
+                if binding == _STB_GLOBAL:
+                    letter = letter.upper()
+            result.append((letter, _c_string(data, strings_offset + name_offset, end)))
+    return result
+
+# Mach-O constants.
+_MH_MAGIC = 0xfeedface
+_MH_MAGIC_64 = 0xfeedfacf
+_LC_SEGMENT = 0x1
+_LC_SYMTAB = 0x2
+_LC_SEGMENT_64 = 0x19
+_N_STAB = 0xe0
+_N_TYPE = 0x0e
+_N_EXT = 0x01
+_N_UNDF = 0x0
+_N_ABS = 0x2
+_N_INDR = 0xa
+_N_PBUD = 0xc
+_N_SECT = 0xe
+
+def _mach_o_symbols(data, start, end):
+    magic = struct.unpack_from("<I", data, start)[0]
+    if magic in (_MH_MAGIC, _MH_MAGIC_64):
+        endian = "<"
+    else:
+        endian = ">"
+        magic = struct.unpack_from(">I", data, start)[0]
+    is_64 = magic == _MH_MAGIC_64
+    command_count = struct.unpack_from(endian + "I", data, start + 16)[0]
+    command_offset = start + (32 if is_64 else 28)
+    # Section names in load command order, section numbers start from 1.
+    section_names = [None]
+    symbol_table = None
+    for _ in xrange(command_count):
+        command, command_size = struct.unpack_from(endian + "II", data, command_offset)
+        if command in (_LC_SEGMENT, _LC_SEGMENT_64):
+            if command == _LC_SEGMENT_64:
+                sections_count = struct.unpack_from(endian + "I", data, command_offset + 64)[0]
+                section_offset, section_size = command_offset + 72, 80
+            else:
+                sections_count = struct.unpack_from(endian + "I", data, command_offset + 48)[0]
+                section_offset, section_size = command_offset + 56, 68
+            for index in xrange(sections_count):
+                section_name, segment_name = struct.unpack_from("16s16s", data, section_offset + index * section_size)
+                section_names.append((segment_name.rstrip("\0"), section_name.rstrip("\0")))
+        elif command == _LC_SYMTAB:
+            symbol_table = struct.unpack_from(endian + "IIII", data, command_offset + 8)
+        command_offset += command_size
+    if symbol_table is None:
+        return []
+    symbols_offset, symbols_count, strings_offset, _ = symbol_table
+    symbol_struct = struct.Struct(endian + ("IBBHQ" if is_64 else "IBBhI"))
+    result = []
+    for index in xrange(symbols_count):
+        name_offset, n_type, n_sect, _, n_value = symbol_struct.unpack_from(data,
+            start + symbols_offset + index * symbol_struct.size)
+        if (n_type & _N_STAB) or not (n_type & _N_EXT):
+            continue
+        kind = n_type & _N_TYPE
+        if kind == _N_UNDF:
+            letter = "C" if n_value != 0 else "U"
+        elif kind == _N_PBUD:
+            letter = "U"
+        elif kind == _N_ABS:
+            letter = "A"
+        elif kind == _N_INDR:
+            letter = "I"
+        elif (kind == _N_SECT) and (0 < n_sect < len(section_names)):
+            letter = {("__TEXT", "__text"): "T", ("__DATA", "__data"): "D",
+                ("__DATA", "__bss"): "B"}.get(section_names[n_sect], "S")
+        else:
+            letter = "?"
+        result.append((letter, _c_string(data, start + strings_offset + name_offset, end)))
+    return result
+
+_AR_HEADER_SIZE = 60
+
+def _archive_members(data, start, end):
+    """Yields (member_name, member_start, member_end) for every object in ar
+    archive, skipping symbol index and long name tables."""
+    offset = start + len(ARCHIVE_MAGIC)
+    long_names = None
+    while offset + _AR_HEADER_SIZE <= end:
+        name, size, magic = struct.unpack_from("16s32x10s2s", data, offset)
+        if magic != "`\n":
+            raise UnsupportedObjectFile("Malformed archive member header")
+        member_start = offset + _AR_HEADER_SIZE
+        member_end = member_start + int(size)
+        offset = member_end + (member_end - start) % 2
+        name = name.rstrip(" ")
+        if name in ("/", "/SYM64/"):
+            continue
+        if name == "//":
+            long_names = (member_start, member_end)
+            continue
+        if name.startswith("#1/"):
+            # BSD long name is stored in front of member data.
+            name_length = int(name[3:])
+            name = data[member_start:member_start + name_length].rstrip("\0")
+            member_start += name_length
+        elif name.startswith("/") and (long_names is not None):
+            name_start = long_names[0] + int(name[1:])
+            name = data[name_start:data.find("\n", name_start, long_names[1])].rstrip("/")
+        elif name.endswith("/"):
+            name = name[:-1]
+        if name.startswith("__.SYMDEF"):
+            continue
+        yield name, member_start, member_end
+
+def _buffer_symbols(data, start, end):
+    magic = data[start:start + len(ARCHIVE_MAGIC)]
+    if magic == ARCHIVE_MAGIC:
+        result = []
+        for _, member_start, member_end in _archive_members(data, start, end):
+            result.extend(_buffer_symbols(data, member_start, member_end))
+        return result
+    if magic.startswith(_ELF_MAGIC):
+        return sorted(_elf_symbols(data, start, end), key=lambda symbol: symbol[1])
+    if len(magic) >= 4 and (struct.unpack_from("<I", magic)[0] in (_MH_MAGIC, _MH_MAGIC_64) or
+            struct.unpack_from(">I", magic)[0] in (_MH_MAGIC, _MH_MAGIC_64)):
+        return sorted(_mach_o_symbols(data, start, end), key=lambda symbol: symbol[1])
+    raise UnsupportedObjectFile("Unknown object file format")
+
+def object_file_symbols(filename):
+    """Returns list of (symbol_type, symbol_name) of global symbols like `nm -g`
+    for ELF and Mach-O object files and ar archives of them.
+
+    File is mapped into memory, only symbol and string tables are read.
+    Raises UnsupportedObjectFile for other formats."""
+    with open(filename, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            raise UnsupportedObjectFile("Empty file")
+        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            return _buffer_symbols(data, 0, len(data))
+        except (struct.error, ValueError, IndexError) as e:
+            raise UnsupportedObjectFile(str(e))
+        finally:
+            data.close()
+
+def _split_symbols(symbols):
+    """Returns (defined_symbols, undefined_symbols) from (symbol_type, symbol_name) list."""
+    defined_symbols = []
+    undefined_symbols = []
+    for symbol_type, symbol_name in symbols:
+        if symbol_type == DEFINED_SYMBOL_TYPE:
+            defined_symbols.append(symbol_name)
+        elif symbol_type == UNDEFINED_SYMBOL_TYPE:
+            undefined_symbols.append(symbol_name)
+    return defined_symbols, undefined_symbols
+
+def global_symbols(filename, use_nm=False):
+    """Returns tuple of lists - (defined_symbols, undefined_symbols).
+
+    Reads symbol tables in-process unless `use_nm`, falls back to `nm` for
+    formats object_file_symbols() doesn't support."""
+    if not use_nm:
+        try:
+            return _split_symbols(object_file_symbols(filename))
+        except UnsupportedObjectFile:
+            pass
     defined_symbols = []
     undefined_symbols = []
     global_symbols_text = subprocess.check_output(["nm", "-g", filename])
@@ -33,21 +335,751 @@ def global_symbols(filename):
             undefined_symbols.append(symbol_name)
     return defined_symbols, undefined_symbols
 
+def global_symbols_of_files(filenames):
+    """Returns list of (defined_symbols, undefined_symbols) tuples, one per file.
+
+    Runs a single `nm` for all files and splits its output on per-file headers.
+    Archives print headers for their members too, so pass only object files."""
+    if len(filenames) == 1:
+        return [global_symbols(filenames[0], use_nm=True)]
+    result = [([], []) for _ in filenames]
+    global_symbols_text = subprocess.check_output(["nm", "-g"] + list(filenames))
+    current = None
+    next_index = 0
+    for line in global_symbols_text.splitlines():
+        if (next_index < len(filenames)) and (line == filenames[next_index] + ":"):
+            current = result[next_index]
+            next_index += 1
+            continue
+        symbol_type, symbol_name = parse_symbol_string(line)
+        if symbol_type == DEFINED_SYMBOL_TYPE:
+            current[0].append(symbol_name)
+        elif symbol_type == UNDEFINED_SYMBOL_TYPE:
+            current[1].append(symbol_name)
+    assert next_index == len(filenames), "Unexpected nm output, not every file has a header"
+    return result
+
+class SymbolCache:
+    """On-disk cache of global_symbols() results.
+
+    Entries are keyed by file path and invalidated when file mtime or size
+    changes.  With `check_content` a file with changed mtime but the same size
+    is also compared by SHA-1 of its content, so rebuilt but identical objects
+    aren't rescanned.  Archive members like 'libfoo.a(bar.o)' are checked
+    against their archive.  Cache file is a zlib-compressed marshal dump."""
+    _MAGIC = "DVSC"
+    _FORMAT_VERSION = 1
+
+    def __init__(self, filename, check_content=False):
+        self._filename = filename
+        self._check_content = check_content
+        # path -> (mtime, size, digest, defined_symbols, undefined_symbols)
+        self._entries = dict()
+        self._is_modified = False
+        # (path, mtime, size) -> SHA-1, archive members share their archive's one
+        self._digests = dict()
+        self._load()
+
+    def _load(self):
+        try:
+            with open(self._filename, "rb") as f:
+                data = f.read()
+        except IOError:
+            return
+        header = "%s%d\n" % (SymbolCache._MAGIC, SymbolCache._FORMAT_VERSION)
+        if not data.startswith(header):
+            return
+        try:
+            entries = marshal.loads(zlib.decompress(data[len(header):]))
+        except (ValueError, EOFError, TypeError, zlib.error):
+            return
+        if isinstance(entries, dict):
+            self._entries = entries
+
+    def save(self):
+        if not self._is_modified:
+            return
+        header = "%s%d\n" % (SymbolCache._MAGIC, SymbolCache._FORMAT_VERSION)
+        temporary_filename = self._filename + ".tmp"
+        with open(temporary_filename, "wb") as f:
+            f.write(header)
+            f.write(zlib.compress(marshal.dumps(self._entries)))
+        os.rename(temporary_filename, self._filename)
+        self._is_modified = False
+
+    def _content_digest(self, path, stat):
+        path = split_archive_member_path(path)[0]
+        key = (path, stat.st_mtime, stat.st_size)
+        if key not in self._digests:
+            digest = hashlib.sha1()
+            with open(path, "rb") as f:
+                for chunk in iter(lambda: f.read(1 << 20), ""):
+                    digest.update(chunk)
+            self._digests[key] = digest.digest()
+        return self._digests[key]
+
+    @staticmethod
+    def _stat(path):
+        return os.stat(split_archive_member_path(path)[0])
+
+    def lookup(self, path):
+        """Returns (defined_symbols, undefined_symbols) or None if path isn't cached or is stale."""
+        entry = self._entries.get(path)
+        if entry is None:
+            return None
+        mtime, size, digest, defined, undefined = entry
+        stat = SymbolCache._stat(path)
+        if (stat.st_mtime == mtime) and (stat.st_size == size):
+            return defined, undefined
+        if self._check_content and (digest is not None) and (stat.st_size == size):
+            if self._content_digest(path, stat) == digest:
+                self._entries[path] = (stat.st_mtime, size, digest, defined, undefined)
+                self._is_modified = True
+                return defined, undefined
+        return None
+
+    def store(self, path, defined, undefined):
+        stat = SymbolCache._stat(path)
+        digest = self._content_digest(path, stat) if self._check_content else None
+        self._entries[path] = (stat.st_mtime, stat.st_size, digest, list(defined), list(undefined))
+        self._is_modified = True
+
+    def retain(self, paths):
+        """Drops entries for files not in paths."""
+        paths = frozenset(paths)
+        stale_paths = [path for path in self._entries if path not in paths]
+        for path in stale_paths:
+            del self._entries[path]
+        self._is_modified = self._is_modified or (len(stale_paths) > 0)
+
+class Instrumentation(object):
+    """Collects stage timings and counters of a run and reports them.
+
+    Every event is a dict passed to each of `sinks`, which are callables like
+    PrintSink, LoggingSink or JSONSink.  `progress` is called as
+    progress(stage, done, total) while long stages advance.  Progress events
+    are sent at most once in `progress_interval` seconds per stage."""
+    def __init__(self, sinks=(), progress=None, progress_interval=1.0):
+        self._sinks = list(sinks)
+        self._progress = progress
+        self._progress_interval = progress_interval
+        self._last_progress_times = dict()
+        # stage -> total seconds spent in it
+        self.timings = collections.OrderedDict()
+        # counter -> value, like "files_scanned" or "bytes_written"
+        self.counters = collections.OrderedDict()
+
+    def _emit(self, event):
+        for sink in self._sinks:
+            sink(event)
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        """Context manager timing a stage."""
+        self._emit({"event": "stage_start", "stage": name})
+        start = time.time()
+        try:
+            yield
+        finally:
+            elapsed = time.time() - start
+            self.timings[name] = self.timings.get(name, 0.0) + elapsed
+            self._emit({"event": "stage_end", "stage": name, "seconds": elapsed})
+
+    def count(self, counter, amount=1):
+        self.counters[counter] = self.counters.get(counter, 0) + amount
+
+    def progress(self, stage, done, total):
+        now = time.time()
+        if (done < total) and (now - self._last_progress_times.get(stage, 0) < self._progress_interval):
+            return
+        self._last_progress_times[stage] = now
+        if self._progress is not None:
+            self._progress(stage, done, total)
+        self._emit({"event": "progress", "stage": stage, "done": done, "total": total})
+
+    def counting_writes(self, f):
+        """Returns file-like object which writes to f and counts bytes_written."""
+        return _CountingWriter(f, self)
+
+    def report(self):
+        """Returns {"stages": timings, "counters": counters} and sends it to sinks."""
+        summary = {"stages": dict(self.timings), "counters": dict(self.counters)}
+        event = {"event": "summary"}
+        event.update(summary)
+        self._emit(event)
+        return summary
+
+class _NullStage(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+class _NullInstrumentation(Instrumentation):
+    """Instrumentation which does nothing, used when none is provided."""
+    _STAGE = _NullStage()
+
+    def stage(self, name):
+        return _NullInstrumentation._STAGE
+
+    def count(self, counter, amount=1):
+        pass
+
+    def progress(self, stage, done, total):
+        pass
+
+    def counting_writes(self, f):
+        return f
+
+NO_INSTRUMENTATION = _NullInstrumentation()
+
+class _CountingWriter(object):
+    def __init__(self, f, instrumentation):
+        self._file = f
+        self._instrumentation = instrumentation
+
+    def write(self, text):
+        self._instrumentation.count("bytes_written", len(text))
+        self._file.write(text)
+
+class PrintSink(object):
+    """Prints instrumentation events as text lines, to stderr by default."""
+    def __init__(self, f=None):
+        self._file = f
+
+    def __call__(self, event):
+        f = self._file if self._file is not None else sys.stderr
+        kind = event["event"]
+        if kind == "stage_start":
+            f.write("%s...\n" % event["stage"])
+        elif kind == "stage_end":
+            f.write("%s done in %.3fs\n" % (event["stage"], event["seconds"]))
+        elif kind == "progress":
+            f.write("%s: %d/%d\n" % (event["stage"], event["done"], event["total"]))
+        elif kind == "summary":
+            for stage, seconds in event["stages"].iteritems():
+                f.write("%-24s %10.3fs\n" % (stage, seconds))
+            for counter, value in event["counters"].iteritems():
+                f.write("%-24s %11d\n" % (counter, value))
+
+class LoggingSink(object):
+    """Passes instrumentation events to a `logging` logger."""
+    def __init__(self, logger=None, level=None):
+        self._logger = logger if logger is not None else logging.getLogger("dependency_viz")
+        self._level = level if level is not None else logging.INFO
+
+    def __call__(self, event):
+        self._logger.log(self._level, "%s", json.dumps(event, sort_keys=True))
+
+class JSONSink(object):
+    """Writes every instrumentation event as a JSON line to file-like object."""
+    def __init__(self, f):
+        self._file = f
+
+    def __call__(self, event):
+        event = dict(event, time=time.time())
+        self._file.write(json.dumps(event, sort_keys=True))
+        self._file.write("\n")
+
+def collect_global_symbols(filenames, jobs=1, batch_size=1, cache=None, use_nm=False, instrumentation=None):
+    """Returns list of (filename, defined_symbols, undefined_symbols) in filenames order.
+
+    Symbol tables are read in-process unless `use_nm`.  Files the in-process
+    reader doesn't support are passed to `nm`: up to `jobs` `nm` processes run
+    at once, each handling up to `batch_size` files.
+    If SymbolCache `cache` is provided, only files missing from it are scanned.
+    Scanned files and symbols are counted by `instrumentation`."""
+    if instrumentation is None:
+        instrumentation = NO_INSTRUMENTATION
+    if cache is not None:
+        cached_symbols = dict()
+        for filename in filenames:
+            symbols = cache.lookup(filename)
+            if symbols is not None:
+                cached_symbols[filename] = symbols
+        instrumentation.count("files_cached", len(cached_symbols))
+        missing_files = [f for f in filenames if f not in cached_symbols]
+        for filename, defined, undefined in collect_global_symbols(missing_files, jobs, batch_size,
+                use_nm=use_nm, instrumentation=instrumentation):
+            cache.store(filename, defined, undefined)
+            cached_symbols[filename] = (defined, undefined)
+        return [(f,) + tuple(cached_symbols[f]) for f in filenames]
+    if not use_nm:
+        file_symbols = dict()
+        for index, filename in enumerate(filenames):
+            try:
+                symbols = file_symbols[filename] = _split_symbols(object_file_symbols(filename))
+            except UnsupportedObjectFile:
+                continue
+            instrumentation.count("files_scanned")
+            instrumentation.count("symbols_parsed", len(symbols[0]) + len(symbols[1]))
+            instrumentation.progress("read_symbols", index + 1, len(filenames))
+        nm_files = [f for f in filenames if f not in file_symbols]
+        for filename, defined, undefined in collect_global_symbols(nm_files, jobs, batch_size,
+                use_nm=True, instrumentation=instrumentation):
+            file_symbols[filename] = (defined, undefined)
+        return [(f,) + file_symbols[f] for f in filenames]
+    batches = []
+    batch = []
+    for filename in filenames:
+        if (batch_size > 1) and is_archive(filename):
+            if len(batch) > 0:
+                batches.append(batch)
+                batch = []
+            batches.append([filename])
+            continue
+        batch.append(filename)
+        if len(batch) >= batch_size:
+            batches.append(batch)
+            batch = []
+    if len(batch) > 0:
+        batches.append(batch)
+    pool = ThreadPool(jobs) if jobs > 1 else None
+    try:
+        if pool is not None:
+            batch_results = pool.imap(global_symbols_of_files, batches, chunksize=1)
+        else:
+            batch_results = (global_symbols_of_files(batch) for batch in batches)
+        result = []
+        for batch_index, symbols in enumerate(batch_results):
+            batch = batches[batch_index]
+            for filename, (defined, undefined) in zip(batch, symbols):
+                result.append((filename, defined, undefined))
+                instrumentation.count("symbols_parsed", len(defined) + len(undefined))
+            instrumentation.count("files_scanned", len(batch))
+            instrumentation.progress("nm", len(result), len(filenames))
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+    return result
+
+_ARCHIVE_MEMBER_PATH_RE = re.compile(r"^(.+)\(([^()]+)\)$")
+
+def archive_member_path(archive, member):
+    """Returns path of archive member like 'lib/libfoo.a(bar.o)', the way
+    linkers name them."""
+    return "%s(%s)" % (archive, member)
+
+def split_archive_member_path(path):
+    """Returns (archive, member) for 'archive(member)' paths and (path, None)
+    for other paths."""
+    if not path.endswith(")"):
+        return path, None
+    match = _ARCHIVE_MEMBER_PATH_RE.match(path)
+    if match is None:
+        return path, None
+    return match.group(1), match.group(2)
+
+def _member_name_without_index(member):
+    """Strips '#2' which archive_member_symbols() appends to repeated member names."""
+    name, separator, index = member.rpartition("#")
+    return name if separator and index.isdigit() else member
+
+class _ArchiveMemberNames(object):
+    """Makes member paths unique, ar archives can have several members with
+    the same name.  Repeated names get '#2', '#3' and so on."""
+    def __init__(self, archive):
+        self._archive = archive
+        self._name_counts = dict()
+
+    def member_path(self, name):
+        count = self._name_counts[name] = self._name_counts.get(name, 0) + 1
+        if count > 1:
+            name = "%s#%d" % (name, count)
+        return archive_member_path(self._archive, name)
+
+def _nm_archive_member_symbols(archive):
+    """Yields (member_path, defined_symbols, undefined_symbols) reading
+    streamed `nm -g` output for archive."""
+    member_names = _ArchiveMemberNames(archive)
+    member_prefix = archive + "("
+    process = subprocess.Popen(["nm", "-g", archive], stdout=subprocess.PIPE)
+    try:
+        current = None
+        for line in process.stdout:
+            line = line.rstrip("\n")
+            # GNU nm prints member headers as 'bar.o:', BSD nm as 'libfoo.a(bar.o):'.
+            if line.endswith(":") and (line.startswith(member_prefix) or " " not in line):
+                if current is not None:
+                    yield current
+                name = line[len(member_prefix):-2] if line.startswith(member_prefix) else line[:-1]
+                current = (member_names.member_path(name), [], [])
+                continue
+            symbol_type, symbol_name = parse_symbol_string(line)
+            if current is None:
+                continue
+            if symbol_type == DEFINED_SYMBOL_TYPE:
+                current[1].append(symbol_name)
+            elif symbol_type == UNDEFINED_SYMBOL_TYPE:
+                current[2].append(symbol_name)
+        if current is not None:
+            yield current
+    finally:
+        process.stdout.close()
+        return_code = process.wait()
+    if return_code != 0:
+        raise subprocess.CalledProcessError(return_code, "nm -g %s" % archive)
+
+def archive_member_symbols(archive, members=None, cache=None, use_nm=False):
+    """Yields (member_path, defined_symbols, undefined_symbols) for every
+    object in ar archive, member_path is like 'lib/libfoo.a(bar.o)'.
+
+    Archive is mapped into memory and read member by member, so it's never
+    loaded whole.  If `members` names are provided, other members are
+    skipped.  Members found in SymbolCache `cache` aren't read.  Members the
+    in-process reader doesn't support, or all members with `use_nm`, are
+    read from streamed `nm` output."""
+    def is_selected(member_path):
+        return (members is None) or (_member_name_without_index(split_archive_member_path(member_path)[1]) in members)
+    nm_members = set()
+    with open(archive, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            raise UnsupportedObjectFile("Empty file")
+        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            if data[:len(ARCHIVE_MAGIC)] != ARCHIVE_MAGIC:
+                raise UnsupportedObjectFile("Not an archive")
+            member_names = _ArchiveMemberNames(archive)
+            for name, member_start, member_end in _archive_members(data, 0, len(data)):
+                member_path = member_names.member_path(name)
+                if not is_selected(member_path):
+                    continue
+                symbols = cache.lookup(member_path) if cache is not None else None
+                if symbols is None and not use_nm:
+                    try:
+                        symbols = _split_symbols(_buffer_symbols(data, member_start, member_end))
+                    except (UnsupportedObjectFile, struct.error, ValueError, IndexError):
+                        symbols = None
+                    if (symbols is not None) and (cache is not None):
+                        cache.store(member_path, *symbols)
+                if symbols is None:
+                    nm_members.add(member_path)
+                    continue
+                yield (member_path,) + tuple(symbols)
+        except (struct.error, ValueError) as e:
+            raise UnsupportedObjectFile(str(e))
+        finally:
+            data.close()
+    if len(nm_members) == 0:
+        return
+    for member_path, defined, undefined in _nm_archive_member_symbols(archive):
+        if member_path in nm_members:
+            if cache is not None:
+                cache.store(member_path, defined, undefined)
+            yield member_path, defined, undefined
+
+def _is_archive_path(path):
+    return os.path.splitext(path)[1] == ".a"
+
+def collect_link_input_symbols(inputs, jobs=1, batch_size=1, cache=None, use_nm=False,
+                               expand_archives=False, instrumentation=None):
+    """Returns list of (input, file, defined_symbols, undefined_symbols) in inputs order.
+
+    Inputs are object files, archives and archive members like
+    'lib/libfoo.a(bar.o)'.  Each archive member, and each archive with
+    `expand_archives`, is a separate file with its member path, other inputs
+    are files themselves.  Object files are read by collect_global_symbols().
+    Archives with several members of the same name give them to member
+    inputs of that name in archive order, one member per input."""
+    if instrumentation is None:
+        instrumentation = NO_INSTRUMENTATION
+    objects = []
+    # archive -> names of its members in inputs, None for all members
+    archive_members = collections.OrderedDict()
+    for path in inputs:
+        archive, member = split_archive_member_path(path)
+        if member is not None:
+            selected = archive_members.setdefault(archive, set())
+            if selected is not None:
+                selected.add(member)
+        elif expand_archives and _is_archive_path(path):
+            archive_members[path] = None
+        else:
+            objects.append(path)
+    object_symbols = dict((f, (defined, undefined)) for f, defined, undefined in
+        collect_global_symbols(objects, jobs, batch_size, cache, use_nm, instrumentation))
+    # archive -> [(member_path, defined, undefined)]
+    member_symbols = dict()
+    # (archive, member name) -> deque of (member_path, defined, undefined) with that name
+    named_member_symbols = collections.defaultdict(collections.deque)
+    for index, (archive, selected) in enumerate(archive_members.iteritems()):
+        symbols = member_symbols[archive] = []
+        for member_path, defined, undefined in archive_member_symbols(archive, selected, cache, use_nm):
+            symbols.append((member_path, defined, undefined))
+            member_name = _member_name_without_index(split_archive_member_path(member_path)[1])
+            named_member_symbols[(archive, member_name)].append((member_path, defined, undefined))
+            instrumentation.count("archive_members_scanned")
+            instrumentation.count("symbols_parsed", len(defined) + len(undefined))
+        instrumentation.progress("read_archives", index + 1, len(archive_members))
+    result = []
+    for path in inputs:
+        archive, member = split_archive_member_path(path)
+        if member is not None:
+            same_named_members = named_member_symbols.get((archive, member))
+            if same_named_members:
+                result.append((path,) + same_named_members.popleft())
+        elif path in object_symbols:
+            result.append((path, path) + object_symbols[path])
+        else:
+            result.extend((path,) + symbols for symbols in member_symbols[path])
+    return result
+
+_OBJECT_FILE_EXTENSIONS = frozenset([".o", ".obj", ".a", ".lo"])
+
+def _ld64_map_inputs(lines):
+    """Yields object files and archive members from '# Object files:' section
+    of ld64 map file."""
+    in_object_files = False
+    for line in lines:
+        if line.startswith("#"):
+            in_object_files = line.startswith("# Object files:")
+            continue
+        if not in_object_files:
+            continue
+        match = re.match(r"\[\s*\d+\]\s+(.*)$", line.rstrip("\n"))
+        if match is None:
+            continue
+        path = match.group(1)
+        if path == "linker synthesized" or os.path.splitext(split_archive_member_path(path)[0])[1] in (".tbd", ".dylib"):
+            continue
+        yield path
+
+_GNU_MAP_MEMBER_RE = re.compile(r"^(\S[^(]*\([^)]*\))(\s|$)")
+
+def _gnu_ld_map_inputs(lines):
+    """Yields object files and archive members in link order from GNU ld map
+    file.  Members come from 'Archive member included' section and are
+    yielded in place of their archive's LOAD line."""
+    # archive -> its included members
+    included_members = collections.OrderedDict()
+    in_members = False
+    loaded_archives = set()
+    for line in lines:
+        line = line.rstrip("\n")
+        if line.startswith("Archive member included"):
+            in_members = True
+            continue
+        if in_members and line and not line[0].isspace():
+            match = _GNU_MAP_MEMBER_RE.match(line)
+            if match is None:
+                in_members = False
+            else:
+                archive, _ = split_archive_member_path(match.group(1))
+                included_members.setdefault(archive, []).append(match.group(1))
+                continue
+        if not line.startswith("LOAD "):
+            continue
+        path = line[len("LOAD "):]
+        if path in included_members:
+            if path not in loaded_archives:
+                loaded_archives.add(path)
+                for member in included_members[path]:
+                    yield member
+        elif os.path.splitext(path)[1] in _OBJECT_FILE_EXTENSIONS and not _is_archive_path(path):
+            yield path
+
+_LLD_MAP_INPUT_RE = re.compile(r"^\s*(?:[0-9a-fA-F]+\s+){3,4}(\S.*):\([^)]*\)$")
+
+def _lld_map_inputs(lines):
+    """Yields input files of lld map file in the order of their first section."""
+    seen = set()
+    for line in lines:
+        match = _LLD_MAP_INPUT_RE.match(line.rstrip("\n"))
+        if match is None:
+            continue
+        path = match.group(1)
+        if path.startswith("<") or path in seen:
+            continue
+        seen.add(path)
+        yield path
+
+def _find_library(name, library_directories):
+    for directory in library_directories:
+        path = os.path.join(directory, "lib%s.a" % name)
+        if os.path.exists(path):
+            return path
+    return None
+
+def _response_file_inputs(f):
+    """Yields object files and archives from linker arguments in response
+    file f.  Nested @files and -filelist are read too, -l libraries are
+    looked up as static archives in all -L directories, like linkers do
+    regardless of whether -L comes before or after -l."""
+    lexer = shlex.shlex(f, posix=True)
+    lexer.whitespace_split = True
+    lexer.commenters = ""
+    # (option, value) for options with a value, (None, argument) otherwise
+    options = []
+    arguments = iter(lexer)
+    for argument in arguments:
+        if argument in ("-o", "-L", "-l", "-filelist"):
+            options.append((argument, next(arguments, "")))
+        elif argument.startswith("-L") or argument.startswith("-l"):
+            options.append((argument[:2], argument[2:]))
+        else:
+            options.append((None, argument))
+    library_directories = [value for option, value in options if option == "-L"]
+    for option, argument in options:
+        if option == "-l":
+            library = _find_library(argument, library_directories)
+            if library is not None:
+                yield library
+        elif option == "-filelist":
+            filelist, _, directory = argument.partition(",")
+            for path in read_link_inputs(filelist):
+                yield os.path.join(directory, path) if directory else path
+        elif option is not None:
+            continue
+        elif argument.startswith("@"):
+            for path in read_link_inputs(argument):
+                yield path
+        elif not argument.startswith("-") and (
+                os.path.splitext(split_archive_member_path(argument)[0])[1] in _OBJECT_FILE_EXTENSIONS):
+            yield argument
+
+def read_link_inputs(filename):
+    """Yields object files, archives and archive members linked together.
+
+    filename is a LinkFileList with a path per line, a response file when it
+    starts with '@' or has '.rsp' extension, or a ld64, GNU ld or lld map
+    file.  File is read line by line."""
+    is_response_file = filename.startswith("@")
+    if is_response_file:
+        filename = filename[1:]
+    is_response_file = is_response_file or filename.endswith(".rsp")
+    with open(filename, "r") as f:
+        if is_response_file:
+            for path in _response_file_inputs(f):
+                yield path
+            return
+        first_line = f.readline()
+        lines = itertools.chain([first_line], f)
+        if first_line.startswith("# Path:"):
+            inputs = _ld64_map_inputs(lines)
+        elif first_line.startswith(("Archive member included", "Merging program properties",
+                "As-needed library included", "Discarded input sections", "Memory Configuration")):
+            inputs = _gnu_ld_map_inputs(lines)
+        elif first_line.split()[:3] in (["VMA", "LMA", "Size"], ["Address", "Size", "Align"]):
+            inputs = _lld_map_inputs(lines)
+        else:
+            inputs = (line.rstrip("\n") for line in lines)
+        for path in inputs:
+            if len(path) > 0:
+                yield path
+
 class SymbolTable:
-    """SymbolTable tracks in which file which symbol was defined."""
+    """SymbolTable tracks in which file which symbol was defined and which
+    files reference it.
+
+    If symbol is defined in several files, file added first to the table
+    loses to the files added later, but all definitions are kept.  Files keep
+    their position when their symbols are removed and added again, position
+    can also be set explicitly before file defines anything."""
     def __init__(self):
-        self._symbol_to_file_dict = dict()
-        
+        # symbol -> list of files ordered by file position
+        self._symbol_to_files_dict = dict()
+        self._file_positions = dict()
+        # symbol -> set of files where it's undefined
+        self._symbol_users = dict()
+        # Sorted names of all symbols for prefix search, built on demand.
+        self._sorted_symbols = None
+
+    def set_file_position(self, filename, position):
+        """Sets position of file without definitions, file with a larger one wins."""
+        self._file_positions[filename] = position
+
+    def remove_file_position(self, filename):
+        self._file_positions.pop(filename, None)
+
     def add_defined_symbol_from_file(self, symbol_name, filename):
-        conflicting_filename = self._symbol_to_file_dict.get(symbol_name)
-        #assert conflicting_filename is None
-        self._symbol_to_file_dict[symbol_name] = filename
-        
+        position = self._file_positions.setdefault(filename, len(self._file_positions))
+        files = self._symbol_to_files_dict.get(symbol_name)
+        if files is None:
+            files = self._symbol_to_files_dict[symbol_name] = []
+            self._sorted_symbols = None
+        if filename in files:
+            return
+        index = len(files)
+        while (index > 0) and (self._file_positions[files[index - 1]] > position):
+            index -= 1
+        files.insert(index, filename)
+
+    def remove_defined_symbol_from_file(self, symbol_name, filename):
+        files = self._symbol_to_files_dict.get(symbol_name)
+        if (files is not None) and (filename in files):
+            files.remove(filename)
+            if len(files) == 0:
+                del self._symbol_to_files_dict[symbol_name]
+                self._sorted_symbols = None
+
+    def add_undefined_symbol_from_file(self, symbol_name, filename):
+        users = self._symbol_users.get(symbol_name)
+        if users is None:
+            users = self._symbol_users[symbol_name] = set()
+            self._sorted_symbols = None
+        users.add(filename)
+
+    def remove_undefined_symbol_from_file(self, symbol_name, filename):
+        users = self._symbol_users.get(symbol_name)
+        if users is not None:
+            users.discard(filename)
+            if len(users) == 0:
+                del self._symbol_users[symbol_name]
+                self._sorted_symbols = None
+
     def file_for_symbol(self, symbol_name):
-        return self._symbol_to_file_dict.get(symbol_name)
+        files = self._symbol_to_files_dict.get(symbol_name)
+        return files[-1] if files is not None else None
+
+    def files_defining_symbol(self, symbol_name):
+        """Returns files defining symbol, the one symbol resolves to is the last."""
+        return list(self._symbol_to_files_dict.get(symbol_name, ()))
+
+    def files_using_symbol(self, symbol_name):
+        return frozenset(self._symbol_users.get(symbol_name, ()))
+
+    def duplicate_symbols(self):
+        """Returns {symbol: files} for symbols defined in several files."""
+        return dict((symbol, list(files)) for symbol, files in self._symbol_to_files_dict.iteritems()
+            if len(files) > 1)
+
+    def unresolved_symbols(self):
+        """Returns {symbol: files} for undefined symbols no file defines."""
+        return dict((symbol, frozenset(users)) for symbol, users in self._symbol_users.iteritems()
+            if symbol not in self._symbol_to_files_dict)
+
+    def _symbol_names(self):
+        if self._sorted_symbols is None:
+            symbols = set(self._symbol_to_files_dict)
+            symbols.update(self._symbol_users)
+            self._sorted_symbols = sorted(symbols)
+        return self._sorted_symbols
+
+    def symbols_with_prefix(self, prefix):
+        """Returns sorted names of defined or referenced symbols starting with prefix."""
+        symbols = self._symbol_names()
+        start = bisect.bisect_left(symbols, prefix)
+        end = start
+        while (end < len(symbols)) and symbols[end].startswith(prefix):
+            end += 1
+        return symbols[start:end]
+
+    def symbols_matching(self, pattern):
+        """Returns sorted names of defined or referenced symbols matching
+        shell-style `pattern`.  Only symbols with pattern literal prefix are
+        checked."""
+        prefix = re.match(r"[^*?\[]*", pattern).group(0)
+        return [symbol for symbol in self.symbols_with_prefix(prefix)
+            if fnmatch.fnmatchcase(symbol, pattern)]
 
 def short_filename(file_path):
-    """Strips directory and extension from file path."""
+    """Strips directory and extension from file path.  Archive member
+    'lib/libfoo.a(bar.o)' becomes 'libfoo(bar)'."""
+    archive, member = split_archive_member_path(file_path)
+    if member is not None:
+        return "%s(%s)" % (short_filename(archive), short_filename(member))
     return os.path.splitext(os.path.split(file_path)[1])[0]
 
 def readable_symbol_name(symbol_name):
@@ -59,6 +1091,66 @@ def readable_symbol_name(symbol_name):
             break  # Strip single prefix.
     return symbol_name
 
+@contextlib.contextmanager
+def open_output(filename):
+    """Opens file for writing.  "-" means stdout, ".gz" files are compressed."""
+    if filename == "-":
+        yield sys.stdout
+    elif filename.endswith(".gz"):
+        with contextlib.closing(gzip.open(filename, "wb")) as f:
+            yield f
+    else:
+        with open(filename, "w") as f:
+            yield f
+
+@contextlib.contextmanager
+def open_input(filename):
+    """Opens file for reading.  "-" means stdin, ".gz" files are decompressed."""
+    if filename == "-":
+        yield sys.stdin
+    elif filename.endswith(".gz"):
+        with contextlib.closing(gzip.open(filename, "rb")) as f:
+            yield f
+    else:
+        with open(filename, "r") as f:
+            yield f
+
+class BatchedWriter:
+    """Collects small strings and writes them to file-like object in batches."""
+    DEFAULT_BATCH_SIZE = 4096
+
+    def __init__(self, f, batch_size=DEFAULT_BATCH_SIZE):
+        self._file = f
+        self._batch_size = batch_size
+        self._pending = []
+
+    def write(self, text):
+        self._pending.append(text)
+        if len(self._pending) >= self._batch_size:
+            self.flush()
+
+    def flush(self):
+        if len(self._pending) > 0:
+            self._file.write("".join(self._pending))
+            self._pending = []
+
+def _native_string(text):
+    """json module decodes strings to unicode, graph uses str."""
+    return text if isinstance(text, str) else text.encode("utf-8")
+
+_DOT_PLAIN_ID_RE = re.compile(r"^([A-Za-z_\x80-\xff][A-Za-z_0-9\x80-\xff]*|-?(\.[0-9]+|[0-9]+(\.[0-9]*)?))\Z")
+_DOT_KEYWORDS = frozenset(["node", "edge", "graph", "digraph", "subgraph", "strict"])
+
+def dot_string(text):
+    """Returns text as quoted DOT string."""
+    return '"%s"' % text.replace("\\", "\\\\").replace('"', '\\"')
+
+def dot_id(text):
+    """Returns text as DOT identifier, quoted unless it's a plain one."""
+    if _DOT_PLAIN_ID_RE.match(text) and (text.lower() not in _DOT_KEYWORDS):
+        return text
+    return dot_string(text)
+
 class DirectedGraph:
     class Builder:
         def __init__(self):
@@ -77,7 +1169,10 @@ class DirectedGraph:
             if vertex not in self._edges:
                 self._edges[vertex] = []
 
-        def build_graph(self):
+        def build_graph(self, compact=False):
+            """Returns DirectedGraph or CompactDirectedGraph if `compact`."""
+            if compact:
+                return self._build_compact_graph()
             adjacency_matrix = dict()
             for from_vertex, destinations in self._edges.iteritems():
                 collected_destinations = collections.defaultdict(set)
@@ -86,11 +1181,38 @@ class DirectedGraph:
                 adjacency_matrix[from_vertex] = dict(collected_destinations)
             return DirectedGraph(adjacency_matrix)
 
+        def _build_compact_graph(self):
+            vertexes = sorted(self._edges.keys())
+            vertex_indexes = dict((vertex, index) for index, vertex in enumerate(vertexes))
+            labels = []
+            label_indexes = dict()
+            edge_offsets = array.array(CompactDirectedGraph.INDEX_TYPECODE, [0])
+            edge_targets = array.array(CompactDirectedGraph.INDEX_TYPECODE)
+            label_offsets = array.array(CompactDirectedGraph.INDEX_TYPECODE, [0])
+            label_ids = array.array(CompactDirectedGraph.INDEX_TYPECODE)
+            for from_vertex in vertexes:
+                collected_destinations = collections.defaultdict(set)
+                for to_vertex, edge_label in self._edges[from_vertex]:
+                    collected_destinations[vertex_indexes[to_vertex]].add(edge_label)
+                for to_index in sorted(collected_destinations):
+                    edge_targets.append(to_index)
+                    for edge_label in collected_destinations[to_index]:
+                        label_id = label_indexes.get(edge_label)
+                        if label_id is None:
+                            label_id = len(labels)
+                            labels.append(edge_label)
+                            label_indexes[edge_label] = label_id
+                        label_ids.append(label_id)
+                    label_offsets.append(len(label_ids))
+                edge_offsets.append(len(edge_targets))
+            return CompactDirectedGraph(vertexes, edge_offsets, edge_targets, label_offsets, label_ids, labels)
+
     def __init__(self, adjacency_matrix):
         self._adjacency_matrix = adjacency_matrix
+        self._indexed_graph = None
 
     def __eq__(self, other):
-        return self._adjacency_matrix == other._adjacency_matrix
+        return self._adjacency_dict() == other._adjacency_dict()
 
     def __ne__(self, other):
         return not (self == other)
@@ -102,25 +1224,75 @@ class DirectedGraph:
         """Returns all vertexes."""
         return frozenset(self._adjacency_matrix.keys())
 
-    def write_dot_file(self, filename, write_edge_labels=False):
-        with open(filename, 'w') as f:
-            f.write("digraph dependencies {\n")
-            for from_vertex, destinations in self._adjacency_matrix.iteritems():
-                for to_vertex, edge_labels in destinations.iteritems():
-                    f.write(" " * 4)
-                    f.write("%s -> %s" % (from_vertex, to_vertex))
-                    if write_edge_labels:
-                        f.write(" [label='%s']" % ", ".join(sorted(edge_labels)))
-                    f.write(";\n")
-                # Write vertex without outgoing nodes
-                if len(destinations) == 0:
-                    f.write(" " * 4)
-                    f.write("%s;\n" % from_vertex)
-            f.write("}\n")
+    def has_vertex(self, vertex):
+        return vertex in self._adjacency_matrix
+
+    def write_dot_file(self, filename, write_edge_labels=False, vertex_labels=None):
+        with open_output(filename) as f:
+            self.write_dot(f, write_edge_labels, vertex_labels)
+
+    def write_dot(self, f, write_edge_labels=False, vertex_labels=None):
+        """Writes graph in DOT format to file-like object f.  Vertexes which
+        aren't plain DOT identifiers are quoted.  If `vertex_labels` function
+        is provided, vertexes are labelled with vertex_labels(vertex)."""
+        writer = BatchedWriter(f)
+        writer.write("digraph dependencies {\n")
+        # vertex -> DOT identifier, the same vertexes repeat in many edges
+        ids = dict()
+        def vertex_id(vertex):
+            result = ids.get(vertex)
+            if result is None:
+                result = ids[vertex] = dot_id(vertex)
+            return result
+        for from_vertex, destinations in self._iter_adjacency():
+            from_id = vertex_id(from_vertex)
+            if vertex_labels is not None:
+                writer.write("    %s [label=%s];\n" % (from_id, dot_string(vertex_labels(from_vertex))))
+            for to_vertex, edge_labels in destinations.iteritems():
+                if write_edge_labels:
+                    writer.write("    %s -> %s [label='%s'];\n" % (from_id, vertex_id(to_vertex),
+                        ", ".join(sorted(edge_labels))))
+                else:
+                    writer.write("    %s -> %s;\n" % (from_id, vertex_id(to_vertex)))
+            # Write vertex without outgoing nodes
+            if len(destinations) == 0:
+                writer.write("    %s;\n" % from_id)
+        writer.write("}\n")
+        writer.flush()
+
+    def write_edge_list(self, f):
+        """Writes graph to file-like object f as JSON lines.  Every edge is
+        [from_vertex, to_vertex, [edge_labels]], every vertex without outgoing
+        edges is [vertex]."""
+        writer = BatchedWriter(f)
+        for from_vertex, destinations in self._iter_adjacency():
+            for to_vertex, edge_labels in destinations.iteritems():
+                writer.write(json.dumps([from_vertex, to_vertex, sorted(edge_labels)]))
+                writer.write("\n")
+            if len(destinations) == 0:
+                writer.write(json.dumps([from_vertex]))
+                writer.write("\n")
+        writer.flush()
+
+    @staticmethod
+    def read_edge_list(lines, compact=False):
+        """Returns graph from lines written by write_edge_list."""
+        builder = DirectedGraph.Builder()
+        for line in lines:
+            if len(line.strip()) == 0:
+                continue
+            item = json.loads(line)
+            if len(item) == 1:
+                builder.add_vertex(_native_string(item[0]))
+            else:
+                from_vertex, to_vertex, edge_labels = item
+                builder.add_edge_with_labels(_native_string(from_vertex), _native_string(to_vertex),
+                    [_native_string(label) for label in edge_labels])
+        return builder.build_graph(compact)
 
     def subgraph(self, sub_vertexes):
         builder = DirectedGraph.Builder()
-        for from_vertex, destinations in self._adjacency_matrix.iteritems():
+        for from_vertex, destinations in self._iter_adjacency():
             if from_vertex not in sub_vertexes:
                 continue
             builder.add_vertex(from_vertex)
@@ -131,37 +1303,543 @@ class DirectedGraph:
 
     def reversed_graph(self):
         builder = DirectedGraph.Builder()
-        for from_vertex, destinations in self._adjacency_matrix.iteritems():
+        for from_vertex, destinations in self._iter_adjacency():
             builder.add_vertex(from_vertex)
             for to_vertex, edge_labels in destinations.iteritems():
                 builder.add_edge_with_labels(to_vertex, from_vertex, edge_labels)
         return builder.build_graph()
 
-    def _reachable_vertexes(self, from_vertex, visited):
-        visited.add(from_vertex)
-        reachable = dict()
-        for to_vertex, edge_labels in self._adjacency_matrix[from_vertex].iteritems():
-            if to_vertex in visited:
+    def subgraph_view(self, sub_vertexes):
+        """Returns read-only SubgraphView of vertexes from sub_vertexes, which
+        shares edges with this graph instead of copying them."""
+        return SubgraphView(self, sub_vertexes)
+
+    def reversed_view(self):
+        """Returns read-only ReversedGraphView sharing edges with this graph."""
+        return ReversedGraphView(self)
+
+    def _destinations(self, vertex):
+        """Returns dict {to_vertex: edge_labels} of vertex outgoing edges."""
+        return self._adjacency_matrix[vertex]
+
+    def _set_destinations(self, vertex, destinations):
+        """Replaces vertex outgoing edges, adds vertex if it's missing.  All
+        destinations must be graph vertexes."""
+        self._adjacency_matrix[vertex] = destinations
+        self._indexed_graph = None
+
+    def _remove_vertex(self, vertex):
+        """Removes vertex, it must have no incoming edges."""
+        del self._adjacency_matrix[vertex]
+        self._indexed_graph = None
+
+    def compacted(self):
+        """Returns CompactDirectedGraph with the same vertexes and edges."""
+        builder = DirectedGraph.Builder()
+        for from_vertex, destinations in self._iter_adjacency():
+            builder.add_vertex(from_vertex)
+            for to_vertex, edge_labels in destinations.iteritems():
+                builder.add_edge_with_labels(from_vertex, to_vertex, edge_labels)
+        return builder.build_graph(compact=True)
+
+    def _iter_adjacency(self):
+        """Yields (from_vertex, {to_vertex: edge_labels}) for every vertex."""
+        return self._adjacency_matrix.iteritems()
+
+    def _adjacency_dict(self):
+        return self._adjacency_matrix
+
+    def _indexed(self):
+        """Returns (vertexes, vertex_indexes, successors) where vertexes are
+        numbered from 0 and successors[i] is a list of indexes of vertexes[i]
+        destinations.  Computed once and cached."""
+        if self._indexed_graph is None:
+            vertexes = sorted(self.vertexes())
+            vertex_indexes = dict((vertex, index) for index, vertex in enumerate(vertexes))
+            successors = [[vertex_indexes[to_vertex] for to_vertex in self._destinations(vertex)]
+                for vertex in vertexes]
+            self._indexed_graph = (vertexes, vertex_indexes, successors)
+        return self._indexed_graph
+
+    def _csr_arrays(self):
+        """Returns (edge_offsets, edge_targets) arrays of _indexed() successors
+        laid out like CompactDirectedGraph edges."""
+        _, _, successors = self._indexed()
+        edge_offsets = array.array(CompactDirectedGraph.INDEX_TYPECODE, [0])
+        edge_targets = array.array(CompactDirectedGraph.INDEX_TYPECODE)
+        for to_indexes in successors:
+            edge_targets.extend(to_indexes)
+            edge_offsets.append(len(edge_targets))
+        return edge_offsets, edge_targets
+
+    def _strongly_connected_component_indexes(self):
+        """Returns (components, component_of).  components is a list of lists
+        of vertex indexes in reverse topological order, i.e. a component is
+        listed after all components reachable from it.  component_of[i] is the
+        index of vertex i component.
+
+        Tarjan's algorithm with an explicit stack instead of recursion."""
+        vertexes, _, successors = self._indexed()
+        vertex_count = len(vertexes)
+        order = [-1] * vertex_count
+        lowlink = [0] * vertex_count
+        on_stack = [False] * vertex_count
+        component_of = [-1] * vertex_count
+        components = []
+        stack = []
+        next_order = 0
+        for root in range(vertex_count):
+            if order[root] != -1:
                 continue
-            new_path_item = PathItem(to_vertex, from_vertex, 1, edge_labels)
-            current_path_item = reachable.get(to_vertex)
-            if (current_path_item is None) or (new_path_item.distance < current_path_item.distance):
-                reachable[to_vertex] = new_path_item
-            transitive_reachable = self._reachable_vertexes(to_vertex, visited)
-            for reachable_vertex, reachable_path_item in transitive_reachable.iteritems():
-                current_path_item = reachable.get(reachable_vertex)
-                if (current_path_item is None) or (reachable_path_item.distance + 1 < current_path_item.distance):
-                    reachable[reachable_vertex] = PathItem(reachable_vertex,
-                        reachable_path_item.prev_vertex,
-                        reachable_path_item.distance + 1,
-                        reachable_path_item.edge_labels)
+            order[root] = lowlink[root] = next_order
+            next_order += 1
+            stack.append(root)
+            on_stack[root] = True
+            # Each frame is (vertex, index of the next successor to visit).
+            call_stack = [(root, 0)]
+            while call_stack:
+                vertex, successor_index = call_stack[-1]
+                vertex_successors = successors[vertex]
+                if successor_index < len(vertex_successors):
+                    call_stack[-1] = (vertex, successor_index + 1)
+                    to_vertex = vertex_successors[successor_index]
+                    if order[to_vertex] == -1:
+                        order[to_vertex] = lowlink[to_vertex] = next_order
+                        next_order += 1
+                        stack.append(to_vertex)
+                        on_stack[to_vertex] = True
+                        call_stack.append((to_vertex, 0))
+                    elif on_stack[to_vertex] and (order[to_vertex] < lowlink[vertex]):
+                        lowlink[vertex] = order[to_vertex]
+                    continue
+                call_stack.pop()
+                if call_stack:
+                    parent = call_stack[-1][0]
+                    if lowlink[vertex] < lowlink[parent]:
+                        lowlink[parent] = lowlink[vertex]
+                if lowlink[vertex] == order[vertex]:
+                    component = []
+                    while True:
+                        member = stack.pop()
+                        on_stack[member] = False
+                        component_of[member] = len(components)
+                        component.append(member)
+                        if member == vertex:
+                            break
+                    components.append(component)
+        return components, component_of
+
+    def strongly_connected_components(self):
+        """Returns list of vertex lists, every component is listed after
+        components reachable from it."""
+        vertexes = self._indexed()[0]
+        components, _ = self._strongly_connected_component_indexes()
+        return [[vertexes[index] for index in component] for component in components]
+
+    def distance_bounds(self):
+        """Returns {vertex: bound} where bound is not less than the longest
+        shortest path from vertex.  A shortest path visits every strongly
+        connected component at most once and passes at most all its members,
+        so bound is the largest sum of component sizes along a path in the
+        condensed graph, not counting vertex itself."""
+        vertexes, _, successors = self._indexed()
+        components, component_of = self._strongly_connected_component_indexes()
+        component_bounds = [0] * len(components)
+        # Components reachable from a component are processed before it.
+        for component_index, members in enumerate(components):
+            longest_tail = 0
+            for member in members:
+                for to_index in successors[member]:
+                    to_component = component_of[to_index]
+                    if to_component != component_index:
+                        longest_tail = max(longest_tail, component_bounds[to_component])
+            component_bounds[component_index] = len(members) + longest_tail
+        return dict((vertex, component_bounds[component_of[index]] - 1)
+            for index, vertex in enumerate(vertexes))
+
+    def back_edges(self, sub_vertexes):
+        """Returns list of (from_vertex, to_vertex) edges between sub_vertexes
+        which close cycles during depth-first traversal.  Removing them makes
+        the subgraph acyclic."""
+        vertexes, vertex_indexes, successors = self._indexed()
+        # Member state is None before visit, True while on stack, False after.
+        # Only sub_vertexes are kept, so cost doesn't depend on graph size.
+        on_stack = dict((vertex_indexes[vertex], None) for vertex in sub_vertexes)
+        result = []
+        for root in sorted(on_stack):
+            if on_stack[root] is not None:
+                continue
+            on_stack[root] = True
+            call_stack = [(root, iter(sorted(successors[root])))]
+            while call_stack:
+                vertex, destinations = call_stack[-1]
+                for to_vertex in destinations:
+                    state = on_stack.get(to_vertex, False)
+                    if state is None:
+                        on_stack[to_vertex] = True
+                        call_stack.append((to_vertex, iter(sorted(successors[to_vertex]))))
+                        break
+                    elif state:
+                        result.append((vertexes[vertex], vertexes[to_vertex]))
+                else:
+                    on_stack[vertex] = False
+                    call_stack.pop()
+        return result
+
+    def condensed_graph(self, vertex_groups):
+        """Returns graph where vertexes mapped to the same name in vertex_groups
+        dict are merged into a single vertex with that name.  Edges inside a
+        group are dropped, parallel edges are merged with their labels."""
+        builder = DirectedGraph.Builder()
+        for from_vertex, destinations in self._iter_adjacency():
+            from_group = vertex_groups.get(from_vertex, from_vertex)
+            builder.add_vertex(from_group)
+            for to_vertex, edge_labels in destinations.iteritems():
+                to_group = vertex_groups.get(to_vertex, to_vertex)
+                if to_group != from_group:
+                    builder.add_edge_with_labels(from_group, to_group, edge_labels)
+        return builder.build_graph(compact=isinstance(self, CompactDirectedGraph))
+
+    def _edge_labels_between(self, from_vertex, to_vertex):
+        return self._adjacency_matrix[from_vertex][to_vertex]
+
+    def reachability_table(self, from_vertex):
+        """Returns ReachabilityTable, read-only mapping equal to
+        reachable_vertexes() dict, which keeps breadth-first traversal
+        results in arrays and creates PathItems on access."""
+        vertexes, vertex_indexes, successors = self._indexed()
+        source = vertex_indexes[from_vertex]
+        distances = {source: 0}
+        prev_indexes = dict()
+        queue = collections.deque([source])
+        while queue:
+            vertex_index = queue.popleft()
+            distance = distances[vertex_index] + 1
+            for to_index in successors[vertex_index]:
+                if to_index in distances:
+                    continue
+                distances[to_index] = distance
+                prev_indexes[to_index] = vertex_index
+                queue.append(to_index)
+        reached = sorted(prev_indexes)
+        typecode = CompactDirectedGraph.INDEX_TYPECODE
+        return ReachabilityTable(self, vertexes, vertex_indexes, array.array(typecode, reached),
+            array.array(typecode, [prev_indexes[index] for index in reached]),
+            array.array(typecode, [distances[index] for index in reached]))
+
+    def reachable_vertexes(self, from_vertex):
+        """Returns dict {vertex: PathItem} of vertexes reachable from from_vertex.
+
+        Traverses graph breadth-first, so every PathItem has the shortest
+        distance and prev_vertex is on one of the shortest paths."""
+        reachable = dict()
+        queue = collections.deque([from_vertex])
+        while queue:
+            vertex = queue.popleft()
+            distance = reachable[vertex].distance + 1 if vertex != from_vertex else 1
+            for to_vertex, edge_labels in self._destinations(vertex).iteritems():
+                if (to_vertex == from_vertex) or (to_vertex in reachable):
+                    continue
+                reachable[to_vertex] = PathItem(to_vertex, vertex, distance, edge_labels)
+                queue.append(to_vertex)
         return reachable
 
+class CompactDirectedGraph(DirectedGraph):
+    """DirectedGraph stored in compressed sparse row arrays.
+
+    Vertexes are numbered in sorted order.  Edges from vertex i are
+    edge_targets[edge_offsets[i]:edge_offsets[i + 1]], labels of edge e are
+    labels[label_id] for label_id in label_ids[label_offsets[e]:label_offsets[e + 1]].
+    Every label string is stored once in `labels` pool, which is shared with
+    subgraphs and reversed graphs."""
+    INDEX_TYPECODE = "i"
+
+    def __init__(self, vertexes, edge_offsets, edge_targets, label_offsets, label_ids, labels):
+        self._vertex_list = vertexes
+        self._vertex_indexes = dict((vertex, index) for index, vertex in enumerate(vertexes))
+        self._edge_offsets = edge_offsets
+        self._edge_targets = edge_targets
+        self._label_offsets = label_offsets
+        self._label_ids = label_ids
+        self._labels = labels
+        self._indexed_graph = None
+
+    def is_empty(self):
+        return len(self._vertex_list) == 0
+
+    def vertexes(self):
+        """Returns all vertexes."""
+        return frozenset(self._vertex_list)
+
+    def has_vertex(self, vertex):
+        return vertex in self._vertex_indexes
+
+    def _edge_labels(self, edge):
+        labels = self._labels
+        return frozenset(labels[label_id] for label_id in
+            self._label_ids[self._label_offsets[edge]:self._label_offsets[edge + 1]])
+
+    def _destinations_at(self, vertex_index):
+        vertexes = self._vertex_list
+        return dict((vertexes[self._edge_targets[edge]], self._edge_labels(edge)) for edge in
+            xrange(self._edge_offsets[vertex_index], self._edge_offsets[vertex_index + 1]))
+
+    def _destinations(self, vertex):
+        return self._destinations_at(self._vertex_indexes[vertex])
+
+    def _edge_labels_between(self, from_vertex, to_vertex):
+        from_index = self._vertex_indexes[from_vertex]
+        to_index = self._vertex_indexes[to_vertex]
+        # Edge targets of every vertex are sorted.
+        edge = bisect.bisect_left(self._edge_targets, to_index,
+            self._edge_offsets[from_index], self._edge_offsets[from_index + 1])
+        if (edge == self._edge_offsets[from_index + 1]) or (self._edge_targets[edge] != to_index):
+            raise KeyError(to_vertex)
+        return self._edge_labels(edge)
+
+    def _iter_adjacency(self):
+        for vertex_index, vertex in enumerate(self._vertex_list):
+            yield vertex, self._destinations_at(vertex_index)
+
+    def _adjacency_dict(self):
+        return dict(self._iter_adjacency())
+
+    class _Successors:
+        """Sequence of successor index arrays, as _indexed() returns."""
+        def __init__(self, edge_offsets, edge_targets):
+            self._edge_offsets = edge_offsets
+            self._edge_targets = edge_targets
+
+        def __len__(self):
+            return len(self._edge_offsets) - 1
+
+        def __getitem__(self, vertex_index):
+            return self._edge_targets[self._edge_offsets[vertex_index]:self._edge_offsets[vertex_index + 1]]
+
+    def _indexed(self):
+        if self._indexed_graph is None:
+            successors = CompactDirectedGraph._Successors(self._edge_offsets, self._edge_targets)
+            self._indexed_graph = (self._vertex_list, self._vertex_indexes, successors)
+        return self._indexed_graph
+
+    def _csr_arrays(self):
+        return self._edge_offsets, self._edge_targets
+
+    def _with_edges(self, vertexes, edges):
+        """Returns graph sharing label pool with self.  edges[i] is a list of
+        (to_index, edge) for vertexes[i] where edge indexes labels in self."""
+        edge_offsets = array.array(CompactDirectedGraph.INDEX_TYPECODE, [0])
+        edge_targets = array.array(CompactDirectedGraph.INDEX_TYPECODE)
+        label_offsets = array.array(CompactDirectedGraph.INDEX_TYPECODE, [0])
+        label_ids = array.array(CompactDirectedGraph.INDEX_TYPECODE)
+        for vertex_edges in edges:
+            for to_index, edge in vertex_edges:
+                edge_targets.append(to_index)
+                label_ids.extend(self._label_ids[self._label_offsets[edge]:self._label_offsets[edge + 1]])
+                label_offsets.append(len(label_ids))
+            edge_offsets.append(len(edge_targets))
+        return CompactDirectedGraph(vertexes, edge_offsets, edge_targets, label_offsets, label_ids, self._labels)
+
+    def subgraph(self, sub_vertexes):
+        kept_indexes = [index for index, vertex in enumerate(self._vertex_list) if vertex in sub_vertexes]
+        new_indexes = dict((old_index, new_index) for new_index, old_index in enumerate(kept_indexes))
+        edges = []
+        for old_index in kept_indexes:
+            vertex_edges = []
+            for edge in xrange(self._edge_offsets[old_index], self._edge_offsets[old_index + 1]):
+                to_index = new_indexes.get(self._edge_targets[edge])
+                if to_index is not None:
+                    vertex_edges.append((to_index, edge))
+            edges.append(vertex_edges)
+        return self._with_edges([self._vertex_list[index] for index in kept_indexes], edges)
+
+    def reversed_graph(self):
+        edges = [[] for _ in self._vertex_list]
+        # Sources are visited in increasing order, so reversed edges stay sorted.
+        for from_index in xrange(len(self._vertex_list)):
+            for edge in xrange(self._edge_offsets[from_index], self._edge_offsets[from_index + 1]):
+                edges[self._edge_targets[edge]].append((from_index, edge))
+        return self._with_edges(self._vertex_list, edges)
+
     def reachable_vertexes(self, from_vertex):
-        visited = set()
-        return self._reachable_vertexes(from_vertex, visited)
+        source = self._vertex_indexes[from_vertex]
+        edge_offsets = self._edge_offsets
+        edge_targets = self._edge_targets
+        # vertex index -> (prev vertex index, edge index, distance)
+        reached = dict()
+        queue = collections.deque([source])
+        while queue:
+            vertex_index = queue.popleft()
+            distance = reached[vertex_index][2] + 1 if vertex_index != source else 1
+            for edge in xrange(edge_offsets[vertex_index], edge_offsets[vertex_index + 1]):
+                to_index = edge_targets[edge]
+                if (to_index == source) or (to_index in reached):
+                    continue
+                reached[to_index] = (vertex_index, edge, distance)
+                queue.append(to_index)
+        vertexes = self._vertex_list
+        return dict((vertexes[to_index],
+                PathItem(vertexes[to_index], vertexes[prev_index], distance, self._edge_labels(edge)))
+            for to_index, (prev_index, edge, distance) in reached.iteritems())
+
+class _GraphView(DirectedGraph):
+    """Read-only graph whose vertexes and edges are computed from `graph` on
+    access.  Subclasses provide _indexed() and _edge_labels_between(), edge
+    labels are never copied.  The view reflects graph as it was when the
+    view was first traversed, so graph shouldn't be changed after that."""
+    def __init__(self, graph):
+        self._graph = graph
+        self._indexed_graph = None
+
+    def is_empty(self):
+        return len(self._indexed()[0]) == 0
+
+    def vertexes(self):
+        return frozenset(self._indexed()[0])
+
+    def has_vertex(self, vertex):
+        return vertex in self._indexed()[1]
+
+    def _destinations(self, vertex):
+        vertexes, vertex_indexes, successors = self._indexed()
+        return dict((vertexes[to_index], self._edge_labels_between(vertex, vertexes[to_index]))
+            for to_index in successors[vertex_indexes[vertex]])
+
+    def _iter_adjacency(self):
+        for vertex in self._indexed()[0]:
+            yield vertex, self._destinations(vertex)
+
+    def _adjacency_dict(self):
+        return dict(self._iter_adjacency())
+
+    def _set_destinations(self, vertex, destinations):
+        raise TypeError("Graph views are read-only")
+
+    def _remove_vertex(self, vertex):
+        raise TypeError("Graph views are read-only")
+
+class SubgraphView(_GraphView):
+    """Vertexes of graph which are in sub_vertexes and edges between them."""
+    def __init__(self, graph, sub_vertexes):
+        _GraphView.__init__(self, graph)
+        self._sub_vertexes = sub_vertexes
+
+    def _indexed(self):
+        if self._indexed_graph is None:
+            graph_vertexes, _, graph_successors = self._graph._indexed()
+            new_indexes = [-1] * len(graph_vertexes)
+            vertexes = []
+            for index, vertex in enumerate(graph_vertexes):
+                if vertex in self._sub_vertexes:
+                    new_indexes[index] = len(vertexes)
+                    vertexes.append(vertex)
+            successors = [[new_indexes[to_index] for to_index in graph_successors[index]
+                if new_indexes[to_index] != -1] for index, new_index in enumerate(new_indexes) if new_index != -1]
+            vertex_indexes = dict((vertex, index) for index, vertex in enumerate(vertexes))
+            self._indexed_graph = (vertexes, vertex_indexes, successors)
+        return self._indexed_graph
+
+    def _destinations(self, vertex):
+        vertex_indexes = self._indexed()[1]
+        if vertex not in vertex_indexes:
+            raise KeyError(vertex)
+        return dict((to_vertex, edge_labels) for to_vertex, edge_labels in self._graph._destinations(vertex).iteritems()
+            if to_vertex in vertex_indexes)
+
+    def _edge_labels_between(self, from_vertex, to_vertex):
+        vertex_indexes = self._indexed()[1]
+        if (from_vertex not in vertex_indexes) or (to_vertex not in vertex_indexes):
+            raise KeyError(to_vertex)
+        return self._graph._edge_labels_between(from_vertex, to_vertex)
+
+    def subgraph_view(self, sub_vertexes):
+        vertex_indexes = self._indexed()[1]
+        return SubgraphView(self._graph, frozenset(v for v in sub_vertexes if v in vertex_indexes))
+
+class ReversedGraphView(_GraphView):
+    """Graph with edges of graph in opposite direction.  Reversed adjacency
+    is built once as lists of vertex indexes."""
+    def _indexed(self):
+        if self._indexed_graph is None:
+            vertexes, vertex_indexes, successors = self._graph._indexed()
+            predecessors = [[] for _ in vertexes]
+            for from_index in xrange(len(vertexes)):
+                for to_index in successors[from_index]:
+                    predecessors[to_index].append(from_index)
+            self._indexed_graph = (vertexes, vertex_indexes, predecessors)
+        return self._indexed_graph
+
+    def _edge_labels_between(self, from_vertex, to_vertex):
+        return self._graph._edge_labels_between(to_vertex, from_vertex)
+
+    def reversed_view(self):
+        return self._graph
+
+class TransitiveClosure:
+    """Reachability between all graph vertexes.
+
+    Graph is condensed into strongly connected components which are processed
+    in reverse topological order.  Every component gets a bitset (long
+    integer indexed like DirectedGraph._indexed vertexes) of vertexes
+    reachable from its members including members themselves, which is a union
+    of its successor components bitsets.  All vertexes in the same component
+    share the bitset.  With `reverse` reachability is computed for reversed
+    graph without building it."""
+    def __init__(self, graph, reverse=False):
+        self._vertexes, self._vertex_indexes, successors = graph._indexed()
+        components, component_of = graph._strongly_connected_component_indexes()
+        if reverse:
+            predecessors = [[] for _ in successors]
+            for from_index, to_indexes in enumerate(successors):
+                for to_index in to_indexes:
+                    predecessors[to_index].append(from_index)
+            successors = predecessors
+            # Reversed graph has the same components in opposite order.
+            component_order = range(len(components) - 1, -1, -1)
+        else:
+            component_order = range(len(components))
+        component_bitsets = [0] * len(components)
+        for component_index in component_order:
+            members = components[component_index]
+            bitset = 0
+            successor_components = set()
+            for member in members:
+                bitset |= 1 << member
+                for to_index in successors[member]:
+                    successor_components.add(component_of[to_index])
+            successor_components.discard(component_index)
+            for successor_component in successor_components:
+                bitset |= component_bitsets[successor_component]
+            component_bitsets[component_index] = bitset
+        self._component_of = component_of
+        self._component_bitsets = component_bitsets
+        self._component_counts = [bin(bitset).count("1") for bitset in component_bitsets]
+
+    def reachable_count(self, vertex):
+        """Returns number of vertexes reachable from vertex, excluding vertex itself."""
+        return self._component_counts[self._component_of[self._vertex_indexes[vertex]]] - 1
+
+    def reachable_set(self, vertex):
+        """Returns frozenset of vertexes reachable from vertex, excluding vertex itself."""
+        vertex_index = self._vertex_indexes[vertex]
+        bitset = self._component_bitsets[self._component_of[vertex_index]] & ~(1 << vertex_index)
+        result = []
+        # Shifting a long is linear in its size, so bits aren't shifted out one
+        # by one.  Hex conversion of the whole bitset is linear, then every
+        # 64-bit word yields its set bits with `bits & -bits`.
+        digits = "%x" % bitset
+        for word_end in xrange(len(digits), 0, -16):
+            bits = int(digits[max(word_end - 16, 0):word_end], 16)
+            base_index = (len(digits) - word_end) * 4
+            while bits:
+                lowest_bit = bits & -bits
+                result.append(self._vertexes[base_index + lowest_bit.bit_length() - 1])
+                bits ^= lowest_bit
+        return frozenset(result)
+
+class PathItem(object):
+    __slots__ = ("vertex", "prev_vertex", "distance", "edge_labels")
 
-class PathItem:
     def __init__(self, vertex, prev_vertex, distance, edge_labels):
         self.vertex = vertex
         self.prev_vertex = prev_vertex
@@ -181,18 +1859,235 @@ class PathItem:
         return not (self == other)
 
     def __hash__(self):
-        return hash(self.vertex) + hash(self.prev_vertex) + hash(self.distance) + hash(self.edge_labels)
+        # Edge labels are usually a mutable set, equal items have equal labels anyway.
+        return hash((self.vertex, self.prev_vertex, self.distance))
 
     def path_from_root(self, path_items_dict):
-        if self.distance == 1:
-            return [self]
-        return path_items_dict[self.prev_vertex].path_from_root(path_items_dict) + [self]
+        """Returns list of PathItems from the source to this item."""
+        path = [self]
+        while path[-1].distance > 1:
+            path.append(path_items_dict[path[-1].prev_vertex])
+        path.reverse()
+        return path
+
+class ReachabilityTable(collections.Mapping):
+    """Read-only mapping {vertex: PathItem} of vertexes reachable from a source.
+
+    Instead of a PathItem per vertex, it keeps three integer arrays sorted by
+    graph vertex index: reached vertexes, their previous vertexes and
+    distances.  PathItems are created on access, edge labels are taken from
+    the graph."""
+    def __init__(self, graph, vertexes, vertex_indexes, reached, prev_indexes, distances):
+        self._graph = graph
+        self._vertexes = vertexes
+        self._vertex_indexes = vertex_indexes
+        self._reached = reached
+        self._prev_indexes = prev_indexes
+        self._distances = distances
+
+    def _position(self, vertex):
+        index = self._vertex_indexes.get(vertex)
+        if index is None:
+            return None
+        position = bisect.bisect_left(self._reached, index)
+        if (position == len(self._reached)) or (self._reached[position] != index):
+            return None
+        return position
+
+    def _path_item(self, position):
+        vertex = self._vertexes[self._reached[position]]
+        prev_vertex = self._vertexes[self._prev_indexes[position]]
+        return PathItem(vertex, prev_vertex, self._distances[position],
+            self._graph._edge_labels_between(prev_vertex, vertex))
+
+    def __getitem__(self, vertex):
+        position = self._position(vertex)
+        if position is None:
+            raise KeyError(vertex)
+        return self._path_item(position)
+
+    def __contains__(self, vertex):
+        return self._position(vertex) is not None
+
+    def __iter__(self):
+        vertexes = self._vertexes
+        return (vertexes[index] for index in self._reached)
+
+    def __len__(self):
+        return len(self._reached)
+
+    def __repr__(self):
+        return repr(dict(self.iteritems()))
+
+    def itervalues(self):
+        return (self._path_item(position) for position in xrange(len(self._reached)))
+
+    def values(self):
+        return list(self.itervalues())
+
+    def iteritems(self):
+        return ((path_item.vertex, path_item) for path_item in self.itervalues())
+
+    def items(self):
+        return list(self.iteritems())
+
+    def distance(self, vertex):
+        """Returns distance to vertex without creating PathItem."""
+        position = self._position(vertex)
+        if position is None:
+            raise KeyError(vertex)
+        return self._distances[position]
+
+    def max_distance(self):
+        return max(self._distances) if len(self._distances) > 0 else 0
+
+    def iter_layers(self):
+        """Yields (distance, [PathItem]) by increasing distance.  Only
+        positions are sorted up front, PathItems of a layer are created when
+        the layer is reached."""
+        positions = sorted(xrange(len(self._reached)), key=self._distances.__getitem__)
+        for distance, layer_positions in itertools.groupby(positions, key=self._distances.__getitem__):
+            yield distance, [self._path_item(position) for position in layer_positions]
+
+# (edge_offsets, edge_targets) of graphs traversed by reachability worker
+# processes.  Set before the pool forks, so workers read the parent's arrays
+# from shared copy-on-write pages and tasks carry only source index ranges.
+_reachability_graphs = None
+
+def _breadth_first_arrays(edge_offsets, edge_targets, source, distances):
+    """Traverses CSR graph from vertex index source.  Returns (reached,
+    prev_indexes, distances) lists sorted by vertex index without source.
+    `distances` is a scratch array filled with -1, it's restored on return."""
+    distances[source] = 0
+    prev_indexes = dict()
+    queue = [source]
+    enqueue = queue.append
+    # Iterating over a list visits items appended during iteration.
+    for vertex_index in queue:
+        distance = distances[vertex_index] + 1
+        for to_index in edge_targets[edge_offsets[vertex_index]:edge_offsets[vertex_index + 1]]:
+            if distances[to_index] != -1:
+                continue
+            distances[to_index] = distance
+            prev_indexes[to_index] = vertex_index
+            enqueue(to_index)
+    reached = sorted(prev_indexes)
+    result = (reached, [prev_indexes[index] for index in reached], [distances[index] for index in reached])
+    for vertex_index in queue:
+        distances[vertex_index] = -1
+    return result
+
+def _reachability_task(task):
+    """Returns (graph_index, [(source, reached, prev_indexes, distances)]) for
+    sources in [first, last) of graph `graph_index`, arrays packed into strings."""
+    graph_index, first, last = task
+    edge_offsets, edge_targets = _reachability_graphs[graph_index]
+    typecode = CompactDirectedGraph.INDEX_TYPECODE
+    distances = array.array(typecode, [-1]) * (len(edge_offsets) - 1)
+    result = []
+    for source in xrange(first, last):
+        arrays = _breadth_first_arrays(edge_offsets, edge_targets, source, distances)
+        result.append((source,) + tuple(array.array(typecode, values).tostring() for values in arrays))
+    return graph_index, result
+
+def all_reachability_tables(graphs, jobs=1, chunk_size=None, instrumentation=None):
+    """Returns a list with {vertex: ReachabilityTable} of every vertex for
+    each of `graphs`, which must have the same vertexes.
+
+    With `jobs` > 1 sources are split into chunks of `chunk_size` vertexes
+    and traversed by a pool of worker processes.  Workers don't receive
+    graphs with tasks, they share graph index arrays with this process.
+    Traversed sources are counted as vertexes_closed by `instrumentation`."""
+    global _reachability_graphs
+    if instrumentation is None:
+        instrumentation = NO_INSTRUMENTATION
+    graphs = list(graphs)
+    if len(graphs) == 0:
+        return []
+    _reachability_graphs = [graph._csr_arrays() for graph in graphs]
+    try:
+        vertex_count = len(_reachability_graphs[0][0]) - 1
+        if chunk_size is None:
+            # Several chunks per worker even out unequal traversal costs.
+            chunk_size = max(1, min(256, vertex_count // (max(jobs, 1) * 8)))
+        tasks = [(graph_index, first, min(first + chunk_size, vertex_count))
+            for graph_index in range(len(graphs)) for first in xrange(0, vertex_count, chunk_size)]
+        pool = multiprocessing.Pool(jobs) if jobs > 1 else None
+        try:
+            if pool is not None:
+                task_results = pool.imap_unordered(_reachability_task, tasks)
+            else:
+                task_results = (_reachability_task(task) for task in tasks)
+            tables = [dict() for _ in graphs]
+            done = 0
+            for graph_index, sources in task_results:
+                _add_reachability_tables(tables[graph_index], graphs[graph_index], sources)
+                done += len(sources)
+                instrumentation.count("vertexes_closed", len(sources))
+                instrumentation.progress("reachability_tables", done, len(graphs) * vertex_count)
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+    finally:
+        _reachability_graphs = None
+    return tables
+
+def _add_reachability_tables(tables, graph, sources):
+    """Adds ReachabilityTables of _reachability_task results to tables."""
+    typecode = CompactDirectedGraph.INDEX_TYPECODE
+    vertexes, vertex_indexes, _ = graph._indexed()
+    for source, reached, prev_indexes, distances in sources:
+        arrays = []
+        for packed in (reached, prev_indexes, distances):
+            values = array.array(typecode)
+            values.fromstring(packed)
+            arrays.append(values)
+        tables[vertexes[source]] = ReachabilityTable(graph, vertexes, vertex_indexes, *arrays)
+
+class CycleReport():
+    """Strongly connected component of several files, i.e. files which
+    depend on each other through a dependency cycle."""
+    def __init__(self, name, files, edges, closing_edges):
+        self._name = name
+        self._files = files
+        self._edges = edges
+        self._closing_edges = closing_edges
+
+    def __str__(self):
+        return "%s: %d files" % (self._name, self.size())
+
+    def name(self):
+        """Vertex name in condensed graph."""
+        return self._name
+
+    def files(self):
+        return self._files
+
+    def size(self):
+        return len(self._files)
+
+    def edges(self):
+        """Returns list of (from_file, to_file, edge_labels) inside the cycle."""
+        return self._edges
+
+    def closing_edges(self):
+        """Returns edges, with fewest symbols first, which close the cycle.
+        Without them files of the cycle don't form a cycle anymore."""
+        return self._closing_edges
 
 class DependencyReport():
-    def __init__(self, filename, required_dependencies, provided_dependencies):
+    def __init__(self, filename, required_dependencies, provided_dependencies,
+                 required_dependencies_count=None, provided_dependencies_count=None):
+        """Dependencies are dicts {filename: PathItem} or functions returning
+        such dicts, which are called on every access and not kept, so the
+        cache behind them bounds how many dicts stay in memory.  Known counts
+        allow to answer count queries without computing dependencies."""
         self._filename = filename
         self._required_dependencies = required_dependencies
         self._provided_dependencies = provided_dependencies
+        self._required_dependencies_count = required_dependencies_count
+        self._provided_dependencies_count = provided_dependencies_count
 
     def __str__(self):
         return self.filename()
@@ -201,19 +2096,31 @@ class DependencyReport():
         return self._filename
 
     def required_dependencies(self):
+        if callable(self._required_dependencies):
+            return self._required_dependencies()
         return self._required_dependencies
 
     def provided_dependencies(self):
+        if callable(self._provided_dependencies):
+            return self._provided_dependencies()
         return self._provided_dependencies
 
     def required_dependencies_count(self):
-        return len(self._required_dependencies)
+        if self._required_dependencies_count is None:
+            self._required_dependencies_count = len(self.required_dependencies())
+        return self._required_dependencies_count
 
     def provided_dependencies_count(self):
-        return len(self._provided_dependencies)
+        if self._provided_dependencies_count is None:
+            self._provided_dependencies_count = len(self.provided_dependencies())
+        return self._provided_dependencies_count
 
     def most_distant_required_dependency(self):
-        path_items = self.required_dependencies().values()
+        return DependencyReport._most_distant_dependency(self.required_dependencies())
+
+    @staticmethod
+    def _most_distant_dependency(dependencies):
+        path_items = dependencies.values()
         return max(path_items, key=attrgetter("distance")) if len(path_items) > 0 else None
 
     def longest_required_distance(self):
@@ -221,152 +2128,944 @@ class DependencyReport():
         return most_distant_dependency.distance if most_distant_dependency is not None else 0
 
     def longest_required_path(self):
-        most_distant_dependency = self.most_distant_required_dependency()
-        return most_distant_dependency.path_from_root(self.required_dependencies()) if most_distant_dependency is not None else []
-
-    def print_layered_dependencies(self, dependencies):
-        print(self.filename())
-        while len(dependencies) > 0:
-            # Find closest dependencies.
-            closest_dependencies = []
-            for dependency in dependencies:
-                if len(closest_dependencies) == 0:
-                    closest_dependencies.append(dependency)
-                elif dependency.distance < closest_dependencies[0].distance:
-                    closest_dependencies = [dependency]
-                elif dependency.distance == closest_dependencies[0].distance:
-                    closest_dependencies.append(dependency)
-            assert len(closest_dependencies) > 0
-            # Print closest dependencies.
-            # TODO: group by prev_vertex
-            print(closest_dependencies[0].distance)
-            for dependency in closest_dependencies:
-                print("    %s <- %s [%s]" % (dependency.vertex, dependency.prev_vertex,
-                    ", ".join(sorted(dependency.edge_labels))))
-            # Remove closest dependencies from dependencies.
-            closest_filenames = set(dependency.vertex for dependency in closest_dependencies)
-            dependencies = [d for d in dependencies if d.vertex not in closest_filenames]
-
-class Dependencies:
+        required_dependencies = self.required_dependencies()
+        most_distant_dependency = DependencyReport._most_distant_dependency(required_dependencies)
+        return most_distant_dependency.path_from_root(required_dependencies) if most_distant_dependency is not None else []
+
+    @staticmethod
+    def _dependency_layers(dependencies):
+        """Yields (distance, [PathItem]) by increasing distance."""
+        if isinstance(dependencies, ReachabilityTable):
+            for layer in dependencies.iter_layers():
+                yield layer
+            return
+        if hasattr(dependencies, "itervalues"):
+            dependencies = dependencies.itervalues()
+        # PathItems already exist, buckets only refer to them.
+        layers = collections.defaultdict(list)
+        for dependency in dependencies:
+            layers[dependency.distance].append(dependency)
+        for distance in sorted(layers):
+            yield distance, layers.pop(distance)
+
+    def print_layered_dependencies(self, dependencies, f=None):
+        """Writes dependencies to f, stdout by default, layer by layer of
+        equal distance.  In every layer dependencies are grouped by
+        prev_vertex, through which they are reached:
+
+        2
+            b ->
+                c [_c]
+
+        This replaces former `c <- b [_c]` line per dependency.  Every layer
+        is written as soon as it's produced, ReachabilityTable creates
+        PathItems of one layer at a time."""
+        f = f if f is not None else sys.stdout
+        writer = BatchedWriter(f)
+        writer.write("%s\n" % self.filename())
+        for distance, layer in DependencyReport._dependency_layers(dependencies):
+            writer.write("%d\n" % distance)
+            groups = collections.defaultdict(list)
+            for dependency in layer:
+                groups[dependency.prev_vertex].append(dependency)
+            for prev_vertex in sorted(groups):
+                writer.write("    %s ->\n" % prev_vertex)
+                for dependency in sorted(groups[prev_vertex], key=attrgetter("vertex")):
+                    writer.write("        %s [%s]\n" % (dependency.vertex, ", ".join(sorted(dependency.edge_labels))))
+            writer.flush()
+
+class LRUCache:
+    """Dict-like cache which keeps at most `capacity` most recently used items."""
+    def __init__(self, capacity):
+        self._capacity = capacity
+        self._items = collections.OrderedDict()
+
+    def __len__(self):
+        return len(self._items)
+
+    def __contains__(self, key):
+        return key in self._items
+
+    def get(self, key, default=None):
+        if key not in self._items:
+            return default
+        value = self._items.pop(key)
+        self._items[key] = value
+        return value
+
+    def keys(self):
+        return self._items.keys()
+
+    def pop(self, key, default=None):
+        return self._items.pop(key, default)
+
+    def put(self, key, value):
+        self._items.pop(key, None)
+        if self._capacity <= 0:
+            return
+        while len(self._items) >= self._capacity:
+            self._items.popitem(last=False)
+        self._items[key] = value
+
+    def clear(self):
+        self._items.clear()
+
+class Dependencies(object):
     _UNDEFINED_FILE = "<Undefined>"
+    DEFAULT_REPORT_CACHE_SIZE = 256
+
+    def __init__(self, link_file_list_filename, jobs=1, batch_size=1, cache_filename=None,
+                 compact_graph=False, report_cache_size=DEFAULT_REPORT_CACHE_SIZE, use_nm=False,
+                 instrumentation=None, expand_archives=False, unique_vertexes=False,
+                 check_content=False):
+        """Linked files are read by read_link_inputs() from LinkFileList,
+        response file or linker map file.  With `expand_archives` every
+        archive member is a separate file, members listed in map files always are.
+        Files with the same short name share a vertex, `unique_vertexes` makes
+        every file path its own vertex and keeps short names for display.
+        Symbol tables are read in-process, `use_nm` reads all of them with `nm`.
+        `jobs` and `batch_size` control how many `nm` processes run in parallel
+        and how many files each of them handles.  If `cache_filename` is provided,
+        symbols are kept in SymbolCache there and only changed files are rescanned,
+        `check_content` compares content of files whose mtime changed.
+        `compact_graph` stores dependency graph as CompactDirectedGraph, the
+        first update() which changes edges turns it into a dict-based graph.
+        `report_cache_size` is how many per-file dependency dicts are kept.
+        Stages of this and later computations are reported to `instrumentation`."""
+        self._init_with_graph(None, report_cache_size, instrumentation)
+        instrumentation = self._instrumentation
+        files_to_process = list(read_link_inputs(link_file_list_filename))
+        symbol_options = (jobs, batch_size, cache_filename, check_content, use_nm, expand_archives)
+        file_symbols = Dependencies._collect_symbols(files_to_process, (), symbol_options, instrumentation)
+        self._link_file_list_filename = link_file_list_filename
+        self._symbol_options = symbol_options
+        self._unique_vertexes = unique_vertexes
+        self._symbol_table = SymbolTable()
+        # file -> (defined_symbols, undefined_symbols)
+        self._file_symbols = dict()
+        # vertex -> files with the same short name, or the single file with unique_vertexes
+        self._vertex_files = collections.OrderedDict()
+        # input -> files it's expanded to, archive members for archives
+        self._input_files = collections.OrderedDict()
+        # input -> its place in link order, duplicate definitions resolve by it
+        self._input_positions = dict()
+        self._file_stats = dict()
+        with instrumentation.stage("index_symbols"):
+            for link_input in files_to_process:
+                self._input_files.setdefault(link_input, [])
+                self._input_positions.setdefault(link_input, len(self._input_positions))
+                self._file_stats[link_input] = Dependencies._file_stat(link_input)
+            self._next_input_position = len(self._input_positions)
+            for link_input, file, defined, undefined in file_symbols:
+                self._add_file_symbols(link_input, file, defined, undefined)
+        # Find dependencies for undefined symbols.
+        with instrumentation.stage("build_graph"):
+            graph_builder = DirectedGraph.Builder()
+            for index, vertex in enumerate(self._vertex_files):
+                graph_builder.add_vertex(vertex)
+                destinations = self._vertex_destinations(vertex)
+                for defined_vertex, labels in destinations.iteritems():
+                    graph_builder.add_edge_with_labels(vertex, defined_vertex, labels)
+                if Dependencies._UNDEFINED_FILE in destinations:
+                    self._undefined_references += 1
+                instrumentation.count("edges_added", len(destinations))
+                instrumentation.progress("build_graph", index + 1, len(self._vertex_files))
+            self._dependency_graph = graph_builder.build_graph(compact=compact_graph)
+        self._graphs[0] = self._dependency_graph
+
+    @staticmethod
+    def _collect_symbols(inputs, unchanged_files, symbol_options, instrumentation):
+        """Returns collect_link_input_symbols() for inputs.  Cache entries
+        of files other than unchanged_files and collected ones are dropped."""
+        jobs, batch_size, cache_filename, check_content, use_nm, expand_archives = symbol_options
+        with instrumentation.stage("collect_symbols"):
+            cache = SymbolCache(cache_filename, check_content) if cache_filename is not None else None
+            file_symbols = collect_link_input_symbols(inputs, jobs, batch_size, cache, use_nm,
+                expand_archives, instrumentation)
+            if cache is not None:
+                cache.retain(itertools.chain(unchanged_files, (file for _, file, _, _ in file_symbols)))
+                cache.save()
+        return file_symbols
+
+    def _file_vertex(self, file):
+        return file if self._unique_vertexes else intern(short_filename(file))
 
-    def __init__(self, link_file_list_filename):
-        with open(link_file_list_filename, "r") as f:
-            files_to_process = f.read().splitlines()
-        symbol_table = SymbolTable()
-        undefined_symbols = []
+    def _add_file_symbols(self, link_input, file, defined, undefined):
+        # The same symbols and file names repeat across files and edges, keep
+        # a single copy of each.
+        file = intern(file)
+        defined = [intern(symbol) for symbol in defined]
+        undefined = [intern(symbol) for symbol in undefined]
+        input_files = self._input_files.setdefault(link_input, [])
+        if file not in input_files:
+            input_files.append(file)
+            index = len(input_files) - 1
+        else:
+            index = input_files.index(file)
+        # Position comes from link order, not from the first definition, so
+        # that files added by update() resolve symbols like in a fresh build.
+        self._symbol_table.set_file_position(file, (self._input_positions[link_input], index))
         # Remember where each defined symbol is defined.
-        for file in files_to_process:
-            defined, undefined = global_symbols(file)
+        for symbol in defined:
+            self._symbol_table.add_defined_symbol_from_file(symbol, file)
+        for symbol in undefined:
+            self._symbol_table.add_undefined_symbol_from_file(symbol, file)
+        self._file_symbols[file] = (defined, undefined)
+        vertex_files = self._vertex_files.setdefault(self._file_vertex(file), [])
+        if file not in vertex_files:
+            vertex_files.append(file)
+
+    def _remove_input_files(self, link_input):
+        """Removes symbols of files link_input expanded to, returns their vertexes."""
+        vertexes = set()
+        for file in self._input_files.pop(link_input):
+            defined, undefined = self._file_symbols.pop(file)
             for symbol in defined:
-                symbol_table.add_defined_symbol_from_file(symbol, file)
-            undefined_symbols.append((file, undefined))
-        # Find dependencies for undefined symbols.
-        graph_builder = DirectedGraph.Builder()
-        for file, undefined in undefined_symbols:
-            short_file = short_filename(file)
-            graph_builder.add_vertex(short_file)
+                self._symbol_table.remove_defined_symbol_from_file(symbol, file)
             for symbol in undefined:
-                defined_file = symbol_table.file_for_symbol(symbol)
-                defined_file = short_filename(defined_file) if defined_file is not None else Dependencies._UNDEFINED_FILE
-                graph_builder.add_edge_with_label(short_file, defined_file, readable_symbol_name(symbol))                    
-        self._dependency_graph = graph_builder.build_graph()
+                self._symbol_table.remove_undefined_symbol_from_file(symbol, file)
+            self._symbol_table.remove_file_position(file)
+            vertex = self._file_vertex(file)
+            self._vertex_files[vertex].remove(file)
+            if len(self._vertex_files[vertex]) == 0:
+                del self._vertex_files[vertex]
+            vertexes.add(vertex)
+        self._file_stats.pop(link_input, None)
+        return vertexes
+
+    @staticmethod
+    def _file_stat(file):
+        try:
+            stat = os.stat(split_archive_member_path(file)[0])
+        except OSError:
+            return None
+        return stat.st_mtime, stat.st_size
+
+    def _vertex_destinations(self, vertex):
+        """Returns {defined_vertex: readable_symbols} for undefined symbols of vertex files."""
+        destinations = collections.defaultdict(set)
+        for file in self._vertex_files.get(vertex, []):
+            for symbol in self._file_symbols[file][1]:
+                defined_file = self._symbol_table.file_for_symbol(symbol)
+                defined_file = self._file_vertex(defined_file) if defined_file is not None else Dependencies._UNDEFINED_FILE
+                destinations[defined_file].add(intern(readable_symbol_name(symbol)))
+        return dict(destinations)
+
+    @classmethod
+    def from_graph(cls, dependency_graph, report_cache_size=DEFAULT_REPORT_CACHE_SIZE, instrumentation=None):
+        """Returns Dependencies for already built file dependency graph.
+        Such Dependencies have no symbol tables and can't be updated."""
+        dependencies = cls.__new__(cls)
+        dependencies._init_with_graph(dependency_graph, report_cache_size, instrumentation)
+        return dependencies
+
+    def _init_with_graph(self, dependency_graph, report_cache_size, instrumentation=None):
+        self._instrumentation = instrumentation if instrumentation is not None else NO_INSTRUMENTATION
+        self._dependency_graph = dependency_graph
         self._marked_files = frozenset([Dependencies._UNDEFINED_FILE])
         self._dependency_dicts = [None, None]
+        # Whether dependency dicts have all reports computed.
+        self._loaded_dependency_dicts = [False, False]
+        # Graphs with and without marked files, and their reversed graphs.
+        self._graphs = [dependency_graph, None]
+        self._reversed_graphs = [None, None]
+        # (is_required, filename, include_marked_files) -> {filename: PathItem}
+        self._report_cache = LRUCache(report_cache_size)
+        # Guards report cache and closures, so queries can run in several threads.
+        self._cache_lock = threading.RLock()
+        self._file_symbols = None
+        self._symbol_table = None
+        self._input_files = None
+        self._input_positions = None
+        # Number of vertexes with an edge to undefined file vertex.
+        self._undefined_references = 0
+        self._unique_vertexes = False
+        # (vertexes, {short name: vertexes}) for name lookups, built on demand
+        self._vertex_names = None
+
+    def update(self, changed_files=(), removed_files=(), added_files=(), link_inputs=None):
+        """Applies object file changes after incremental build.
+
+        Only changed and added files are rescanned.  Symbol table and edges of
+        affected files are patched, cached reports are dropped only if their
+        reachability could change.  Added files go after all others unless
+        `link_inputs`, the whole link order after the change, is provided.
+        Reordering of existing files isn't detected.  Returns set of vertexes
+        whose outgoing edges changed."""
+        if self._file_symbols is None:
+            raise ValueError("Dependencies without symbol tables can't be updated")
+        removed_files = [f for f in removed_files if f in self._input_files]
+        changed_files = [f for f in changed_files if f in self._input_files]
+        added_files = [f for f in added_files if f not in self._input_files]
+        replaced_inputs = frozenset(removed_files + changed_files)
+        unchanged_files = [file for link_input, files in self._input_files.iteritems()
+            if link_input not in replaced_inputs for file in files]
+        new_symbols = Dependencies._collect_symbols(changed_files + added_files, unchanged_files,
+            self._symbol_options, self._instrumentation)
+        # Symbols which can be resolved to another file now.
+        candidate_symbols = set()
+        for link_input in removed_files + changed_files:
+            for file in self._input_files[link_input]:
+                candidate_symbols.update(self._file_symbols[file][0])
+        for _, _, defined, _ in new_symbols:
+            candidate_symbols.update(defined)
+        resolution_before = dict((symbol, self._symbol_table.file_for_symbol(symbol))
+            for symbol in candidate_symbols)
+        affected_vertexes = set()
+        for link_input in removed_files + changed_files:
+            affected_vertexes.update(self._remove_input_files(link_input))
+        for link_input in removed_files:
+            del self._input_positions[link_input]
+        for link_input in changed_files + added_files:
+            self._input_files.setdefault(link_input, [])
+            if link_input not in self._input_positions:
+                self._input_positions[link_input] = self._next_input_position
+                self._next_input_position += 1
+            self._file_stats[link_input] = Dependencies._file_stat(link_input)
+        if link_inputs is not None:
+            self._set_input_positions(link_inputs)
+        for link_input, file, defined, undefined in new_symbols:
+            affected_vertexes.add(self._file_vertex(file))
+            self._add_file_symbols(link_input, file, defined, undefined)
+        for symbol, defined_file in resolution_before.iteritems():
+            if self._symbol_table.file_for_symbol(symbol) != defined_file:
+                affected_vertexes.update(self._file_vertex(f) for f in self._symbol_table.files_using_symbol(symbol))
+        # Collect changed outgoing edges, None means vertex is removed.
+        graph = self._dependency_graph
+        changes = dict()
+        for vertex in affected_vertexes:
+            old_destinations = graph._destinations(vertex) if graph.has_vertex(vertex) else None
+            new_destinations = self._vertex_destinations(vertex) if vertex in self._vertex_files else None
+            if new_destinations != old_destinations:
+                changes[vertex] = (old_destinations, new_destinations)
+        # Undefined file vertex exists while there are edges to it.
+        undefined_file = Dependencies._UNDEFINED_FILE
+        for old_destinations, new_destinations in changes.itervalues():
+            self._undefined_references += ((undefined_file in (new_destinations or {})) -
+                (undefined_file in (old_destinations or {})))
+        is_referenced = self._undefined_references > 0
+        if is_referenced and not graph.has_vertex(undefined_file):
+            changes[undefined_file] = (None, dict())
+        elif not is_referenced and graph.has_vertex(undefined_file):
+            changes[undefined_file] = (graph._destinations(undefined_file), None)
+        # Vertexes whose outgoing or incoming edges changed.
+        changed_sources = set()
+        changed_destinations = set()
+        for vertex, (old_destinations, new_destinations) in changes.iteritems():
+            changed_sources.add(vertex)
+            if (old_destinations is None) or (new_destinations is None):
+                changed_destinations.add(vertex)
+            old_destinations = old_destinations or {}
+            new_destinations = new_destinations or {}
+            for to_vertex in set(old_destinations) | set(new_destinations):
+                if old_destinations.get(to_vertex) != new_destinations.get(to_vertex):
+                    changed_destinations.add(to_vertex)
+        if len(changes) == 0:
+            return changed_sources
+        if isinstance(graph, CompactDirectedGraph):
+            # Compact arrays can't be patched in place, the graph stays
+            # dict-based after the first change instead of being recompacted.
+            graph = DirectedGraph(graph._adjacency_dict())
+        for vertex, (_, new_destinations) in changes.iteritems():
+            if new_destinations is not None:
+                graph._set_destinations(vertex, new_destinations)
+        for vertex, (_, new_destinations) in changes.iteritems():
+            if new_destinations is None:
+                graph._remove_vertex(vertex)
+        self._dependency_graph = graph
+        self._vertex_names = None
+        self._graphs = [graph, None]
+        self._reversed_graphs = [None, None]
+        self._dependency_dicts = [None, None]
+        self._loaded_dependency_dicts = [False, False]
+        # Reachability from a file changes only if it reached a changed vertex.
+        for key in self._report_cache.keys():
+            is_required, filename, _ = key
+            changed_vertexes = changed_sources if is_required else changed_destinations
+            dependencies = self._report_cache.get(key)
+            if (filename in changed_vertexes) or any(v in changed_vertexes for v in dependencies):
+                self._report_cache.pop(key)
+        return changed_sources
+
+    def _set_input_positions(self, link_inputs):
+        """Renumbers known inputs and their files, inputs from link_inputs go
+        first in its order, the rest keep their relative order after them."""
+        order = [f for f in link_inputs if f in self._input_files]
+        ordered_inputs = frozenset(order)
+        order.extend(sorted((f for f in self._input_files if f not in ordered_inputs),
+            key=self._input_positions.get))
+        self._input_positions = dict()
+        for link_input in order:
+            self._input_positions.setdefault(link_input, len(self._input_positions))
+        self._next_input_position = len(self._input_positions)
+        for link_input, files in self._input_files.iteritems():
+            for index, file in enumerate(files):
+                self._symbol_table.set_file_position(file, (self._input_positions[link_input], index))
+
+    def watch(self, interval=1.0, callback=None, iterations=None):
+        """Polls link file list and object files every `interval` seconds and
+        applies update() for added, removed and rewritten files.  Calls
+        callback(changed_files, removed_files, added_files, changed_vertexes)
+        after each update.  Runs forever unless `iterations` is provided."""
+        if self._file_symbols is None:
+            raise ValueError("Dependencies without symbol tables can't be updated")
+        iteration = 0
+        while (iterations is None) or (iteration < iterations):
+            iteration += 1
+            time.sleep(interval)
+            files = list(read_link_inputs(self._link_file_list_filename))
+            known_files = frozenset(self._input_files.keys())
+            added_files = [f for f in files if f not in known_files]
+            removed_files = list(known_files - frozenset(files))
+            changed_files = [f for f in files if (f in known_files) and
+                (Dependencies._file_stat(f) != self._file_stats.get(f))]
+            if len(added_files) + len(removed_files) + len(changed_files) == 0:
+                continue
+            changed_vertexes = self.update(changed_files, removed_files, added_files, link_inputs=files)
+            if callback is not None:
+                callback(changed_files, removed_files, added_files, changed_vertexes)
 
     def mark_files(self, link_file_list_filename):
-        with open(link_file_list_filename, "r") as f:
-            files = f.read().splitlines()
-        files = [short_filename(f) for f in files]
-        files.append(Dependencies._UNDEFINED_FILE)
-        self._marked_files = frozenset(files)
+        """Marks files read by read_link_inputs(), archives mark all their members."""
+        vertexes = [Dependencies._UNDEFINED_FILE]
+        for f in read_link_inputs(link_file_list_filename):
+            if (self._input_files is not None) and (f in self._input_files):
+                vertexes.extend(self._file_vertex(file) for file in self._input_files[f])
+            else:
+                vertexes.append(self._vertex(f))
+        self._marked_files = frozenset(vertexes)
+        # Results without marked files are stale now.
+        self._dependency_dicts[1] = None
+        self._loaded_dependency_dicts[1] = False
+        self._graphs[1] = None
+        self._reversed_graphs[1] = None
+        self._report_cache.clear()
 
     def files(self):
         return self._dependency_graph.vertexes()
 
+    def display_name(self, vertex):
+        """Returns short name of vertex for output."""
+        return short_filename(vertex)
+
+    def _vertex(self, filename):
+        """Returns vertex for file path, vertex or short name.  Short names
+        shared by several vertexes are ambiguous and raise KeyError."""
+        if self._vertex_names is None:
+            vertexes = self._dependency_graph.vertexes()
+            short_name_vertexes = collections.defaultdict(list)
+            for vertex in vertexes:
+                short_name_vertexes[short_filename(vertex)].append(vertex)
+            self._vertex_names = (vertexes, dict(short_name_vertexes))
+        vertexes, short_name_vertexes = self._vertex_names
+        if filename in vertexes:
+            return filename
+        short_name = short_filename(filename)
+        if short_name in vertexes:
+            return short_name
+        candidates = short_name_vertexes.get(short_name, ())
+        if len(candidates) > 1:
+            raise KeyError("%s is ambiguous: %s" % (filename, ", ".join(sorted(candidates))))
+        return candidates[0] if len(candidates) == 1 else short_name
+
+    def _symbols(self):
+        if self._symbol_table is None:
+            raise ValueError("Dependencies without symbol tables have no symbol index")
+        return self._symbol_table
+
+    def symbol_definitions(self, symbol):
+        """Returns files defining symbol.  If there are several, symbol
+        resolves to the last one."""
+        return self._symbols().files_defining_symbol(symbol)
+
+    def symbol_users(self, symbol):
+        """Returns frozenset of files where symbol is undefined."""
+        return self._symbols().files_using_symbol(symbol)
+
+    def duplicate_symbols(self):
+        """Returns {symbol: files} for symbols defined in several files."""
+        return self._symbols().duplicate_symbols()
+
+    def unresolved_symbols(self):
+        """Returns {symbol: files} for undefined symbols which no file defines."""
+        return self._symbols().unresolved_symbols()
+
+    def find_symbols(self, pattern):
+        """Returns sorted symbols matching shell-style pattern like
+        '_OBJC_CLASS_$_NS*'.  Symbols are kept sorted, so only those with
+        pattern prefix are matched."""
+        return self._symbols().symbols_matching(pattern)
+
+    def dependency_symbols(self, file1, file2):
+        """Returns sorted symbols which make file1 depend on file2."""
+        symbol_table = self._symbols()
+        file1 = self._vertex(file1)
+        file2 = self._vertex(file2)
+        result = set()
+        for file in self._vertex_files.get(file1, []):
+            for symbol in self._file_symbols[file][1]:
+                defined_file = symbol_table.file_for_symbol(symbol)
+                defined_vertex = self._file_vertex(defined_file) if defined_file is not None else Dependencies._UNDEFINED_FILE
+                if defined_vertex == file2:
+                    result.add(symbol)
+        return sorted(result)
+
     def marked_files(self):
         return self._marked_files
 
-    def dump(self, filename, write_edge_labels=False):
+    def dump(self, filename, write_edge_labels=False, condensed=False):
+        """Writes DOT graph to filename or file-like object.  With `condensed`
+        every dependency cycle is collapsed into a single vertex."""
         assert not self._dependency_graph.is_empty()
-        self._dependency_graph.write_dot_file(filename, write_edge_labels)
+        graph = self.condensed_graph() if condensed else self._dependency_graph
+        self._write_dot(graph, filename, write_edge_labels)
 
     def dump_subgraph(self, filename, vertexes, write_edge_labels=False):
-        subgraph = self._dependency_graph.subgraph(vertexes)
+        subgraph = self._dependency_graph.subgraph_view(frozenset(self._vertex(v) for v in vertexes))
         assert not subgraph.is_empty()
-        subgraph.write_dot_file(filename, write_edge_labels)
+        self._write_dot(subgraph, filename, write_edge_labels)
+
+    def _write_dot(self, graph, filename, write_edge_labels):
+        if not hasattr(filename, "write"):
+            with open_output(filename) as f:
+                return self._write_dot(graph, f, write_edge_labels)
+        vertex_labels = self.display_name if self._unique_vertexes else None
+        with self._instrumentation.stage("write_dot"):
+            graph.write_dot(self._instrumentation.counting_writes(filename), write_edge_labels, vertex_labels)
+
+    _EDGE_LIST_FORMAT = "dependency-viz-edge-list"
+    _EDGE_LIST_VERSION = 1
+
+    def save(self, filename):
+        """Writes dependency graph and marked files to filename or file-like
+        object as JSON lines, which load() reads back without running `nm`."""
+        if not hasattr(filename, "write"):
+            with open_output(filename) as f:
+                return self.save(f)
+        header = {"format": Dependencies._EDGE_LIST_FORMAT, "version": Dependencies._EDGE_LIST_VERSION,
+            "marked_files": sorted(self._marked_files), "unique_vertexes": self._unique_vertexes}
+        with self._instrumentation.stage("save"):
+            f = self._instrumentation.counting_writes(filename)
+            f.write(json.dumps(header))
+            f.write("\n")
+            self._dependency_graph.write_edge_list(f)
+
+    @classmethod
+    def load(cls, filename, compact_graph=False, report_cache_size=DEFAULT_REPORT_CACHE_SIZE,
+             instrumentation=None):
+        """Returns Dependencies written by save() to filename or file-like object."""
+        if not hasattr(filename, "read"):
+            with open_input(filename) as f:
+                return cls.load(f, compact_graph, report_cache_size, instrumentation)
+        header = json.loads(filename.readline())
+        if (header.get("format") != Dependencies._EDGE_LIST_FORMAT or
+                header.get("version") != Dependencies._EDGE_LIST_VERSION):
+            raise ValueError("Unsupported dependency graph format")
+        dependency_graph = DirectedGraph.read_edge_list(filename, compact_graph)
+        dependencies = cls.from_graph(dependency_graph, report_cache_size, instrumentation)
+        dependencies._marked_files = frozenset(_native_string(f) for f in header["marked_files"])
+        dependencies._unique_vertexes = header.get("unique_vertexes", False)
+        return dependencies
 
     def required_dependencies(self, filename, verbose=True, include_marked_files=True):
-        filename = short_filename(filename)
-        dependencies = self._all_dependencies_dict(include_marked_files)[filename].required_dependencies()
+        filename = self._vertex(filename)
+        dependencies = self._file_dependencies(True, filename, include_marked_files)
         return dependencies if verbose else set(dependencies.keys())
 
     def provided_dependencies(self, filename, verbose=True, include_marked_files=True):
-        filename = short_filename(filename)
-        dependencies = self._all_dependencies_dict(include_marked_files)[filename].provided_dependencies()
+        filename = self._vertex(filename)
+        dependencies = self._file_dependencies(False, filename, include_marked_files)
         return dependencies if verbose else set(dependencies.keys())
 
-    def _all_dependencies_dict(self, include_marked_files):
+    def _graph(self, include_marked_files):
+        graph_index = 0 if include_marked_files else 1
+        if self._graphs[graph_index] is None:
+            left_files = self.files() - self.marked_files()
+            self._graphs[graph_index] = self._dependency_graph.subgraph_view(left_files)
+        return self._graphs[graph_index]
+
+    def _reversed_graph(self, include_marked_files):
+        graph_index = 0 if include_marked_files else 1
+        if self._reversed_graphs[graph_index] is None:
+            self._reversed_graphs[graph_index] = self._graph(include_marked_files).reversed_view()
+        return self._reversed_graphs[graph_index]
+
+    def _file_dependencies(self, is_required, filename, include_marked_files):
+        """Returns {filename: PathItem} for required or provided dependencies
+        of a single file.  Only this file reachability is computed, results
+        are kept in LRU cache."""
+        key = (is_required, filename, include_marked_files)
+        with self._cache_lock:
+            dependencies = self._report_cache.get(key)
+        if dependencies is None:
+            if is_required:
+                graph = self._graph(include_marked_files)
+            else:
+                graph = self._reversed_graph(include_marked_files)
+            dependencies = graph.reachability_table(filename)
+            with self._cache_lock:
+                self._report_cache.put(key, dependencies)
+        return dependencies
+
+    def _all_dependencies_dict(self, include_marked_files, jobs=1):
+        # Threads asking for closure at the same time wait for a single computation.
+        with self._cache_lock:
+            return self._locked_all_dependencies_dict(include_marked_files, jobs)
+
+    def _locked_all_dependencies_dict(self, include_marked_files, jobs):
         dict_index = 0 if include_marked_files else 1
-        if self._dependency_dicts[dict_index] is None:
+        if (jobs > 1) and not self._loaded_dependency_dicts[dict_index]:
+            dependency_dict = {}
+            with self._instrumentation.stage("reachability_tables"):
+                required_tables, provided_tables = all_reachability_tables(
+                    [self._graph(include_marked_files), self._reversed_graph(include_marked_files)], jobs,
+                    instrumentation=self._instrumentation)
+            for filename, required_table in required_tables.iteritems():
+                dependency_dict[filename] = DependencyReport(filename, required_table, provided_tables[filename])
+            self._dependency_dicts[dict_index] = dependency_dict
+            self._loaded_dependency_dicts[dict_index] = True
+        elif self._dependency_dicts[dict_index] is None:
             dependency_dict = {}
-            dependency_graph = self._dependency_graph
-            if not include_marked_files:
-                left_files = self.files() - self.marked_files()
-                dependency_graph = dependency_graph.subgraph(left_files)
-            reversed_dependency_graph = dependency_graph.reversed_graph()
+            dependency_graph = self._graph(include_marked_files)
+            # Counts come from transitive closure, PathItem dicts are computed
+            # only for reports which are asked for them.
+            with self._instrumentation.stage("closure"):
+                required_closure = TransitiveClosure(dependency_graph)
+                provided_closure = TransitiveClosure(dependency_graph, reverse=True)
+            self._instrumentation.count("vertexes_closed", 2 * len(dependency_graph.vertexes()))
             for filename in dependency_graph.vertexes():
-                required_dependencies = dependency_graph.reachable_vertexes(filename)
-                provided_dependencies = reversed_dependency_graph.reachable_vertexes(filename)
-                report = DependencyReport(filename, required_dependencies, provided_dependencies)
+                report = DependencyReport(filename,
+                    functools.partial(self._file_dependencies, True, filename, include_marked_files),
+                    functools.partial(self._file_dependencies, False, filename, include_marked_files),
+                    required_closure.reachable_count(filename),
+                    provided_closure.reachable_count(filename))
                 dependency_dict[filename] = report
             self._dependency_dicts[dict_index] = dependency_dict
         return self._dependency_dicts[dict_index]
 
-    def all_dependencies(self, include_marked_files=True):
-        return self._all_dependencies_dict(include_marked_files).values()
-
-    def files_connection(self, file1, file2):
-        file1 = short_filename(file1)
-        file2 = short_filename(file2)
+    def strong_connected_components(self, include_marked_files=True):
+        """Returns CycleReport for every dependency cycle, largest first."""
+        graph = self._graph(include_marked_files)
         result = []
-        direct_dependencies = self.required_dependencies(file1, verbose=True, include_marked_files=True)
-        if file2 in direct_dependencies:
-            result.append(direct_dependencies[file2].path_from_root(direct_dependencies))
-        reverse_dependencies = self.required_dependencies(file2, verbose=True, include_marked_files=True)
-        if file1 in reverse_dependencies:
-            result.append(reverse_dependencies[file1].path_from_root(reverse_dependencies))
+        for index, files in enumerate(self._cycles(include_marked_files)):
+            members = frozenset(files)
+            edges = []
+            for from_file in files:
+                for to_file, edge_labels in sorted(graph._destinations(from_file).iteritems()):
+                    if to_file in members:
+                        edges.append((from_file, to_file, edge_labels))
+            edge_labels = dict(((from_file, to_file), labels) for from_file, to_file, labels in edges)
+            closing_edges = [(from_file, to_file, edge_labels[(from_file, to_file)])
+                for from_file, to_file in graph.back_edges(members)]
+            closing_edges.sort(key=lambda edge: (len(edge[2]), edge[0], edge[1]))
+            result.append(CycleReport("cycle_%d" % (index + 1), files, edges, closing_edges))
         return result
 
+    def _cycles(self, include_marked_files):
+        """Returns sorted file lists of components with several files, largest first."""
+        components = self._graph(include_marked_files).strongly_connected_components()
+        components = [sorted(component) for component in components if len(component) > 1]
+        components.sort(key=lambda component: (-len(component), component[0]))
+        return components
+
+    def condensed_graph(self, include_marked_files=True):
+        """Returns acyclic graph where every dependency cycle is a single
+        vertex named like its CycleReport."""
+        vertex_groups = dict()
+        for index, files in enumerate(self._cycles(include_marked_files)):
+            for file in files:
+                vertex_groups[file] = "cycle_%d" % (index + 1)
+        return self._graph(include_marked_files).condensed_graph(vertex_groups)
+
+    def all_dependencies(self, include_marked_files=True, jobs=1):
+        """Returns DependencyReport of every file.  Reports compute their
+        dependencies on demand, with `jobs` > 1 dependencies of all files are
+        computed at once by `jobs` processes."""
+        return self._all_dependencies_dict(include_marked_files, jobs).values()
+
+    def files_connection(self, file1, file2):
+        """Returns shortest paths file1 -> file2 and file2 -> file1 which exist,
+        as lists of PathItems."""
+        return self.files_connections([(file1, file2)])[0]
+
+    def files_connections(self, file_pairs):
+        """Returns files_connection() result for every (file1, file2) pair.
+        Dependencies of every file are computed once for all pairs."""
+        file_pairs = [(self._vertex(file1), self._vertex(file2)) for file1, file2 in file_pairs]
+        tables = dict()
+        def required_dependencies(file):
+            table = tables.get(file)
+            if table is None:
+                table = tables[file] = self._file_dependencies(True, file, True)
+            return table
+        results = []
+        for file1, file2 in file_pairs:
+            result = []
+            for from_file, to_file in [(file1, file2), (file2, file1)]:
+                dependencies = required_dependencies(from_file)
+                if to_file in dependencies:
+                    result.append(dependencies[to_file].path_from_root(dependencies))
+            results.append(result)
+        return results
+
     # Convenience methods which provide answers for common questions.
 
-    def _top_files(self, criteria_method_name, count, include_marked_files=True, descending=True):
-        result = self.all_dependencies()
-        result.sort(key=methodcaller(criteria_method_name), reverse=descending)
-        return result[:count]
+    @staticmethod
+    def _ranking_key(report, criteria_method_name):
+        # Higher values go first, equal values are ordered by file name.
+        return (-getattr(report, criteria_method_name)(), report.filename())
+
+    def _top_files(self, criteria_method_name, count, include_marked_files=True, reports=None):
+        """Returns `count` reports with the largest criteria values.  Reports
+        come with dependency counts, so count criteria don't compute
+        dependencies."""
+        if reports is None:
+            reports = self._all_dependencies_dict(include_marked_files).itervalues()
+        return heapq.nsmallest(count, reports,
+            key=lambda report: Dependencies._ranking_key(report, criteria_method_name))
 
     # Which file has most dependencies?
-    def most_dependent_file(self, count=5):
-        return self._top_files("required_dependencies_count", count, include_marked_files=True)
+    def most_dependent_file(self, count=5, include_marked_files=True):
+        return self._top_files("required_dependencies_count", count, include_marked_files)
 
     # What is the longest chain of dependencies?
-    def longest_dependency_chain(self, count=5):
-        return self._top_files("longest_required_distance", count, include_marked_files=True)
+    def longest_dependency_chain(self, count=5, include_marked_files=True):
+        """Files are checked in order of their chain length upper bound and
+        search stops when no remaining file can get into the result.  Only
+        reachability of checked files is computed, not transitive closure."""
+        graph = self._graph(include_marked_files)
+        candidates = [(-bound, vertex) for vertex, bound in graph.distance_bounds().iteritems()]
+        heapq.heapify(candidates)
+        # Sorted (-distance, vertex, required_count) of the best files found so far.
+        best = []
+        while candidates and count > 0:
+            negative_bound, vertex = heapq.heappop(candidates)
+            if (len(best) == count) and ((negative_bound, vertex) > best[-1][:2]):
+                break
+            required_table = self._file_dependencies(True, vertex, include_marked_files)
+            bisect.insort(best, (-required_table.max_distance(), vertex, len(required_table)))
+            del best[count:]
+        return [DependencyReport(vertex,
+            functools.partial(self._file_dependencies, True, vertex, include_marked_files),
+            functools.partial(self._file_dependencies, False, vertex, include_marked_files),
+            required_count) for _, vertex, required_count in best]
 
     # What file is most needed?
-    def most_used_file(self, count=5):
-        return self._top_files("provided_dependencies_count", count, include_marked_files=False)
+    def most_used_file(self, count=5, include_marked_files=False):
+        return self._top_files("provided_dependencies_count", count, include_marked_files)
 
     # What file is most needed among those without external dependencies?
-    def most_used_independent_file(self, count=5):
-        independent_files = [report for report in self.all_dependencies(include_marked_files=False)
-            if report.required_dependencies_count() == 0]
-        independent_files.sort(key=methodcaller("provided_dependencies_count"), reverse=True)
-        return independent_files[:count]
+    def most_used_independent_file(self, count=5, include_marked_files=False):
+        independent_files = (report for report in self._all_dependencies_dict(include_marked_files).itervalues()
+            if report.required_dependencies_count() == 0)
+        return self._top_files("provided_dependencies_count", count, reports=independent_files)
+
+def _path_item_json(path_item):
+    return {"vertex": path_item.vertex, "prev_vertex": path_item.prev_vertex,
+        "distance": path_item.distance, "edge_labels": sorted(path_item.edge_labels)}
+
+def _report_json(report):
+    return {"file": report.filename(), "required_count": report.required_dependencies_count(),
+        "provided_count": report.provided_dependencies_count()}
+
+class _ReadWriteLock(object):
+    """Lock held by many readers or a single writer.  Waiting writer stops
+    new readers, so a stream of reads doesn't starve it."""
+    def __init__(self):
+        self._condition = threading.Condition(threading.Lock())
+        self._readers = 0
+        self._writers_waiting = 0
+        self._is_writing = False
+
+    @contextlib.contextmanager
+    def reading(self):
+        with self._condition:
+            while self._is_writing or (self._writers_waiting > 0):
+                self._condition.wait()
+            self._readers += 1
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._readers -= 1
+                if self._readers == 0:
+                    self._condition.notify_all()
+
+    @contextlib.contextmanager
+    def writing(self):
+        with self._condition:
+            self._writers_waiting += 1
+            while self._is_writing or (self._readers > 0):
+                self._condition.wait()
+            self._writers_waiting -= 1
+            self._is_writing = True
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._is_writing = False
+                self._condition.notify_all()
+
+class DependencyQueries(object):
+    """Answers JSON queries about Dependencies shared between threads.
+
+    A query is {"method": name, "params": {...}}, the answer is
+    {"result": ...} or {"error": message}.  Read-only queries run
+    concurrently, closures which several clients ask for are computed once
+    and shared through Dependencies caches.  update and mark_files change
+    dependencies and wait until they are the only query running."""
+    _TOP_FILES_METHODS = ("most_dependent_file", "longest_dependency_chain",
+        "most_used_file", "most_used_independent_file")
+    _WRITE_METHODS = ("update", "mark_files")
+
+    def __init__(self, dependencies):
+        self._dependencies = dependencies
+        self._lock = _ReadWriteLock()
+
+    def warm_up(self):
+        """Computes dependency counts of all files with and without marked files."""
+        with self._lock.reading():
+            self._dependencies.all_dependencies(include_marked_files=True)
+            self._dependencies.all_dependencies(include_marked_files=False)
+
+    def answer(self, query):
+        try:
+            method = query["method"]
+            params = dict((_native_string(key), value) for key, value in query.get("params", {}).iteritems())
+            handler = getattr(self, "_query_" + method, None)
+            if method in DependencyQueries._TOP_FILES_METHODS:
+                handler = functools.partial(self._top_files, method)
+            if handler is None:
+                raise ValueError("Unknown method %s" % method)
+            if method in DependencyQueries._WRITE_METHODS:
+                lock = self._lock.writing()
+            else:
+                lock = self._lock.reading()
+            with lock:
+                return {"result": handler(**params)}
+        except Exception as e:
+            return {"error": "%s: %s" % (type(e).__name__, e)}
+
+    def _query_files(self):
+        return sorted(self._dependencies.files())
+
+    def _query_update(self, changed_files=(), removed_files=(), added_files=()):
+        """Returns sorted vertexes whose outgoing edges changed."""
+        return sorted(self._dependencies.update([_native_string(f) for f in changed_files],
+            [_native_string(f) for f in removed_files], [_native_string(f) for f in added_files]))
+
+    def _query_mark_files(self, link_file_list):
+        self._dependencies.mark_files(_native_string(link_file_list))
+        return sorted(self._dependencies.marked_files())
+
+    def _file_dependencies(self, method_name, file, verbose=True, include_marked_files=True):
+        dependencies = getattr(self._dependencies, method_name)(_native_string(file), True, include_marked_files)
+        if not verbose:
+            return sorted(dependencies.keys())
+        return sorted((_path_item_json(path_item) for path_item in dependencies.itervalues()),
+            key=lambda item: (item["distance"], item["vertex"]))
+
+    def _query_required_dependencies(self, file, verbose=True, include_marked_files=True):
+        return self._file_dependencies("required_dependencies", file, verbose, include_marked_files)
+
+    def _query_provided_dependencies(self, file, verbose=True, include_marked_files=True):
+        return self._file_dependencies("provided_dependencies", file, verbose, include_marked_files)
+
+    def _query_files_connection(self, file1=None, file2=None, pairs=None):
+        """Answers a single file1, file2 query or a batch of [file1, file2] pairs."""
+        single = pairs is None
+        if single:
+            pairs = [(file1, file2)]
+        connections = self._dependencies.files_connections(
+            [(_native_string(f1), _native_string(f2)) for f1, f2 in pairs])
+        result = [[[_path_item_json(path_item) for path_item in path] for path in paths] for paths in connections]
+        return result[0] if single else result
+
+    def _top_files(self, method_name, count=5, include_marked_files=None):
+        method = getattr(self._dependencies, method_name)
+        reports = method(count) if include_marked_files is None else method(count, include_marked_files)
+        result = [_report_json(report) for report in reports]
+        if method_name == "longest_dependency_chain":
+            for item, report in zip(result, reports):
+                item["longest_distance"] = report.longest_required_distance()
+        return result
+
+    def _query_dump_subgraph(self, files, write_edge_labels=False):
+        output = StringIO.StringIO()
+        self._dependencies.dump_subgraph(output, frozenset(_native_string(f) for f in files), write_edge_labels)
+        return output.getvalue()
+
+class _QueryRequestHandler(SocketServer.StreamRequestHandler):
+    """Reads JSON queries, one per line, and writes answers the same way."""
+    def handle(self):
+        for line in iter(self.rfile.readline, ""):
+            if len(line.strip()) == 0:
+                continue
+            try:
+                query = json.loads(line)
+            except ValueError as e:
+                answer = {"error": "Malformed query: %s" % e}
+            else:
+                answer = self.server.queries.answer(query)
+            self.wfile.write(json.dumps(answer))
+            self.wfile.write("\n")
+            self.wfile.flush()
+
+def _is_socket(path):
+    try:
+        return stat.S_ISSOCK(os.lstat(path).st_mode)
+    except OSError:
+        return False
+
+class DependencyServer(SocketServer.ThreadingMixIn, SocketServer.UnixStreamServer):
+    """Serves DependencyQueries on a Unix domain socket at `socket_path`,
+    every client connection is handled in its own thread."""
+    daemon_threads = True
+
+    def __init__(self, socket_path, dependencies):
+        # A socket left by previous server is replaced, any other file is kept.
+        if _is_socket(socket_path):
+            os.remove(socket_path)
+        elif os.path.lexists(socket_path):
+            raise ValueError("%s exists and is not a socket" % socket_path)
+        SocketServer.UnixStreamServer.__init__(self, socket_path, _QueryRequestHandler)
+        self.queries = DependencyQueries(dependencies)
+
+    def server_close(self):
+        SocketServer.UnixStreamServer.server_close(self)
+        if _is_socket(self.server_address):
+            os.remove(self.server_address)
+
+def query_server(socket_path, method, **params):
+    """Sends a single query to DependencyServer and returns its result."""
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        client.connect(socket_path)
+        f = client.makefile("rw")
+        f.write(json.dumps({"method": method, "params": params}))
+        f.write("\n")
+        f.flush()
+        answer = json.loads(f.readline())
+    finally:
+        client.close()
+    if "error" in answer:
+        raise ValueError(answer["error"])
+    return answer["result"]
 
 def print_usage():
     print """You must provide LINK_FILE_LIST_FILE
-Usage: dependency-viz LINK_FILE_LIST_FILE"""
+Usage: dependency-viz [OPTIONS] LINK_FILE_LIST_FILE
+       dependency-viz [OPTIONS] --serve SOCKET (LINK_FILE_LIST_FILE | --load GRAPH_FILE)
+
+LINK_FILE_LIST_FILE can also be a response file (@file or .rsp) or a linker map file.
+
+  --profile          print stage timings and counters to stderr
+  --expand-archives  make every member of static archives a separate file
+  --unique-vertexes  don't merge files with the same name from different directories
+  --symbol-cache     keep symbols in CACHE_FILE and rescan only changed object files
+  --check-content    compare content of cached files whose modification time changed
+  --serve            keep dependencies loaded and answer JSON queries on Unix socket SOCKET
+  --load             read dependency graph written by Dependencies.save() instead of running nm"""
 
 def get_files_to_process():
     if len(sys.argv) != 2:
@@ -377,13 +3076,56 @@ def get_files_to_process():
         files_to_process = f.read().splitlines()
     return files_to_process
 
+def _pop_option_value(arguments, option):
+    if option not in arguments:
+        return None
+    index = arguments.index(option)
+    if index + 1 >= len(arguments):
+        print_usage()
+        sys.exit(1)
+    value = arguments[index + 1]
+    del arguments[index:index + 2]
+    return value
+
+def serve(socket_path, dependencies):
+    """Answers queries about dependencies on socket_path until interrupted."""
+    server = DependencyServer(socket_path, dependencies)
+    server.queries.warm_up()
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
 def main():
-    if len(sys.argv) != 2:
+    arguments = sys.argv[1:]
+    flags = dict((flag, flag in arguments) for flag in ["--profile", "--expand-archives", "--unique-vertexes",
+        "--check-content"])
+    arguments = [argument for argument in arguments if argument not in flags]
+    profile = flags["--profile"]
+    cache_filename = _pop_option_value(arguments, "--symbol-cache")
+    socket_path = _pop_option_value(arguments, "--serve")
+    graph_filename = _pop_option_value(arguments, "--load")
+    if len(arguments) != (0 if graph_filename is not None else 1) or (graph_filename is not None and socket_path is None):
         print_usage()
         sys.exit(1)
-    link_file_list_filename = sys.argv[1]
-    dependencies = Dependencies(link_file_list_filename)
-    dependencies.dump("dependency.dot")
+    if (socket_path is not None) and os.path.lexists(socket_path) and not _is_socket(socket_path):
+        sys.stderr.write("%s exists and is not a socket\n" % socket_path)
+        sys.exit(1)
+    instrumentation = Instrumentation([PrintSink()]) if profile else None
+    if graph_filename is not None:
+        dependencies = Dependencies.load(graph_filename, instrumentation=instrumentation)
+    else:
+        dependencies = Dependencies(arguments[0], cache_filename=cache_filename, instrumentation=instrumentation,
+            expand_archives=flags["--expand-archives"], unique_vertexes=flags["--unique-vertexes"],
+            check_content=flags["--check-content"])
+    if socket_path is not None:
+        serve(socket_path, dependencies)
+    else:
+        dependencies.dump("dependency.dot")
+    if instrumentation is not None:
+        instrumentation.report()
 
 if __name__ == "__main__":
     main()
@@ -393,6 +3135,7 @@ if __name__ == "__main__":
 #
 # How I want to use dependency-visualizer (wishful thinking):
 # > dependencies = Dependencies(linkFileListFilename)
+# > dependencies = Dependencies("app.map", expand_archives=True, unique_vertexes=True)
 # > dependencies.mark_files(unitTestLinkFileListFilename)
 #
 # -- write a graph
@@ -410,12 +3153,24 @@ if __name__ == "__main__":
 # > print dependencies.provided_dependencies(filename, verbose, include_marked_files)
 # > dependencies.all_dependencies()  # returns filename with provided and required dependencies
 # > dependencies.files_connection(file1, file2)  # paths file1->file2, file2->file1
+# > dependencies.files_connections([(file1, file2), (file1, file3)])
 #
 # -- pretty print dependencies
 # > r.print_layered_dependencies(r.required_dependencies().values())
 #
 # -- kinda cycle detection
 # > dependencies.strong_connected_components()
+#
+# -- who defines and uses symbols
+# > dependencies.symbol_definitions(symbol)  # several files for duplicates
+# > dependencies.symbol_users(symbol)
+# > dependencies.dependency_symbols(file1, file2)  # why file1 depends on file2
+# > dependencies.unresolved_symbols()
+# > dependencies.find_symbols("_OBJC_CLASS_$_NS*")
+#
+# -- query a graph kept warm by `dependency-viz --serve SOCKET ...`
+# > query_server(SOCKET, "required_dependencies", file=filename, verbose=False)
+# > query_server(SOCKET, "most_used_file", count=10)
 
 # TODO:
 # - fix function symbols, because they are T _FunctionName, S _FunctionName.eh
@@ -1,8 +1,36 @@
 #!/usr/bin/env python
 
+import contextlib
+import gzip
+import json
+import os
+import random
+import shutil
+import StringIO
+import subprocess
+import sys
+import tempfile
+import threading
 import unittest
+import dependency_viz
 from dependency_viz import *
 
+def has_executable(name):
+	return any(os.access(os.path.join(path, name), os.X_OK)
+		for path in os.environ.get("PATH", "").split(os.pathsep))
+
+def compile_objects(directory, sources, flags=[]):
+	"""Compiles {name: C source} into object files, returns their paths sorted by name."""
+	objects = []
+	for name, source in sorted(sources.items()):
+		source_path = os.path.join(directory, name + ".c")
+		object_path = os.path.join(directory, name + ".o")
+		with open(source_path, "w") as f:
+			f.write(source)
+		subprocess.check_call(["cc", "-c"] + flags + ["-o", object_path, source_path])
+		objects.append(object_path)
+	return objects
+
 class ReachableVertexesTestCase(unittest.TestCase):
 	def test_simple_graph(self):
 		builder = DirectedGraph.Builder()
@@ -48,6 +76,818 @@ class ReachableVertexesTestCase(unittest.TestCase):
 		self.assertEqual(g.reachable_vertexes("d"),
 			{"b": PathItem("b", "d", 1, set(["d->b"])), "c": PathItem("c", "b", 2, set(["b->c"])),})
 
+	def test_shortest_distance(self):
+		# a -> b -> c -> d
+		#  \_________^
+		builder = DirectedGraph.Builder()
+		builder.add_edge_with_label("a", "b", "a->b")
+		builder.add_edge_with_label("b", "c", "b->c")
+		builder.add_edge_with_label("c", "d", "c->d")
+		builder.add_edge_with_label("a", "c", "a->c")
+		g = builder.build_graph()
+		self.assertEqual(g.reachable_vertexes("a"),
+			{"b": PathItem("b", "a", 1, set(["a->b"])), "c": PathItem("c", "a", 1, set(["a->c"])),
+			"d": PathItem("d", "c", 2, set(["c->d"]))})
+
+	def test_deep_chain(self):
+		builder = DirectedGraph.Builder()
+		depth = 5 * sys.getrecursionlimit()
+		for i in range(depth):
+			builder.add_edge_with_label(i, i + 1, "label")
+		g = builder.build_graph()
+		reachable = g.reachable_vertexes(0)
+		self.assertEqual(len(reachable), depth)
+		self.assertEqual(reachable[depth].distance, depth)
+		self.assertEqual(reachable[depth].prev_vertex, depth - 1)
+		path = reachable[depth].path_from_root(reachable)
+		self.assertEqual([path_item.vertex for path_item in path], range(1, depth + 1))
+
+def cycle_graph():
+	# a -> b -> c    e -> e
+	#      ^\ /_
+	#        d
+	builder = DirectedGraph.Builder()
+	builder.add_edge_with_label("a", "b", "a->b")
+	builder.add_edge_with_label("b", "c", "b->c")
+	builder.add_edge_with_label("c", "d", "c->d")
+	builder.add_edge_with_label("d", "b", "d->b")
+	builder.add_edge_with_label("e", "e", "e->e")
+	return builder.build_graph()
+
+def random_graph(vertex_count, edge_count, seed):
+	rng = random.Random(seed)
+	builder = DirectedGraph.Builder()
+	for vertex in range(vertex_count):
+		builder.add_vertex(vertex)
+	for _ in range(edge_count):
+		builder.add_edge_with_label(rng.randrange(vertex_count), rng.randrange(vertex_count), "label")
+	return builder.build_graph()
+
+class StronglyConnectedComponentsTestCase(unittest.TestCase):
+	def test_cycle(self):
+		components = cycle_graph().strongly_connected_components()
+		self.assertEqual(sorted(sorted(component) for component in components),
+			[["a"], ["b", "c", "d"], ["e"]])
+		# Reverse topological order.
+		self.assertTrue(components.index(["a"]) > components.index(sorted(components, key=len)[-1]))
+
+	def test_deep_chain(self):
+		builder = DirectedGraph.Builder()
+		depth = 5 * sys.getrecursionlimit()
+		for i in range(depth):
+			builder.add_edge_with_label(i, i + 1, "label")
+		builder.add_edge_with_label(depth, 0, "label")
+		components = builder.build_graph().strongly_connected_components()
+		self.assertEqual(len(components), 1)
+		self.assertEqual(len(components[0]), depth + 1)
+
+	def test_back_edges_break_cycles(self):
+		for seed in range(5):
+			g = random_graph(30, 60, seed)
+			vertexes = g.vertexes()
+			back_edges = set(g.back_edges(vertexes))
+			builder = DirectedGraph.Builder()
+			for from_vertex in vertexes:
+				builder.add_vertex(from_vertex)
+				for to_vertex in g._destinations(from_vertex):
+					if (from_vertex, to_vertex) not in back_edges:
+						builder.add_edge_with_label(from_vertex, to_vertex, "label")
+			acyclic = builder.build_graph()
+			self.assertTrue(all(len(c) == 1 for c in acyclic.strongly_connected_components()))
+			self.assertTrue(all(from_vertex not in acyclic.reachable_vertexes(from_vertex)
+				for from_vertex in vertexes))
+
+class CycleReportTestCase(unittest.TestCase):
+	def setUp(self):
+		# a -> b -> c -> d    e <-> f
+		#      ^\_______/     |
+		#                     v
+		#                     g
+		builder = DirectedGraph.Builder()
+		builder.add_edge_with_label("a", "b", "B")
+		builder.add_edge_with_label("b", "c", "C")
+		builder.add_edge_with_label("c", "d", "D")
+		builder.add_edge_with_labels("d", "b", ["B", "B2"])
+		builder.add_edge_with_label("e", "f", "F")
+		builder.add_edge_with_label("f", "e", "E")
+		builder.add_edge_with_label("e", "g", "G")
+		builder.add_edge_with_label("a", "f", "F")
+		self.dependencies = Dependencies.from_graph(builder.build_graph())
+
+	def test_ranked_cycles(self):
+		cycles = self.dependencies.strong_connected_components()
+		self.assertEqual([(c.name(), c.files()) for c in cycles],
+			[("cycle_1", ["b", "c", "d"]), ("cycle_2", ["e", "f"])])
+		self.assertEqual(cycles[0].size(), 3)
+		self.assertEqual([(f, t) for f, t, _ in cycles[0].edges()], [("b", "c"), ("c", "d"), ("d", "b")])
+		self.assertEqual(cycles[0].closing_edges(), [("d", "b", set(["B", "B2"]))])
+		self.assertEqual(cycles[1].closing_edges(), [("f", "e", set(["E"]))])
+
+	def test_condensed_graph(self):
+		builder = DirectedGraph.Builder()
+		builder.add_edge_with_label("a", "cycle_1", "B")
+		builder.add_edge_with_label("a", "cycle_2", "F")
+		builder.add_edge_with_label("cycle_2", "g", "G")
+		self.assertEqual(self.dependencies.condensed_graph(), builder.build_graph())
+		stream = StringIO.StringIO()
+		self.dependencies.dump(stream, condensed=True)
+		self.assertTrue("    cycle_2 -> g;\n" in stream.getvalue())
+
+class TransitiveClosureTestCase(unittest.TestCase):
+	def test_cycle(self):
+		g = cycle_graph()
+		closure = TransitiveClosure(g)
+		self.assertEqual(closure.reachable_set("a"), frozenset(["b", "c", "d"]))
+		self.assertEqual(closure.reachable_set("c"), frozenset(["b", "d"]))
+		self.assertEqual(closure.reachable_set("e"), frozenset())
+		self.assertEqual(closure.reachable_count("b"), 2)
+		reversed_closure = TransitiveClosure(g, reverse=True)
+		self.assertEqual(reversed_closure.reachable_set("b"), frozenset(["a", "c", "d"]))
+		self.assertEqual(reversed_closure.reachable_set("a"), frozenset())
+
+	def test_matches_reachable_vertexes(self):
+		for seed in range(5):
+			g = random_graph(60, 90, seed)
+			closure = TransitiveClosure(g)
+			reversed_closure = TransitiveClosure(g, reverse=True)
+			reversed_g = g.reversed_graph()
+			for vertex in g.vertexes():
+				reachable = g.reachable_vertexes(vertex)
+				self.assertEqual(closure.reachable_set(vertex), frozenset(reachable.keys()))
+				self.assertEqual(closure.reachable_count(vertex), len(reachable))
+				self.assertEqual(reversed_closure.reachable_set(vertex),
+					frozenset(reversed_g.reachable_vertexes(vertex).keys()))
+
+	def test_bitsets_longer_than_a_word(self):
+		g = random_graph(200, 260, 3)
+		closure = TransitiveClosure(g)
+		for vertex in g.vertexes():
+			self.assertEqual(closure.reachable_set(vertex), frozenset(g.reachable_vertexes(vertex).keys()))
+
+class ReachabilityTableTestCase(unittest.TestCase):
+	def test_matches_reachable_vertexes(self):
+		builder = random_labelled_builder(40, 80, 2)
+		for compact in [False, True]:
+			g = builder.build_graph(compact)
+			for vertex in g.vertexes():
+				expected = g.reachable_vertexes(vertex)
+				table = g.reachability_table(vertex)
+				self.assertEqual(table, expected)
+				self.assertEqual(len(table), len(expected))
+				self.assertEqual(sorted(table.keys()), sorted(expected.keys()))
+				self.assertEqual(table.max_distance(), max([p.distance for p in expected.values()] + [0]))
+				self.assertFalse(vertex in table)
+				self.assertRaises(KeyError, table.__getitem__, vertex)
+
+	def test_cycle(self):
+		table = cycle_graph().reachability_table("c")
+		self.assertEqual(table["b"], PathItem("b", "d", 2, set(["d->b"])))
+		self.assertEqual(table.distance("d"), 1)
+		self.assertEqual(table["b"].path_from_root(table), [table["d"], table["b"]])
+
+	def test_all_reachability_tables(self):
+		builder = random_labelled_builder(40, 80, 3)
+		for compact in [False, True]:
+			g = builder.build_graph(compact)
+			reversed_g = g.reversed_graph()
+			for jobs in [1, 3]:
+				tables, reversed_tables = all_reachability_tables([g, reversed_g], jobs, chunk_size=7)
+				self.assertEqual(sorted(tables.keys()), sorted(g.vertexes()))
+				for vertex in g.vertexes():
+					self.assertEqual(tables[vertex], g.reachable_vertexes(vertex))
+					self.assertEqual(reversed_tables[vertex], reversed_g.reachable_vertexes(vertex))
+
+class PathItemTestCase(unittest.TestCase):
+	def test_compact(self):
+		path_item = PathItem("b", "a", 1, set(["a->b"]))
+		self.assertFalse(hasattr(path_item, "__dict__"))
+
+	def test_hash(self):
+		self.assertEqual(hash(PathItem("b", "a", 1, set(["x"]))), hash(PathItem("b", "a", 1, set(["x"]))))
+		self.assertNotEqual(hash(PathItem("a", "b", 1, set())), hash(PathItem("b", "a", 1, set())))
+		self.assertEqual(len(set([PathItem("b", "a", 1, frozenset()), PathItem("b", "a", 1, frozenset())])), 1)
+
+class DependencyReportTestCase(unittest.TestCase):
+	def test_lazy_dependencies(self):
+		calls = []
+		def required():
+			calls.append("required")
+			return {"b": PathItem("b", "a", 1, set(["a->b"]))}
+		report = DependencyReport("a", required, {}, 1, None)
+		self.assertEqual(report.required_dependencies_count(), 1)
+		self.assertEqual(report.provided_dependencies_count(), 0)
+		self.assertEqual(calls, [])
+		self.assertEqual(report.longest_required_distance(), 1)
+		self.assertEqual(calls, ["required"])
+		# Report doesn't keep loaded dependencies, the loader's cache does.
+		self.assertEqual(report.required_dependencies().keys(), ["b"])
+		self.assertEqual(calls, ["required", "required"])
+
+	def test_print_layered_dependencies(self):
+		builder = DirectedGraph.Builder()
+		builder.add_edge_with_label("a", "b", "_b")
+		builder.add_edge_with_label("a", "c", "_c")
+		builder.add_edge_with_label("b", "d", "_d")
+		builder.add_edge_with_label("b", "e", "_e")
+		builder.add_edge_with_label("e", "f", "_f")
+		table = builder.build_graph().reachability_table("a")
+		report = DependencyReport("a", table, {})
+		expected = """a
+1
+    a ->
+        b [_b]
+        c [_c]
+2
+    b ->
+        d [_d]
+        e [_e]
+3
+    e ->
+        f [_f]
+"""
+		for dependencies in [table, table.values(), dict(table.items())]:
+			output = StringIO.StringIO()
+			report.print_layered_dependencies(dependencies, output)
+			self.assertEqual(output.getvalue(), expected)
+		self.assertEqual([(distance, sorted(p.vertex for p in layer)) for distance, layer in table.iter_layers()],
+			[(1, ["b", "c"]), (2, ["d", "e"]), (3, ["f"])])
+
+def random_labelled_builder(vertex_count, edge_count, seed):
+	rng = random.Random(seed)
+	builder = DirectedGraph.Builder()
+	for vertex in range(vertex_count):
+		builder.add_vertex("v%d" % vertex)
+	for _ in range(edge_count):
+		builder.add_edge_with_label("v%d" % rng.randrange(vertex_count), "v%d" % rng.randrange(vertex_count),
+			"_symbol%d" % rng.randrange(20))
+	return builder
+
+class CompactDirectedGraphTestCase(unittest.TestCase):
+	def setUp(self):
+		builder = random_labelled_builder(40, 80, 0)
+		self.graph = builder.build_graph()
+		self.compact_graph = builder.build_graph(compact=True)
+
+	def test_same_structure(self):
+		self.assertTrue(isinstance(self.compact_graph, CompactDirectedGraph))
+		self.assertEqual(self.compact_graph, self.graph)
+		self.assertEqual(self.compact_graph.vertexes(), self.graph.vertexes())
+
+	def test_reachable_vertexes(self):
+		for vertex in self.graph.vertexes():
+			expected = self.graph.reachable_vertexes(vertex)
+			actual = self.compact_graph.reachable_vertexes(vertex)
+			self.assertEqual(sorted(actual.keys()), sorted(expected.keys()))
+			for reachable_vertex, path_item in actual.iteritems():
+				self.assertEqual(path_item.distance, expected[reachable_vertex].distance)
+				self.assertTrue(path_item.edge_labels <= self.graph._destinations(path_item.prev_vertex)[reachable_vertex])
+
+	def test_subgraph_and_reversed_graph(self):
+		sub_vertexes = set("v%d" % i for i in range(0, 40, 3))
+		compact_subgraph = self.compact_graph.subgraph(sub_vertexes)
+		self.assertTrue(isinstance(compact_subgraph, CompactDirectedGraph))
+		self.assertEqual(compact_subgraph, self.graph.subgraph(sub_vertexes))
+		self.assertEqual(self.compact_graph.reversed_graph(), self.graph.reversed_graph())
+		self.assertEqual(self.compact_graph.reversed_graph().reversed_graph(), self.graph)
+
+	def test_closure(self):
+		closure = TransitiveClosure(self.graph)
+		compact_closure = TransitiveClosure(self.compact_graph)
+		for vertex in self.graph.vertexes():
+			self.assertEqual(compact_closure.reachable_set(vertex), closure.reachable_set(vertex))
+
+	def test_write_dot_file(self):
+		directory = tempfile.mkdtemp()
+		try:
+			filename = os.path.join(directory, "graph.dot")
+			self.graph.write_dot_file(filename, write_edge_labels=True)
+			with open(filename) as f:
+				expected = sorted(f.read().splitlines())
+			self.compact_graph.write_dot_file(filename, write_edge_labels=True)
+			with open(filename) as f:
+				actual = sorted(f.read().splitlines())
+		finally:
+			shutil.rmtree(directory)
+		self.assertEqual(actual, expected)
+
+class LRUCacheTestCase(unittest.TestCase):
+	def test_evicts_least_recently_used(self):
+		cache = LRUCache(2)
+		cache.put("a", 1)
+		cache.put("b", 2)
+		self.assertEqual(cache.get("a"), 1)
+		cache.put("c", 3)
+		self.assertFalse("b" in cache)
+		self.assertEqual(cache.get("a"), 1)
+		self.assertEqual(cache.get("c"), 3)
+		self.assertEqual(len(cache), 2)
+
+	def test_zero_capacity(self):
+		cache = LRUCache(0)
+		cache.put("a", 1)
+		self.assertEqual(cache.get("a"), None)
+
+class LazyDependenciesTestCase(unittest.TestCase):
+	def setUp(self):
+		# a -> b -> c -> <Undefined>
+		builder = DirectedGraph.Builder()
+		builder.add_edge_with_label("a", "b", "B")
+		builder.add_edge_with_label("b", "c", "C")
+		builder.add_edge_with_label("c", "<Undefined>", "X")
+		self.dependencies = Dependencies.from_graph(builder.build_graph(), report_cache_size=2)
+
+	def test_single_file_query_skips_closure(self):
+		self.assertEqual(self.dependencies.required_dependencies("path/to/b.o", verbose=False),
+			set(["c", "<Undefined>"]))
+		self.assertEqual(self.dependencies.provided_dependencies("c", verbose=False), set(["a", "b"]))
+		self.assertEqual(self.dependencies.required_dependencies("b", verbose=False, include_marked_files=False),
+			set(["c"]))
+		self.assertEqual(self.dependencies._dependency_dicts, [None, None])
+		self.assertEqual(len(self.dependencies._report_cache), 2)
+
+	def test_reports_match_single_file_queries(self):
+		for report in self.dependencies.all_dependencies():
+			self.assertEqual(report.required_dependencies(),
+				self.dependencies.required_dependencies(report.filename()))
+			self.assertEqual(report.provided_dependencies_count(),
+				len(self.dependencies.provided_dependencies(report.filename())))
+
+	def test_longest_dependency_chain_skips_closure(self):
+		reports = self.dependencies.longest_dependency_chain(2)
+		self.assertEqual(self.dependencies._dependency_dicts, [None, None])
+		self.assertEqual([(report.filename(), report.required_dependencies_count(), report.provided_dependencies_count())
+			for report in reports], [("a", 3, 0), ("b", 2, 1)])
+
+	def test_reports_keep_only_cached_dependencies(self):
+		reports = self.dependencies.all_dependencies()
+		self.assertEqual(dict((report.filename(), report.longest_required_distance()) for report in reports),
+			{"a": 3, "b": 2, "c": 1, "<Undefined>": 0})
+		self.assertEqual(len(self.dependencies._report_cache), 2)
+		self.assertTrue(all(callable(report._required_dependencies) for report in reports))
+
+	def test_parallel_reports(self):
+		lazy_reports = dict((report.filename(), report) for report in
+			Dependencies.from_graph(self.dependencies._dependency_graph).all_dependencies(False))
+		reports = self.dependencies.all_dependencies(include_marked_files=False, jobs=2)
+		self.assertEqual(sorted(report.filename() for report in reports), ["a", "b", "c"])
+		for report in reports:
+			lazy_report = lazy_reports[report.filename()]
+			self.assertEqual(report.required_dependencies(), lazy_report.required_dependencies())
+			self.assertEqual(report.provided_dependencies(), lazy_report.provided_dependencies())
+			self.assertEqual(report.required_dependencies_count(), lazy_report.required_dependencies_count())
+		self.assertEqual(len(self.dependencies._report_cache), 0)
+
+	def test_files_connections(self):
+		connections = self.dependencies.files_connections([("a", "c"), ("path/c.o", "b"), ("a", "a"), ("c", "a")])
+		self.assertEqual([[[p.vertex for p in path] for path in paths] for paths in connections],
+			[[["b", "c"]], [["c"]], [], [["b", "c"]]])
+		self.assertEqual(self.dependencies.files_connection("b", "c"), connections[1])
+
+	def test_marked_file_is_excluded(self):
+		self.assertRaises(KeyError, self.dependencies.required_dependencies, "<Undefined>",
+			include_marked_files=False)
+
+class TopFilesTestCase(unittest.TestCase):
+	def ranking(self, reports, criteria_method_name, count):
+		reports = sorted(reports, key=lambda r: (-getattr(r, criteria_method_name)(), r.filename()))
+		return [r.filename() for r in reports[:count]]
+
+	def test_matches_full_sort(self):
+		for seed in range(4):
+			builder = random_labelled_builder(50, 70, seed)
+			builder.add_edge_with_label("v0", "<Undefined>", "X")
+			dependencies = Dependencies.from_graph(builder.build_graph())
+			for include_marked_files in [True, False]:
+				reports = Dependencies.from_graph(dependencies._dependency_graph)._all_dependencies_dict(
+					include_marked_files).values()
+				for count in [1, 5, 60]:
+					self.assertEqual([r.filename() for r in dependencies.most_dependent_file(count, include_marked_files)],
+						self.ranking(reports, "required_dependencies_count", count))
+					self.assertEqual([r.filename() for r in dependencies.longest_dependency_chain(count, include_marked_files)],
+						self.ranking(reports, "longest_required_distance", count))
+					self.assertEqual([r.filename() for r in dependencies.most_used_file(count, include_marked_files)],
+						self.ranking(reports, "provided_dependencies_count", count))
+					independent_reports = [r for r in reports if r.required_dependencies_count() == 0]
+					self.assertEqual([r.filename() for r in dependencies.most_used_independent_file(count, include_marked_files)],
+						self.ranking(independent_reports, "provided_dependencies_count", count))
+
+	def test_marked_files_are_excluded(self):
+		builder = DirectedGraph.Builder()
+		builder.add_edge_with_label("a", "<Undefined>", "X")
+		builder.add_edge_with_label("b", "<Undefined>", "Y")
+		dependencies = Dependencies.from_graph(builder.build_graph())
+		self.assertEqual([r.filename() for r in dependencies.most_used_file(1, include_marked_files=True)], ["<Undefined>"])
+		self.assertEqual([r.filename() for r in dependencies.most_used_file(3)], ["a", "b"])
+
+	def test_distance_bounds(self):
+		for seed in range(4):
+			g = random_graph(40, 60, seed)
+			for vertex, bound in g.distance_bounds().iteritems():
+				self.assertTrue(g.reachability_table(vertex).max_distance() <= bound)
+		self.assertEqual(cycle_graph().distance_bounds(), {"a": 3, "b": 2, "c": 2, "d": 2, "e": 0})
+
+class ExportTestCase(unittest.TestCase):
+	def setUp(self):
+		self.directory = tempfile.mkdtemp()
+		builder = random_labelled_builder(30, 60, 1)
+		builder.add_vertex("isolated")
+		self.graph = builder.build_graph()
+
+	def tearDown(self):
+		shutil.rmtree(self.directory)
+
+	def test_dot_stream_matches_file(self):
+		filename = os.path.join(self.directory, "graph.dot")
+		self.graph.write_dot_file(filename, write_edge_labels=True)
+		stream = StringIO.StringIO()
+		self.graph.write_dot(stream, write_edge_labels=True)
+		with open(filename) as f:
+			self.assertEqual(stream.getvalue(), f.read())
+		self.assertTrue("    isolated;\n" in stream.getvalue())
+
+	def test_dot_gzip(self):
+		filename = os.path.join(self.directory, "graph.dot.gz")
+		self.graph.write_dot_file(filename)
+		stream = StringIO.StringIO()
+		self.graph.write_dot(stream)
+		with contextlib.closing(gzip.open(filename)) as f:
+			self.assertEqual(f.read(), stream.getvalue())
+
+	def test_dot_quotes_vertexes(self):
+		builder = DirectedGraph.Builder()
+		builder.add_edge_with_label("libx(a)", "<Undefined>", "X")
+		builder.add_edge_with_label("a#2", "node", "N")
+		builder.add_edge_with_label("plain_1", 'say "hi"', "H")
+		builder.add_vertex("libx(b)")
+		stream = StringIO.StringIO()
+		builder.build_graph().write_dot(stream)
+		lines = stream.getvalue().splitlines()
+		self.assertTrue('    "libx(a)" -> "<Undefined>";' in lines)
+		self.assertTrue('    "a#2" -> "node";' in lines)
+		self.assertTrue('    plain_1 -> "say \\"hi\\"";' in lines)
+		self.assertTrue('    "libx(b)";' in lines)
+
+	def test_edge_list_round_trip(self):
+		stream = StringIO.StringIO()
+		self.graph.write_edge_list(stream)
+		lines = stream.getvalue().splitlines()
+		self.assertEqual(DirectedGraph.read_edge_list(lines), self.graph)
+		self.assertEqual(DirectedGraph.read_edge_list(lines, compact=True), self.graph)
+
+	def test_dependencies_save_load(self):
+		dependencies = Dependencies.from_graph(self.graph)
+		dependencies._marked_files = frozenset(["v1", "<Undefined>"])
+		filename = os.path.join(self.directory, "dependencies.jsonl.gz")
+		dependencies.save(filename)
+		loaded = Dependencies.load(filename)
+		self.assertEqual(loaded._dependency_graph, self.graph)
+		self.assertEqual(loaded.marked_files(), dependencies.marked_files())
+		self.assertEqual(loaded.required_dependencies("v2", verbose=False, include_marked_files=False),
+			dependencies.required_dependencies("v2", verbose=False, include_marked_files=False))
+
+	def test_load_rejects_unknown_format(self):
+		self.assertRaises(ValueError, Dependencies.load, StringIO.StringIO('{"format": "dot"}\n'))
+
+class QueryServerTestCase(unittest.TestCase):
+	def setUp(self):
+		# a -> b -> c -> <Undefined>
+		builder = DirectedGraph.Builder()
+		builder.add_edge_with_label("a", "b", "B")
+		builder.add_edge_with_label("b", "c", "C")
+		builder.add_edge_with_label("c", "<Undefined>", "X")
+		self.dependencies = Dependencies.from_graph(builder.build_graph())
+		self.directory = tempfile.mkdtemp()
+		self.socket_path = os.path.join(self.directory, "dependencies.sock")
+		self.server = DependencyServer(self.socket_path, self.dependencies)
+		self.server_thread = threading.Thread(target=self.server.serve_forever)
+		self.server_thread.start()
+
+	def tearDown(self):
+		self.server.shutdown()
+		self.server_thread.join()
+		self.server.server_close()
+		shutil.rmtree(self.directory)
+
+	def test_queries(self):
+		self.assertEqual(query_server(self.socket_path, "required_dependencies", file="path/a.o", verbose=False),
+			["<Undefined>", "b", "c"])
+		self.assertEqual(query_server(self.socket_path, "provided_dependencies", file="c")[0],
+			{"vertex": "b", "prev_vertex": "c", "distance": 1, "edge_labels": ["C"]})
+		self.assertEqual([[item["vertex"] for item in path] for path in
+			query_server(self.socket_path, "files_connection", file1="a", file2="c")], [["b", "c"]])
+		self.assertEqual(len(query_server(self.socket_path, "files_connection", pairs=[["a", "c"], ["c", "a"]])), 2)
+		self.assertEqual([item["file"] for item in query_server(self.socket_path, "most_used_file", count=2)],
+			["c", "b"])
+		self.assertEqual(query_server(self.socket_path, "longest_dependency_chain", count=1)[0]["longest_distance"], 3)
+		self.assertTrue("digraph" in query_server(self.socket_path, "dump_subgraph", files=["a", "b"]))
+
+	def test_errors(self):
+		self.assertRaises(ValueError, query_server, self.socket_path, "no_such_method")
+		self.assertRaises(ValueError, query_server, self.socket_path, "required_dependencies", file="missing")
+		self.assertEqual(query_server(self.socket_path, "files"), ["<Undefined>", "a", "b", "c"])
+
+	def test_concurrent_clients_share_closure(self):
+		results = []
+		def query():
+			results.append(query_server(self.socket_path, "most_dependent_file", count=1))
+		threads = [threading.Thread(target=query) for _ in range(8)]
+		for thread in threads:
+			thread.start()
+		for thread in threads:
+			thread.join()
+		self.assertEqual(results, [[{"file": "a", "required_count": 3, "provided_count": 0}]] * 8)
+
+	def test_keeps_files_which_are_not_sockets(self):
+		path = os.path.join(self.directory, "precious.txt")
+		with open(path, "w") as f:
+			f.write("data")
+		self.assertRaises(ValueError, DependencyServer, path, self.dependencies)
+		self.assertTrue(os.path.isfile(path))
+
+	def test_mark_files(self):
+		marked_list = os.path.join(self.directory, "marked_files")
+		with open(marked_list, "w") as f:
+			f.write("path/c.o\n")
+		self.assertEqual(query_server(self.socket_path, "mark_files", link_file_list=marked_list),
+			["<Undefined>", "c"])
+		self.assertEqual([item["file"] for item in
+			query_server(self.socket_path, "most_used_file", count=1, include_marked_files=False)], ["b"])
+
+class ReadWriteLockTestCase(unittest.TestCase):
+	def test_readers_share_lock_and_writer_waits(self):
+		lock = dependency_viz._ReadWriteLock()
+		events = []
+		second_reader_entered = threading.Event()
+		def read():
+			with lock.reading():
+				second_reader_entered.set()
+		def write():
+			with lock.writing():
+				events.append("write")
+		with lock.reading():
+			reader = threading.Thread(target=read)
+			reader.start()
+			# Would deadlock if readers excluded each other.
+			self.assertTrue(second_reader_entered.wait(5))
+			reader.join()
+			writer = threading.Thread(target=write)
+			writer.start()
+			writer.join(0.1)
+			events.append("read done")
+		writer.join()
+		self.assertEqual(events, ["read done", "write"])
+
+class FakeSymbolsTestCase(unittest.TestCase):
+	"""Replaces object file reading with self.symbols {filename: (defined, undefined)}."""
+	def setUp(self):
+		self.directory = tempfile.mkdtemp()
+		self.link_file_list = os.path.join(self.directory, "link_file_list")
+		self.symbols = dict()
+		self.original_collect_global_symbols = dependency_viz.collect_global_symbols
+		def collect_global_symbols(filenames, *args):
+			return [(f,) + tuple(self.symbols[f]) for f in filenames]
+		dependency_viz.collect_global_symbols = collect_global_symbols
+
+	def tearDown(self):
+		dependency_viz.collect_global_symbols = self.original_collect_global_symbols
+		shutil.rmtree(self.directory)
+
+	def write_link_file_list(self, files):
+		with open(self.link_file_list, "w") as f:
+			f.write("\n".join(files) + "\n")
+
+	def build_dependencies(self, files, **kwargs):
+		self.write_link_file_list(files)
+		return Dependencies(self.link_file_list, **kwargs)
+
+class IncrementalUpdateTestCase(FakeSymbolsTestCase):
+	def setUp(self):
+		FakeSymbolsTestCase.setUp(self)
+		# a -> b -> c, d -> e, f -> <Undefined>
+		self.symbols.update({
+			"dir/a.o": (["_a"], ["_b"]),
+			"dir/b.o": (["_b"], ["_c"]),
+			"dir/c.o": (["_c"], []),
+			"dir/d.o": (["_d"], ["_e"]),
+			"dir/e.o": (["_e"], []),
+			"dir/f.o": (["_f"], ["_missing"]),
+		})
+		self.files = sorted(self.symbols.keys())
+
+	def assert_matches_rebuild(self, dependencies, files):
+		for compact_graph in [False, True]:
+			rebuilt = self.build_dependencies(files, compact_graph=compact_graph)
+			self.assertEqual(dependencies._dependency_graph, rebuilt._dependency_graph)
+
+	def test_change_resolves_symbols(self):
+		for compact_graph in [False, True]:
+			dependencies = self.build_dependencies(self.files, compact_graph=compact_graph)
+			self.symbols["dir/c.o"] = (["_c", "_missing"], ["_e"])
+			changed = dependencies.update(changed_files=["dir/c.o"])
+			self.assertEqual(changed, set(["c", "f", "<Undefined>"]))
+			self.assertFalse("<Undefined>" in dependencies.files())
+			self.assertEqual(dependencies.required_dependencies("a", verbose=False), set(["b", "c", "e"]))
+			self.assert_matches_rebuild(dependencies, self.files)
+			self.symbols["dir/c.o"] = (["_c"], [])
+
+	def test_undefined_references_and_compact_graph(self):
+		dependencies = self.build_dependencies(self.files, compact_graph=True)
+		self.assertEqual(dependencies._undefined_references, 1)
+		self.symbols["dir/e.o"] = (["_e"], ["_other_missing"])
+		dependencies.update(changed_files=["dir/e.o"])
+		self.assertEqual(dependencies._undefined_references, 2)
+		self.assertFalse(isinstance(dependencies._dependency_graph, CompactDirectedGraph))
+		dependencies.update(removed_files=["dir/e.o", "dir/f.o"])
+		self.assertEqual(dependencies._undefined_references, 1)
+		self.assertTrue("<Undefined>" in dependencies.files())
+		self.assert_matches_rebuild(dependencies, ["dir/a.o", "dir/b.o", "dir/c.o", "dir/d.o"])
+		self.symbols["dir/e.o"] = (["_e"], [])
+
+	def test_remove_and_add(self):
+		dependencies = self.build_dependencies(self.files)
+		dependencies.update(removed_files=["dir/e.o"])
+		self.assert_matches_rebuild(dependencies, [f for f in self.files if f != "dir/e.o"])
+		self.symbols["dir/g.o"] = (["_e"], ["_a"])
+		dependencies.update(added_files=["dir/g.o", "dir/e.o"])
+		self.assert_matches_rebuild(dependencies, [f for f in self.files if f != "dir/e.o"] + ["dir/g.o", "dir/e.o"])
+		self.assertEqual(dependencies.required_dependencies("d", verbose=False), set(["e"]))
+
+	def test_duplicate_definition_keeps_link_order(self):
+		self.symbols["dir/c2.o"] = (["_c"], [])
+		files = self.files + ["dir/c2.o"]
+		dependencies = self.build_dependencies(files)
+		self.assertEqual(dependencies.required_dependencies("b", verbose=False), set(["c2"]))
+		dependencies.update(changed_files=["dir/c.o"])
+		self.assertEqual(dependencies.required_dependencies("b", verbose=False), set(["c2"]))
+
+	def test_new_definition_resolves_by_link_order(self):
+		self.symbols.update({"dir/x.o": ([], ["_x"]), "dir/y.o": ([], []), "dir/z.o": (["_x"], [])})
+		files = ["dir/x.o", "dir/y.o", "dir/z.o"]
+		dependencies = self.build_dependencies(files)
+		self.symbols["dir/y.o"] = (["_x"], [])
+		dependencies.update(changed_files=["dir/y.o"])
+		self.assertEqual(dependencies.required_dependencies("x", verbose=False), set(["z"]))
+		self.assertEqual(dependencies.symbol_definitions("_x"), ["dir/y.o", "dir/z.o"])
+		self.assert_matches_rebuild(dependencies, files)
+
+	def test_watch_adds_files_in_link_order(self):
+		self.symbols.update({"dir/x.o": ([], ["_x"]), "dir/z.o": (["_x"], []), "dir/y.o": (["_x"], [])})
+		dependencies = self.build_dependencies(["dir/x.o", "dir/z.o"])
+		files = ["dir/x.o", "dir/y.o", "dir/z.o"]
+		self.write_link_file_list(files)
+		dependencies.watch(interval=0, iterations=1)
+		self.assertEqual(dependencies.symbol_definitions("_x"), ["dir/y.o", "dir/z.o"])
+		self.assert_matches_rebuild(dependencies, files)
+
+	def test_invalidates_only_affected_reports(self):
+		dependencies = self.build_dependencies(self.files)
+		self.assertEqual(dependencies.required_dependencies("a", verbose=False), set(["b", "c"]))
+		self.assertEqual(dependencies.required_dependencies("d", verbose=False), set(["e"]))
+		self.assertEqual(dependencies.provided_dependencies("b", verbose=False), set(["a"]))
+		self.symbols["dir/e.o"] = (["_e"], ["_f"])
+		dependencies.update(changed_files=["dir/e.o"])
+		cache = dependencies._report_cache
+		self.assertTrue((True, "a", True) in cache)
+		self.assertFalse((True, "d", True) in cache)
+		self.assertTrue((False, "b", True) in cache)
+		self.assertEqual(dependencies.required_dependencies("d", verbose=False), set(["e", "f", "<Undefined>"]))
+
+	def test_watch(self):
+		dependencies = self.build_dependencies(self.files)
+		self.symbols["dir/h.o"] = (["_h"], ["_a"])
+		self.write_link_file_list(self.files[1:] + ["dir/h.o"])
+		updates = []
+		dependencies.watch(interval=0, iterations=2,
+			callback=lambda *args: updates.append(args))
+		self.assertEqual(len(updates), 1)
+		changed_files, removed_files, added_files, changed_vertexes = updates[0]
+		self.assertEqual((changed_files, removed_files, added_files), ([], ["dir/a.o"], ["dir/h.o"]))
+		self.assertEqual(changed_vertexes, set(["a", "h"]))
+
+	def test_graph_without_symbols(self):
+		self.assertRaises(ValueError, Dependencies.from_graph(DirectedGraph({})).update, ["a.o"])
+
+class SymbolIndexTestCase(FakeSymbolsTestCase):
+	def setUp(self):
+		FakeSymbolsTestCase.setUp(self)
+		self.symbols.update({
+			"dir/a.o": (["_a"], ["_OBJC_CLASS_$_B", "_c", "_missing"]),
+			"dir/b.o": (["_OBJC_CLASS_$_B", "_OBJC_METACLASS_$_B"], ["_c"]),
+			"dir/c.o": (["_c"], []),
+			"lib/c.o": (["_c"], ["_missing", "_other_missing"]),
+		})
+		self.dependencies = self.build_dependencies(sorted(self.symbols.keys()))
+
+	def test_lookups(self):
+		self.assertEqual(self.dependencies.symbol_definitions("_c"), ["dir/c.o", "lib/c.o"])
+		self.assertEqual(self.dependencies.symbol_definitions("_none"), [])
+		self.assertEqual(self.dependencies.symbol_users("_c"), frozenset(["dir/a.o", "dir/b.o"]))
+		self.assertEqual(self.dependencies.duplicate_symbols(), {"_c": ["dir/c.o", "lib/c.o"]})
+		self.assertEqual(self.dependencies.unresolved_symbols(), {
+			"_missing": frozenset(["dir/a.o", "lib/c.o"]), "_other_missing": frozenset(["lib/c.o"])})
+		self.assertEqual(self.dependencies.dependency_symbols("dir/a.o", "b"), ["_OBJC_CLASS_$_B"])
+		self.assertEqual(self.dependencies.dependency_symbols("a", "<Undefined>"), ["_missing"])
+
+	def test_search(self):
+		self.assertEqual(self.dependencies.find_symbols("_OBJC_*"), ["_OBJC_CLASS_$_B", "_OBJC_METACLASS_$_B"])
+		self.assertEqual(self.dependencies.find_symbols("*missing"), ["_missing", "_other_missing"])
+		self.assertEqual(self.dependencies.find_symbols("_[ab]"), ["_a"])
+		self.assertEqual(self.dependencies.find_symbols("_c"), ["_c"])
+
+	def test_update(self):
+		self.symbols["lib/c.o"] = (["_missing"], [])
+		self.dependencies.update(changed_files=["lib/c.o"])
+		self.assertEqual(self.dependencies.duplicate_symbols(), {})
+		self.assertEqual(self.dependencies.unresolved_symbols(), {})
+		self.assertEqual(self.dependencies.find_symbols("*missing"), ["_missing"])
+		self.assertEqual(self.dependencies.symbol_definitions("_c"), ["dir/c.o"])
+
+	def test_graph_without_symbols(self):
+		self.assertRaises(ValueError, Dependencies.from_graph(DirectedGraph({})).find_symbols, "*")
+
+class UniqueVertexesTestCase(FakeSymbolsTestCase):
+	def setUp(self):
+		FakeSymbolsTestCase.setUp(self)
+		self.symbols.update({
+			"dir/a.o": (["_a"], ["_c", "_lib_c"]),
+			"dir/c.o": (["_c"], []),
+			"lib/c.o": (["_lib_c"], ["_missing"]),
+		})
+		self.files = sorted(self.symbols.keys())
+
+	def test_same_short_names_share_vertex_by_default(self):
+		dependencies = self.build_dependencies(self.files)
+		self.assertEqual(dependencies.files(), frozenset(["a", "c", "<Undefined>"]))
+
+	def test_unique_vertexes(self):
+		dependencies = self.build_dependencies(self.files, unique_vertexes=True)
+		self.assertEqual(dependencies.files(), frozenset(self.files + ["<Undefined>"]))
+		self.assertEqual(dependencies.required_dependencies("a", verbose=False),
+			set(["dir/c.o", "lib/c.o", "<Undefined>"]))
+		self.assertEqual(dependencies.provided_dependencies("lib/c.o", verbose=False), set(["dir/a.o"]))
+		self.assertRaises(KeyError, dependencies.required_dependencies, "c")
+		self.assertEqual(dependencies.dependency_symbols("a", "dir/c.o"), ["_c"])
+		output = StringIO.StringIO()
+		dependencies.dump(output)
+		self.assertTrue('"lib/c.o" [label="c"];' in output.getvalue())
+		self.assertTrue('"dir/a.o" -> "dir/c.o";' in output.getvalue())
+
+	def test_update_and_marked_files(self):
+		dependencies = self.build_dependencies(self.files, unique_vertexes=True)
+		self.assertEqual(dependencies.update(removed_files=["lib/c.o"]), set(["lib/c.o", "dir/a.o"]))
+		self.assertEqual(dependencies.required_dependencies("dir/a.o", verbose=False), set(["dir/c.o", "<Undefined>"]))
+		marked_list = os.path.join(self.directory, "marked_list")
+		with open(marked_list, "w") as f:
+			f.write("dir/c.o\n")
+		dependencies.mark_files(marked_list)
+		self.assertEqual(dependencies.marked_files(), frozenset(["dir/c.o", "<Undefined>"]))
+
+class InstrumentationTestCase(FakeSymbolsTestCase):
+	def setUp(self):
+		FakeSymbolsTestCase.setUp(self)
+		self.symbols.update({
+			"dir/a.o": (["_a"], ["_b", "_c"]),
+			"dir/b.o": (["_b"], ["_c"]),
+			"dir/c.o": (["_c"], ["_missing"]),
+		})
+
+	def test_stages_and_counters(self):
+		events = []
+		instrumentation = Instrumentation([events.append])
+		dependencies = self.build_dependencies(sorted(self.symbols.keys()), instrumentation=instrumentation)
+		dependencies.most_dependent_file()
+		output = StringIO.StringIO()
+		dependencies.dump(output)
+		summary = instrumentation.report()
+		self.assertEqual(sorted(summary["stages"].keys()),
+			["build_graph", "closure", "collect_symbols", "index_symbols", "write_dot"])
+		self.assertEqual(summary["counters"]["edges_added"], 4)
+		self.assertEqual(summary["counters"]["vertexes_closed"], 8)
+		self.assertEqual(summary["counters"]["bytes_written"], len(output.getvalue()))
+		self.assertEqual([e["stage"] for e in events if e["event"] == "stage_start"],
+			["collect_symbols", "index_symbols", "build_graph", "closure", "write_dot"])
+		self.assertEqual(events[-1]["event"], "summary")
+
+	def test_sinks(self):
+		json_output = StringIO.StringIO()
+		text_output = StringIO.StringIO()
+		instrumentation = Instrumentation([JSONSink(json_output), PrintSink(text_output)])
+		dependencies = self.build_dependencies(sorted(self.symbols.keys()), instrumentation=instrumentation)
+		dependencies.all_dependencies(jobs=2)
+		instrumentation.report()
+		events = [json.loads(line) for line in json_output.getvalue().splitlines()]
+		self.assertEqual(events[-1]["counters"]["vertexes_closed"], 8)
+		self.assertTrue("reachability_tables done in" in text_output.getvalue())
+
+	def test_disabled(self):
+		dependencies = self.build_dependencies(sorted(self.symbols.keys()))
+		self.assertTrue(dependencies._instrumentation is NO_INSTRUMENTATION)
+		output = StringIO.StringIO()
+		self.assertTrue(NO_INSTRUMENTATION.counting_writes(output) is output)
+		with NO_INSTRUMENTATION.stage("stage"):
+			NO_INSTRUMENTATION.count("counter")
+		self.assertEqual(NO_INSTRUMENTATION.report(), {"stages": {}, "counters": {}})
+
 class GraphStructure(unittest.TestCase):
 	def test_subgraph(self):
 		builder = DirectedGraph.Builder()
@@ -78,5 +918,350 @@ class GraphStructure(unittest.TestCase):
 		actual_reversed = g.reversed_graph()
 		self.assertEqual(actual_reversed, g)
 
+	def test_views_match_copies(self):
+		builder = random_labelled_builder(40, 80, 4)
+		for compact in [False, True]:
+			g = builder.build_graph(compact)
+			sub_vertexes = frozenset(sorted(g.vertexes())[::2] + ["missing"])
+			views = [(g.subgraph_view(sub_vertexes), g.subgraph(sub_vertexes)),
+				(g.reversed_view(), g.reversed_graph()),
+				(g.subgraph_view(sub_vertexes).reversed_view(), g.subgraph(sub_vertexes).reversed_graph()),
+				(g.reversed_view().subgraph_view(sub_vertexes), g.reversed_graph().subgraph(sub_vertexes))]
+			for view, copy in views:
+				self.assertEqual(view, copy)
+				self.assertEqual(view.vertexes(), copy.vertexes())
+				for vertex in copy.vertexes():
+					expected = copy.reachable_vertexes(vertex)
+					for reachable in [view.reachable_vertexes(vertex), view.reachability_table(vertex)]:
+						# Shortest paths may differ when there are several.
+						self.assertEqual(dict((v, p.distance) for v, p in reachable.items()),
+							dict((v, p.distance) for v, p in expected.items()))
+						for path_item in reachable.values():
+							self.assertEqual(path_item.edge_labels,
+								copy._destinations(path_item.prev_vertex)[path_item.vertex])
+				self.assertEqual(TransitiveClosure(view).reachable_set("v2"), TransitiveClosure(copy).reachable_set("v2"))
+				view_output = StringIO.StringIO()
+				view.write_dot(view_output, write_edge_labels=True)
+				copy_output = StringIO.StringIO()
+				copy.write_dot(copy_output, write_edge_labels=True)
+				self.assertEqual(sorted(view_output.getvalue().splitlines()), sorted(copy_output.getvalue().splitlines()))
+
+	def test_views_are_read_only(self):
+		g = cycle_graph()
+		self.assertTrue(g.reversed_view().reversed_view() is g)
+		self.assertEqual(g.subgraph_view(set(["a", "b", "c"])).subgraph_view(set(["b", "c", "e"])).vertexes(),
+			frozenset(["b", "c"]))
+		self.assertRaises(TypeError, g.subgraph_view(set(["a"]))._remove_vertex, "a")
+		self.assertRaises(KeyError, g.subgraph_view(set(["a", "b"]))._edge_labels_between, "b", "c")
+
+@unittest.skipUnless(has_executable("cc") and has_executable("nm"), "requires cc and nm")
+class SymbolExtractionTestCase(unittest.TestCase):
+	def setUp(self):
+		self.directory = tempfile.mkdtemp()
+		self.objects = compile_objects(self.directory, {
+			"a": "extern int b(void); int a(void) { return b(); }\n",
+			"b": "extern int c(void); int b(void) { return c(); }\n",
+			"c": "int c(void) { return 0; }\n",
+			"empty": "",
+		})
+		self.archive = os.path.join(self.directory, "libab.a")
+		subprocess.check_call(["ar", "rcs", self.archive] + self.objects[:2])
+
+	def tearDown(self):
+		shutil.rmtree(self.directory)
+
+	def test_batched_matches_serial(self):
+		files = self.objects + [self.archive] + self.objects[:1]
+		expected = [(f,) + global_symbols(f, use_nm=True) for f in files]
+		self.assertEqual(collect_global_symbols(files, use_nm=True), expected)
+		self.assertEqual(collect_global_symbols(files, jobs=1, batch_size=3, use_nm=True), expected)
+		self.assertEqual(collect_global_symbols(files, jobs=3, batch_size=2, use_nm=True), expected)
+		self.assertEqual(collect_global_symbols(files, jobs=4, batch_size=1, use_nm=True), expected)
+		self.assertEqual(collect_global_symbols(files, jobs=2, batch_size=2), expected)
+
+	def test_instrumentation_counts_files(self):
+		files = self.objects + [self.archive]
+		symbol_count = sum(len(defined) + len(undefined) for _, defined, undefined in collect_global_symbols(files))
+		for use_nm in [False, True]:
+			progress = []
+			instrumentation = Instrumentation(progress=lambda *args: progress.append(args))
+			collect_global_symbols(files, 2, 2, use_nm=use_nm, instrumentation=instrumentation)
+			self.assertEqual(instrumentation.counters["files_scanned"], len(files))
+			self.assertEqual(instrumentation.counters["symbols_parsed"], symbol_count)
+			self.assertEqual(progress[-1][1:], (len(files), len(files)))
+
+	def test_cached_matches_uncached(self):
+		files = self.objects + [self.archive]
+		expected = collect_global_symbols(files)
+		cache = SymbolCache(os.path.join(self.directory, "symbols.cache"))
+		self.assertEqual(collect_global_symbols(files, cache=cache), expected)
+		self.assertEqual(collect_global_symbols(files, cache=cache), expected)
+
+	def test_dependencies_evict_stale_cache_entries(self):
+		cache_filename = os.path.join(self.directory, "symbols.cache")
+		link_file_list = os.path.join(self.directory, "link_file_list")
+		with open(link_file_list, "w") as f:
+			f.write("\n".join(self.objects) + "\n")
+		dependencies = Dependencies(link_file_list, cache_filename=cache_filename, check_content=True)
+		self.assertEqual(SymbolCache(cache_filename).lookup(self.objects[0]), global_symbols(self.objects[0]))
+		dependencies.update(removed_files=[self.objects[0]], changed_files=[self.objects[1]])
+		cache = SymbolCache(cache_filename)
+		self.assertEqual(cache.lookup(self.objects[0]), None)
+		self.assertEqual([cache.lookup(f) for f in self.objects[1:]], [global_symbols(f) for f in self.objects[1:]])
+		with open(link_file_list, "w") as f:
+			f.write(self.objects[2] + "\n")
+		Dependencies(link_file_list, cache_filename=cache_filename)
+		self.assertEqual(SymbolCache(cache_filename).lookup(self.objects[1]), None)
+
+class LinkInputsTestCase(unittest.TestCase):
+	def setUp(self):
+		self.directory = tempfile.mkdtemp()
+
+	def tearDown(self):
+		shutil.rmtree(self.directory)
+
+	def write(self, name, text):
+		path = os.path.join(self.directory, name)
+		with open(path, "w") as f:
+			f.write(text)
+		return path
+
+	def test_link_file_list(self):
+		path = self.write("link_file_list", "dir/a.o\n\nlib/libb.a\n")
+		self.assertEqual(list(read_link_inputs(path)), ["dir/a.o", "lib/libb.a"])
+
+	def test_ld64_map(self):
+		path = self.write("app.map", """# Path: app
+# Arch: x86_64
+# Object files:
+[  0] linker synthesized
+[  1] /build/a.o
+[  2] /build/libfoo.a(bar.o)
+[  3] /usr/lib/libSystem.tbd
+# Sections:
+# Address	Size    	Segment	Section
+0x100000F50	0x00000020	__TEXT	__text
+# Symbols:
+# Address	Size    	File  Name
+0x100000F50	0x00000010	[  1] _main
+""")
+		self.assertEqual(list(read_link_inputs(path)), ["/build/a.o", "/build/libfoo.a(bar.o)"])
+
+	def test_gnu_ld_map(self):
+		path = self.write("app.map", """Archive member included to satisfy reference by file (symbol)
+
+libfoo.a(bar.o)               main.o (bar)
+/a/very/long/path/to/libfoo2.a(a_long_member_name.o)
+                              libfoo.a(bar.o) (baz)
+
+Discarded input sections
+
+ .note.GNU-stack
+                0x0000000000000000        0x0 main.o
+
+Linker script and memory map
+
+LOAD /usr/lib/crti.o
+LOAD main.o
+LOAD libfoo.a
+LOAD /a/very/long/path/to/libfoo2.a
+LOAD /usr/lib/libc.so
+LOAD libfoo.a
+""")
+		self.assertEqual(list(read_link_inputs(path)), ["/usr/lib/crti.o", "main.o", "libfoo.a(bar.o)",
+			"/a/very/long/path/to/libfoo2.a(a_long_member_name.o)"])
+
+	def test_lld_map(self):
+		path = self.write("app.map", """             VMA              LMA     Size Align Out     In      Symbol
+          2002c8           2002c8       1c     4 .text
+          2002c8           2002c8        c     4         /build/main.o:(.text)
+          2002c8           2002c8        0     1                 main
+          2002d4           2002d4        8     4         /build/libfoo.a(bar.o):(.text)
+          2002dc           2002dc        4     4         /build/main.o:(.text.startup)
+          2002e0           2002e0        8     1 .comment
+          2002e0           2002e0        8     1         <internal>:(.comment)
+""")
+		self.assertEqual(list(read_link_inputs(path)), ["/build/main.o", "/build/libfoo.a(bar.o)"])
+
+	def test_response_file(self):
+		library_directory = os.path.join(self.directory, "lib")
+		os.mkdir(library_directory)
+		library = self.write("lib/libfoo.a", "!<arch>\n")
+		file_list = self.write("file_list", "c.o\nd.o\n")
+		self.write("nested.rsp", "e.o\n")
+		path = self.write("link.rsp", """-o app.o a.o "dir with space/b.o" -L%s -lfoo -lmissing
+-filelist %s,objects @%s -Wl,-dead_strip main.c
+""" % (library_directory, file_list, os.path.join(self.directory, "nested.rsp")))
+		self.assertEqual(list(read_link_inputs(path)), ["a.o", "dir with space/b.o", library,
+			"objects/c.o", "objects/d.o", "e.o"])
+		self.assertEqual(list(read_link_inputs("@" + file_list)), ["c.o", "d.o"])
+
+	def test_response_file_library_directory_after_library(self):
+		os.mkdir(os.path.join(self.directory, "libs"))
+		library = self.write("libs/libx.a", "!<arch>\n")
+		path = self.write("link.rsp", "-lx -L %s a.o\n" % os.path.join(self.directory, "libs"))
+		self.assertEqual(list(read_link_inputs(path)), [library, "a.o"])
+
+@unittest.skipUnless(has_executable("cc") and has_executable("nm"), "requires cc and nm")
+class ArchiveIngestionTestCase(unittest.TestCase):
+	def setUp(self):
+		self.directory = tempfile.mkdtemp()
+		for name in ["dir1", "dir2"]:
+			os.mkdir(os.path.join(self.directory, name))
+		self.objects = compile_objects(self.directory, {
+			"a": "extern int util(void); int a(void) { return util(); }\n",
+			"dir1/util": "int util(void) { return 1; }\n",
+			"dir2/util": "extern int a(void); int util2(void) { return a(); }\n",
+		})
+		self.archive = os.path.join(self.directory, "libutil.a")
+		# Both members are named util.o.
+		subprocess.check_call(["ar", "q", self.archive] + self.objects, stderr=open(os.devnull, "w"))
+
+	def tearDown(self):
+		shutil.rmtree(self.directory)
+
+	def member_paths(self, symbols):
+		return [symbol[0] for symbol in symbols]
+
+	def test_members_match_nm(self):
+		symbols = list(archive_member_symbols(self.archive))
+		self.assertEqual(self.member_paths(symbols), [archive_member_path(self.archive, name)
+			for name in ["a.o", "util.o", "util.o#2"]])
+		self.assertEqual(symbols, list(archive_member_symbols(self.archive, use_nm=True)))
+		for (member_path, defined, undefined), object_path in zip(symbols, self.objects):
+			self.assertEqual((defined, undefined), global_symbols(object_path))
+		self.assertEqual(self.member_paths(archive_member_symbols(self.archive, members=set(["util.o"]))),
+			self.member_paths(symbols[1:]))
+
+	def test_cached_members(self):
+		expected = list(archive_member_symbols(self.archive))
+		cache = SymbolCache(os.path.join(self.directory, "symbols.cache"), check_content=True)
+		self.assertEqual(list(archive_member_symbols(self.archive, cache=cache)), expected)
+		self.assertEqual(cache.lookup(expected[1][0]), expected[1][1:])
+		self.assertEqual(list(archive_member_symbols(self.archive, cache=cache, use_nm=True)), expected)
+
+	def test_collect_link_input_symbols(self):
+		members = list(archive_member_symbols(self.archive))
+		member_input = archive_member_path(self.archive, "a.o")
+		inputs = [self.objects[0], self.archive, member_input]
+		self.assertEqual(collect_link_input_symbols(inputs, expand_archives=True),
+			[(self.objects[0], self.objects[0]) + global_symbols(self.objects[0])] +
+			[(self.archive,) + symbols for symbols in members] + [(member_input,) + members[0]])
+		self.assertEqual(collect_link_input_symbols(inputs)[1],
+			(self.archive, self.archive) + global_symbols(self.archive))
+		self.assertEqual(short_filename(members[2][0]), "libutil(util)")
+
+	def test_duplicate_member_names_listed_once_each(self):
+		members = list(archive_member_symbols(self.archive))
+		member_input = archive_member_path(self.archive, "util.o")
+		self.assertEqual(collect_link_input_symbols([member_input, self.objects[0], member_input]),
+			[(member_input,) + members[1], (self.objects[0], self.objects[0]) + global_symbols(self.objects[0]),
+			(member_input,) + members[2]])
+		self.assertEqual(collect_link_input_symbols([member_input]), [(member_input,) + members[1]])
+
+def nm_symbols(filename):
+	"""Returns [(symbol_type, symbol_name)] from `nm -g` output."""
+	result = []
+	for line in subprocess.check_output(["nm", "-g", filename]).splitlines():
+		parts = line.split()
+		if (len(parts) >= 2) and not line.endswith(":"):
+			result.append((parts[-2], parts[-1]))
+	return result
+
+@unittest.skipUnless(has_executable("cc") and has_executable("nm"), "requires cc and nm")
+class ObjectFileReaderTestCase(unittest.TestCase):
+	SOURCES = {
+		"kinds": """
+int common_var;
+int data_var = 1;
+int bss_var = 0;
+const int ro_var = 2;
+__attribute__((weak)) int weak_func(void) { return 0; }
+extern __attribute__((weak)) int weak_undefined(void);
+extern int undefined_func(void);
+static int local_func(void) { return 1; }
+int global_func(void) { return weak_undefined() + undefined_func() + local_func(); }
+""",
+		"empty": "",
+		"a_long_object_file_name_for_archive": "int long_name(void) { return 0; }\n",
+	}
+	ELF_SOURCES = {
+		"elf": """
+__attribute__((weak)) int weak_var = 3;
+__thread int tls_var = 1;
+__thread int tls_bss;
+static int local_func(void) { return 1; }
+int (*ifunc_resolver(void))(void) { return local_func; }
+int ifunc_func(void) __attribute__((ifunc("ifunc_resolver")));
+""",
+	}
+
+	def setUp(self):
+		self.directory = tempfile.mkdtemp()
+		sources = dict(ObjectFileReaderTestCase.SOURCES)
+		if sys.platform.startswith("linux"):
+			sources.update(ObjectFileReaderTestCase.ELF_SOURCES)
+		self.objects = compile_objects(self.directory, sources, ["-fcommon"])
+		self.archive = os.path.join(self.directory, "libkinds.a")
+		subprocess.check_call(["ar", "rc", self.archive] + self.objects)
+
+	def tearDown(self):
+		shutil.rmtree(self.directory)
+
+	def test_matches_nm(self):
+		for filename in self.objects + [self.archive]:
+			self.assertEqual(object_file_symbols(filename), nm_symbols(filename))
+			self.assertEqual(global_symbols(filename), global_symbols(filename, use_nm=True))
+
+	def test_unsupported_format(self):
+		text_filename = os.path.join(self.directory, "kinds.c")
+		self.assertRaises(UnsupportedObjectFile, object_file_symbols, text_filename)
+		empty_filename = os.path.join(self.directory, "empty_file.o")
+		open(empty_filename, "w").close()
+		self.assertRaises(UnsupportedObjectFile, object_file_symbols, empty_filename)
+
+class SymbolCacheTestCase(unittest.TestCase):
+	def setUp(self):
+		self.directory = tempfile.mkdtemp()
+		self.cache_filename = os.path.join(self.directory, "symbols.cache")
+		self.object_filename = os.path.join(self.directory, "a.o")
+		with open(self.object_filename, "w") as f:
+			f.write("object")
+
+	def tearDown(self):
+		shutil.rmtree(self.directory)
+
+	def test_round_trip(self):
+		cache = SymbolCache(self.cache_filename)
+		self.assertEqual(cache.lookup(self.object_filename), None)
+		cache.store(self.object_filename, ["_a"], ["_b", "_c"])
+		cache.save()
+		cache = SymbolCache(self.cache_filename)
+		self.assertEqual(cache.lookup(self.object_filename), (["_a"], ["_b", "_c"]))
+
+	def test_invalidated_by_size(self):
+		cache = SymbolCache(self.cache_filename)
+		cache.store(self.object_filename, ["_a"], [])
+		with open(self.object_filename, "w") as f:
+			f.write("changed object")
+		self.assertEqual(cache.lookup(self.object_filename), None)
+
+	def test_content_check_survives_touch(self):
+		cache = SymbolCache(self.cache_filename, check_content=True)
+		cache.store(self.object_filename, ["_a"], [])
+		stat = os.stat(self.object_filename)
+		os.utime(self.object_filename, (stat.st_atime, stat.st_mtime + 10))
+		self.assertEqual(cache.lookup(self.object_filename), (["_a"], []))
+		with open(self.object_filename, "w") as f:
+			f.write("OBJECT")
+		os.utime(self.object_filename, (stat.st_atime, stat.st_mtime + 20))
+		self.assertEqual(cache.lookup(self.object_filename), None)
+
+	def test_corrupted_cache_is_ignored(self):
+		with open(self.cache_filename, "wb") as f:
+			f.write("DVSC1\ngarbage")
+		cache = SymbolCache(self.cache_filename)
+		self.assertEqual(cache.lookup(self.object_filename), None)
+
 if __name__ == "__main__":
 	unittest.main()